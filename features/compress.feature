@@ -0,0 +1,128 @@
+Feature: Compress
+
+    Scenario: Resume an interrupted compression
+        Given a copy of the sample data
+        And a reference compression of the sample data
+        When compression is interrupted after 2 samples
+        And the compression is updated
+        Then 2 samples were compressed
+        And the outputs match the reference compression
+
+    Scenario: Update with an added sample
+        Given a copy of the sample data
+        And a reference compression of the sample data
+        When sample image_0000025 is removed
+        And the sample data is compressed
+        And sample image_0000025 is restored
+        And the compression is updated
+        Then 1 samples were compressed
+        And the outputs match the reference compression
+
+    Scenario: Update with a touched sample
+        Given a copy of the sample data
+        And a reference compression of the sample data
+        When the sample data is compressed
+        And the image for sample image_0000025 is touched
+        And the compression is updated
+        Then 1 samples were compressed
+        And the "output" metadata records were removed
+        And the outputs match the reference compression
+
+    Scenario: Update columnar metadata
+        Given a copy of the sample data
+        And the sample data is compressed to "reference" with "--metadata-format columnar"
+        When the sample data is compressed to "output" with "--metadata-format columnar"
+        And the image for sample image_0000025 is touched
+        And the sample data is compressed to "output" with "--metadata-format columnar --update"
+        Then 1 samples were compressed
+        And the "output" metadata records were removed
+        And the "output" outputs are identical to the "reference" outputs
+
+    Scenario: Update without changes
+        Given a copy of the sample data
+        And a reference compression of the sample data
+        When the sample data is compressed
+        And the compression is updated
+        Then 0 samples were compressed
+        And the outputs match the reference compression
+
+    Scenario: Compressed dataset indexing
+        Given a copy of the sample data
+        And a reference compression of the sample data
+        When the reference compression is opened
+        Then integer indices return one sample
+        And slices return views of the outputs
+        And index lists return samples in order
+        And an empty index list returns no samples
+        And boolean masks return the selected samples
+
+    Scenario: Compressed dataset batches
+        Given a copy of the sample data
+        And a reference compression of the sample data
+        When the reference compression is opened
+        Then batches of 3 contain every sample in order
+        And shuffled batches of 3 dropping the last contain 3 distinct samples in storage order
+        And shuffled batches with the same seed are repeatable
+
+    Scenario: Columnar metadata round trip
+        Given a copy of the sample data
+        And a reference compression of the sample data
+        And a columnar compression of the sample data
+        When the reference compression is opened
+        And the columnar compression is opened
+        Then the columnar metadata matches the reference metadata
+
+    Scenario: Sharded output
+        Given a copy of the sample data
+        And a reference compression of the sample data
+        When the sample data is compressed to "shards" with "--format shards --samples-per-shard 3"
+        Then the "shards" manifest lists shards of 3, 1 samples
+        And the "shards" samples match the reference compression
+
+    Scenario: Update sharded output
+        Given a copy of the sample data
+        And a reference compression of the sample data
+        When the sample data is compressed to "shards" with "--format shards --samples-per-shard 3"
+        And the image for sample image_0000025 is touched
+        And the sample data is compressed to "shards" with "--format shards --samples-per-shard 3 --update"
+        Then 3 samples were compressed
+        And the "shards" manifest lists shards of 1, 3 samples
+        And the "shards" samples match the reference compression
+
+    Scenario Outline: Image dtypes
+        Given a copy of the sample data
+        And the sample data is compressed to "reference" with "--image-dtype float32"
+        When the sample data is compressed to "converted" with "--image-dtype <dtype>"
+        Then the converted images are the <conversion> of the reference images
+
+        Examples:
+            | dtype   | conversion        |
+            | float32 | same              |
+            | float16 | float16 rounding  |
+            | uint8   | 8-bit sRGB coding |
+
+    Scenario Outline: Mask dtypes
+        Given a copy of the sample data
+        And the sample data is compressed to "reference" with "--mask all . first /0$ --mask-dtype float32"
+        When the sample data is compressed to "converted" with "--mask all . first /0$ --mask-dtype <dtype>"
+        Then the converted masks are the <conversion> of the reference masks
+
+        Examples:
+            | dtype   | conversion        |
+            | float32 | same              |
+            | float16 | float16 rounding  |
+            | uint8   | 8-bit coding      |
+            | bit     | packed threshold  |
+
+    Scenario Outline: Parallel compression
+        Given a copy of the sample data
+        And the sample data is compressed to "serial" with "<options> --jobs 1"
+        When the sample data is compressed to "parallel" with "<options> --jobs 2"
+        Then the "parallel" outputs are identical to the "serial" outputs
+
+        Examples:
+            | options                                                 |
+            | --mask all . first /0$                                  |
+            | --mask all . --image-dtype uint8 --mask-dtype bit       |
+            | --mask all . --metadata-format columnar                 |
+            | --mask all . --format shards --samples-per-shard 3      |
@@ -0,0 +1,241 @@
+Feature: Dataset
+
+    Scenario: Persistent sample index
+        Given a copy of the sample data
+        When the dataset is opened with an index
+        And the dataset is opened with an index again
+        Then the second open doesn't rescan any directories
+        And the second open doesn't rewrite the index
+        And both opens find the same samples
+
+    Scenario: Persistent sample index with a cached catalog
+        Given a copy of the sample data
+        When the dataset is opened with an index
+        And the catalog is cached
+        And the dataset is opened with an index again
+        Then the second open doesn't rescan any directories
+        And both opens find the same samples
+
+    Scenario: Persistent sample index with a sample added while it is saved
+        Given a copy of the sample data
+        When the dataset is opened with an index while a sample is added
+        And the dataset is opened with an index again
+        Then the second open finds the added sample
+
+    Scenario: Nested serial map
+        Given the sample data
+        When every sample is mapped serially with a function that maps the dataset
+        Then the outer map returns every sample path
+
+    Scenario: Map failures
+        Given the sample data
+        When every sample is mapped with a function that fails for sample 1
+        Then the map returns results for every sample except sample 1
+        And the map reports that sample 1 failed
+        And mapping with errors="raise" raises RuntimeError
+
+    Scenario: Indexed shard root
+        Given a shard containing the sample data
+        When the shard is opened with an index
+        Then the shard dataset contains every sample
+
+    Scenario: Catalog
+        Given the sample data
+        When the catalog is computed
+        Then the catalog matches the sample metadata
+
+    Scenario: Catalog of a view
+        Given the sample data
+        When the catalog is computed
+        Then the catalog of a view matches the view's sample metadata
+
+    Scenario: Cached catalog reload
+        Given a copy of the sample data
+        When the catalog is computed and cached
+        And the catalog is reloaded from the cache
+        Then no sample metadata was read
+        And the reloaded catalog matches the sample metadata
+
+    Scenario: Cached catalog reload with a modified sample
+        Given a copy of the sample data
+        When the catalog is computed and cached
+        And sample image_0014 is given a new annotation
+        And the catalog is reloaded from the cache
+        Then only sample image_0014 was read
+        And the reloaded catalog matches the sample metadata
+
+    Scenario Outline: Dataset filter
+        Given the sample data
+        When the dataset is filtered by category "<category>", annotation "<annotation>", and license "<license>"
+        Then the filtered samples match
+
+        Examples:
+            | category | annotation   | license                                                   |
+            | 30B      | -            | -                                                         |
+            | 48;real  | -            | -                                                         |
+            | missing  | -            | -                                                         |
+            | -        | bbox         | -                                                         |
+            | -        | tag          | -                                                         |
+            | -        | contours;tag | -                                                         |
+            | 30B      | contours     | -                                                         |
+            | real     | bbox         | -                                                         |
+            | -        | -            | Some rights reserved, Attribution 2.0 Generic (CC BY 2.0) |
+            | 30B      | -            | Some rights reserved, Attribution 2.0 Generic (CC BY 2.0) |
+            | 48       | -            | Some rights reserved, Attribution 2.0 Generic (CC BY 2.0) |
+
+    Scenario: Dataset filter of a view
+        Given the sample data
+        When the dataset is filtered by category "30B", annotation "-", and license "-"
+        Then filtering a reversed view returns the same samples reversed
+
+    Scenario: Dataset filter errors
+        Given the sample data
+        Then filtering without criteria raises ValueError
+        And filtering with an unknown annotation type raises ValueError
+
+    Scenario: Inverted index
+        Given the sample data
+        Then the inverted index maps every category, license, and annotation type to its samples
+
+    Scenario Outline: Dataset indexing
+        Given the sample data
+        Then indexing the dataset with <first> then <second> matches indexing a list of its samples
+
+        Examples:
+            | first                        | second              |
+            | 2                            | -                   |
+            | -1                           | -                   |
+            | 1:3                          | -                   |
+            | ::-1                         | -                   |
+            | -2::-2                       | -                   |
+            | 3:1:-1                       | -                   |
+            | 5:10                         | -                   |
+            | [3, 0, 2]                    | -                   |
+            | [-1, 0]                      | -                   |
+            | []                           | -                   |
+            | [True, False, True, False]   | -                   |
+            | [False, False, False, False] | -                   |
+            | ::-1                         | 1:                  |
+            | ::-1                         | [0, 2]              |
+            | 1:                           | [2, 0]              |
+            | [3, 1, 0]                    | ::-1                |
+            | [3, 1, 0]                    | [True, False, True] |
+            | [3, 1, 0]                    | []                  |
+            | 1:                           | -1                  |
+            | []                           | []                  |
+
+    Scenario Outline: Dataset index errors
+        Given the sample data
+        Then indexing the dataset with <first> then <second> raises IndexError
+
+        Examples:
+            | first         | second        |
+            | 4             | -             |
+            | -5            | -             |
+            | [0, 4]        | -             |
+            | [True, False] | -             |
+            | 1:3           | 2             |
+            | ::-1          | [True, False] |
+
+    Scenario Outline: Cryptomatte mattes match imagecat
+        Given the sample data
+        Then the <selection> mattes of every Cryptomatte match imagecat's decoder
+
+        Examples:
+            | selection          |
+            | all                |
+            | first instance     |
+            | last two instances |
+            | missing instance   |
+            | empty              |
+
+    Scenario: Memoized mattes
+        Given a sample with a Cryptomatte
+        When the matte for the first instance is requested twice
+        Then the memo has 1 hits and 1 misses
+        And both requests return the same read-only matte
+        When the matte for every instance is requested
+        And the matte for the first instance is requested
+        Then the memo has 2 hits and 2 misses
+        When the memo budget is reduced to one matte
+        Then the memo contains 1 values within its budget
+        When the matte for every instance is requested
+        Then the memo has 2 hits and 3 misses
+        And the memo contains 1 values within its budget
+        When the matte for the first instance is requested
+        Then the memo has 2 hits and 4 misses
+        When the memo is cleared
+        Then the memo has 0 hits and 0 misses
+        And the memo contains 0 values within its budget
+
+    Scenario: Image cache round trip
+        Given a copy of the sample data
+        And an image cache
+        When an image is stored in the image cache
+        Then the cached image matches the original image
+        And the cached image isn't returned for a different variant
+        And the cached image isn't returned after the source file changes
+
+    Scenario: Samples with an image cache
+        Given a copy of the sample data
+        And an image cache
+        When every sample image is loaded with the image cache
+        And every sample image is loaded with the image cache again
+        Then the second load reads memory mapped images from the cache
+        And the cached sample images match the uncached sample images
+
+    Scenario: Image cache eviction
+        Given a copy of the sample data
+        And an image cache with room for one image
+        When two images are stored in the image cache
+        Then only the most recently stored image is cached
+        And the image cache is within its budget
+        When the image cache is cleared
+        Then the image cache is empty
+
+    Scenario Outline: Region of interest reads
+        Given the sample data
+        Then cropping every image to <roi> matches slicing the full image
+        And mattes for <roi> match slices of the full mattes
+
+        Examples:
+            | roi                   |
+            | 10, 20, 30, 40        |
+            | 0, 0, 1, 1            |
+            | -5, -7, 20, 30        |
+            | 100, 50, 10000, 10000 |
+
+    Scenario: Area resizing
+        Given a random 64x48 image
+        When the image is resized to 16x12 with the area filter
+        Then the resized image is the mean of each 4x4 block
+
+    Scenario Outline: Resizing preserves constant images
+        Given a constant <width>x<height> <dtype> image with <channels> channels
+        When the image is resized to <res> with the <filter> filter
+        Then the resized image is constant with the same dtype
+
+        Examples:
+            | width | height | dtype   | channels | res     | filter  |
+            | 64    | 48     | float32 | 3        | 16x12   | area    |
+            | 64    | 48     | float32 | 3        | 16x12   | cubic   |
+            | 64    | 48     | float32 | 3        | 16x12   | linear  |
+            | 64    | 48     | float32 | 3        | 16x12   | nearest |
+            | 50    | 30     | float16 | 1        | 224x224 | area    |
+            | 50    | 30     | float16 | 1        | 224x224 | cubic   |
+            | 50    | 30     | float16 | 1        | 224x224 | linear  |
+            | 50    | 30     | float16 | 1        | 224x224 | nearest |
+            | 37    | 29     | uint8   | 0        | 10x7    | area    |
+            | 37    | 29     | uint8   | 0        | 10x7    | cubic   |
+            | 37    | 29     | uint8   | 0        | 10x7    | linear  |
+            | 37    | 29     | uint8   | 0        | 10x7    | nearest |
+
+    Scenario Outline: Resizing several mattes at once
+        Given a sample with a Cryptomatte
+        Then resized mattes at 64x48 with the <filter> filter match resizing each matte
+
+        Examples:
+            | filter  |
+            | area    |
+            | cubic   |
+            | default |
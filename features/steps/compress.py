@@ -0,0 +1,355 @@
+# Copyright 2021 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+
+
+from behave import *
+
+import json
+import os
+import pickle
+import shutil
+import sys
+
+import numpy
+
+import limbo.cli.compress
+import limbo.data
+
+
+def _compress(context, prefix, *options, interrupt=None):
+    # Run limbo-compress in this process, counting the samples it compresses.
+    context.compressed = 0
+    compress_arrays = limbo.cli.compress._compress_arrays
+    def counting_compress(*args):
+        if interrupt is not None and context.compressed == interrupt:
+            raise KeyboardInterrupt()
+        context.compressed += 1
+        return compress_arrays(*args)
+
+    argv = sys.argv
+    sys.argv = ["limbo-compress", "--images", "--metadata", "--image-size", "32", "32", "--flush-interval", "1", "--prefix", os.path.join(context.temp_dir.name, prefix)] + list(options) + ["--", context.data_dir]
+    limbo.cli.compress._compress_arrays = counting_compress
+    try:
+        limbo.cli.compress.main()
+    finally:
+        limbo.cli.compress._compress_arrays = compress_arrays
+        sys.argv = argv
+
+
+def _outputs(context, prefix):
+    # Return the image and metadata written for each sample, by sample name.
+    prefix = os.path.join(context.temp_dir.name, prefix)
+    paths = {}
+    with open(f"{prefix}-manifest.jsonl") as stream:
+        for line in stream:
+            record = json.loads(line)
+            if "slot" in record:
+                paths[record["slot"]] = os.path.basename(record["path"])
+    images = numpy.load(f"{prefix}-images.npy")
+    with open(f"{prefix}-metadata.pickle", "rb") as stream:
+        metadata = pickle.load(stream)
+    return {name: (images[slot], metadata[slot]) for slot, name in paths.items()}
+
+
+@given(u'a reference compression of the sample data')
+def step_impl(context):
+    _compress(context, "reference")
+
+
+@when(u'the sample data is compressed')
+def step_impl(context):
+    _compress(context, "output")
+
+
+@when(u'compression is interrupted after {count:d} samples')
+def step_impl(context, count):
+    try:
+        _compress(context, "output", interrupt=count)
+    except KeyboardInterrupt:
+        pass
+    else:
+        raise AssertionError("Compression should have been interrupted.")
+
+
+@when(u'the compression is updated')
+def step_impl(context):
+    _compress(context, "output", "--update")
+
+
+@when(u'sample {name} is removed')
+def step_impl(context, name):
+    os.rename(os.path.join(context.data_dir, f"{name}.json"), os.path.join(context.temp_dir.name, f"{name}.json"))
+
+
+@when(u'sample {name} is restored')
+def step_impl(context, name):
+    os.rename(os.path.join(context.temp_dir.name, f"{name}.json"), os.path.join(context.data_dir, f"{name}.json"))
+
+
+@when(u'the image for sample {name} is touched')
+def step_impl(context, name):
+    path = os.path.join(context.data_dir, f"{name}.png")
+    info = os.stat(path)
+    os.utime(path, ns=(info.st_atime_ns, info.st_mtime_ns + 10**9))
+
+
+@then(u'{count:d} samples were compressed')
+def step_impl(context, count):
+    if context.compressed != count:
+        raise AssertionError(f"Expected {count} samples to be compressed, got {context.compressed}.")
+
+
+@then(u'the "{prefix}" metadata records were removed')
+def step_impl(context, prefix):
+    if os.path.exists(os.path.join(context.temp_dir.name, f"{prefix}-metadata.records")):
+        raise AssertionError("Metadata records should be removed when the run finishes.")
+
+
+@then(u'the outputs match the reference compression')
+def step_impl(context):
+    reference = _outputs(context, "reference")
+    outputs = _outputs(context, "output")
+    if sorted(outputs) != sorted(reference):
+        raise AssertionError(f"Expected samples {sorted(reference)}, got {sorted(outputs)}.")
+    for name, (image, metadata) in reference.items():
+        if not numpy.array_equal(outputs[name][0], image):
+            raise AssertionError(f"Image for {name} doesn't match.")
+        if outputs[name][1] != metadata:
+            raise AssertionError(f"Metadata for {name} doesn't match.")
+
+
+def _shard_manifest(context, prefix):
+    with open(os.path.join(context.temp_dir.name, f"{prefix}-manifest.json")) as stream:
+        return json.load(stream)
+
+
+@then(u'the "{prefix}" manifest lists shards of {counts} samples')
+def step_impl(context, prefix, counts):
+    counts = [int(count) for count in counts.split(",")]
+    manifest = _shard_manifest(context, prefix)
+    if [shard["count"] for shard in manifest["shards"]] != counts or manifest["samples"] != sum(counts):
+        raise AssertionError(f"Expected shards of {counts} samples, got {manifest['shards']}.")
+    if [shard["start"] for shard in manifest["shards"]] != numpy.cumsum([0] + counts[:-1]).tolist():
+        raise AssertionError(f"Unexpected shard starts in {manifest['shards']}.")
+    if os.path.exists(os.path.join(context.temp_dir.name, f"{prefix}-manifest.jsonl")):
+        raise AssertionError("Shards should only have one manifest.")
+
+
+@then(u'the "{prefix}" samples match the reference compression')
+def step_impl(context, prefix):
+    reference = _outputs(context, "reference")
+    outputs = {}
+    for shard in _shard_manifest(context, prefix)["shards"]:
+        with numpy.load(os.path.join(context.temp_dir.name, shard["path"])) as arrays:
+            samples = json.loads(arrays["samples"].tobytes())
+            for position, sample in enumerate(samples):
+                outputs[os.path.basename(sample["path"])] = (arrays[f"images/{position:06d}"], json.loads(arrays[f"metadata/{position:06d}"].tobytes()))
+    if sorted(outputs) != sorted(reference):
+        raise AssertionError(f"Expected samples {sorted(reference)}, got {sorted(outputs)}.")
+    for name, (image, metadata) in reference.items():
+        if not numpy.array_equal(outputs[name][0], image):
+            raise AssertionError(f"Image for {name} doesn't match.")
+        if outputs[name][1] != metadata:
+            raise AssertionError(f"Metadata for {name} doesn't match.")
+
+
+def _assert_sample(context, result, index):
+    if not numpy.array_equal(result["images"], context.arrays[index]):
+        raise AssertionError(f"Images don't match sample {index}.")
+    if result["metadata"] != context.metadata[index]:
+        raise AssertionError(f"Metadata doesn't match sample {index}.")
+
+
+@given(u'a columnar compression of the sample data')
+def step_impl(context):
+    _compress(context, "columnar", "--metadata-format", "columnar")
+
+
+@when(u'the reference compression is opened')
+def step_impl(context):
+    prefix = os.path.join(context.temp_dir.name, "reference")
+    context.dataset = limbo.data.CompressedDataset(prefix)
+    context.arrays = numpy.load(f"{prefix}-images.npy")
+    with open(f"{prefix}-metadata.pickle", "rb") as stream:
+        context.metadata = pickle.load(stream)
+
+
+@when(u'the columnar compression is opened')
+def step_impl(context):
+    context.columnar = limbo.data.CompressedDataset(os.path.join(context.temp_dir.name, "columnar"))
+
+
+@then(u'integer indices return one sample')
+def step_impl(context):
+    if len(context.dataset) != len(context.arrays):
+        raise AssertionError(f"Expected {len(context.arrays)} samples, got {len(context.dataset)}.")
+    _assert_sample(context, context.dataset[0], 0)
+    _assert_sample(context, context.dataset[numpy.int64(-1)], len(context.arrays) - 1)
+    try:
+        context.dataset[len(context.arrays)]
+    except IndexError:
+        pass
+    else:
+        raise AssertionError("Expected IndexError.")
+
+
+@then(u'slices return views of the outputs')
+def step_impl(context):
+    result = context.dataset[1:3]
+    if not numpy.array_equal(result["images"], context.arrays[1:3]) or result["metadata"] != context.metadata[1:3]:
+        raise AssertionError("Slice doesn't match samples 1:3.")
+    if result["images"].flags.writeable:
+        raise AssertionError("Slices should be read-only.")
+
+
+@then(u'index lists return samples in order')
+def step_impl(context):
+    result = context.dataset[[2, 0]]
+    if not numpy.array_equal(result["images"], context.arrays[[2, 0]]) or result["metadata"] != [context.metadata[2], context.metadata[0]]:
+        raise AssertionError("Index list doesn't match samples [2, 0].")
+
+
+@then(u'an empty index list returns no samples')
+def step_impl(context):
+    result = context.dataset[[]]
+    if result["images"].shape != (0,) + context.arrays.shape[1:] or result["metadata"] != []:
+        raise AssertionError(f"Expected no samples, got {result['images'].shape}.")
+
+
+@then(u'boolean masks return the selected samples')
+def step_impl(context):
+    mask = numpy.arange(len(context.arrays)) % 2 == 1
+    result = context.dataset[mask]
+    if not numpy.array_equal(result["images"], context.arrays[mask]):
+        raise AssertionError("Mask doesn't match the odd samples.")
+    try:
+        context.dataset[mask[:-1]]
+    except IndexError:
+        pass
+    else:
+        raise AssertionError("Expected IndexError.")
+
+
+@then(u'batches of {size:d} contain every sample in order')
+def step_impl(context, size):
+    indices = []
+    for batch in context.dataset.batches(size):
+        if not numpy.array_equal(batch["images"], context.arrays[batch["indices"]]):
+            raise AssertionError(f"Batch {batch['indices']} doesn't match.")
+        indices += batch["indices"].tolist()
+    if indices != list(range(len(context.arrays))):
+        raise AssertionError(f"Expected every sample in order, got {indices}.")
+
+
+@then(u'shuffled batches of {size:d} dropping the last contain {count:d} distinct samples in storage order')
+def step_impl(context, size, count):
+    batches = [batch["indices"].copy() for batch in context.dataset.batches(size, shuffle=True, seed=1234, drop_last=True)]
+    indices = numpy.concatenate(batches)
+    if any(len(batch) != size for batch in batches):
+        raise AssertionError(f"Expected only full batches, got {batches}.")
+    if len(indices) != count or len(set(indices.tolist())) != count:
+        raise AssertionError(f"Expected {count} distinct samples, got {indices}.")
+    if any((numpy.diff(batch) < 0).any() for batch in batches):
+        raise AssertionError(f"Expected samples in storage order, got {batches}.")
+
+
+@then(u'shuffled batches with the same seed are repeatable')
+def step_impl(context):
+    first = [batch["indices"].tolist() for batch in context.dataset.batches(2, shuffle=True, seed=5)]
+    second = [batch["indices"].tolist() for batch in context.dataset.batches(2, shuffle=True, seed=5)]
+    if first != second:
+        raise AssertionError(f"Expected repeatable batches, got {first} and {second}.")
+
+
+@then(u'the columnar metadata matches the reference metadata')
+def step_impl(context):
+    for index, metadata in enumerate(context.metadata):
+        expected = {key: value for key, value in metadata.items() if key in ["annotations", "provenance"]}
+        result = context.columnar.metadata(index)
+        if result != expected:
+            raise AssertionError(f"Expected {expected} for sample {index}, got {result}.")
+
+
+def _srgb(data):
+    # Encode linear values as sRGB, independently of imagecat.
+    data = numpy.clip(data.astype(numpy.float64), 0, 1)
+    return numpy.where(data <= 0.0031308, data * 12.92, 1.055 * numpy.power(data, 1 / 2.4) - 0.055)
+
+
+def _load_output(context, prefix, output):
+    return numpy.load(os.path.join(context.temp_dir.name, f"{prefix}-{output}.npy"))
+
+
+# Expected value, dtype, and tolerance of each conversion, computed from float32 reference outputs.
+_conversions = {
+    "same": (lambda reference: reference, numpy.float32, 0),
+    "float16 rounding": (lambda reference: reference.astype(numpy.float16), numpy.float16, 0),
+    "8-bit sRGB coding": (lambda reference: _srgb(reference) * 255, numpy.uint8, 0.51),
+    "8-bit coding": (lambda reference: numpy.clip(reference, 0, 1) * 255, numpy.uint8, 0.5),
+    "packed threshold": (lambda reference: numpy.packbits(reference >= 0.5, axis=2), numpy.uint8, 0),
+    }
+
+
+def _assert_converted(data, reference, conversion):
+    convert, dtype, tolerance = _conversions[conversion]
+    expected = convert(reference)
+    if data.dtype != dtype or data.shape != expected.shape:
+        raise AssertionError(f"Expected {expected.shape} {numpy.dtype(dtype)}, got {data.shape} {data.dtype}.")
+    error = numpy.abs(data.astype(numpy.float64) - expected.astype(numpy.float64)).max(initial=0)
+    if error > tolerance:
+        raise AssertionError(f"Values differ by up to {error}.")
+
+
+@given(u'the sample data is compressed to "{prefix}" with "{options}"')
+@when(u'the sample data is compressed to "{prefix}" with "{options}"')
+def step_impl(context, prefix, options):
+    _compress(context, prefix, *options.split())
+
+
+@then(u'the converted images are the {conversion} of the reference images')
+def step_impl(context, conversion):
+    _assert_converted(_load_output(context, "converted", "images"), _load_output(context, "reference", "images"), conversion)
+
+
+@then(u'the converted masks are the {conversion} of the reference masks')
+def step_impl(context, conversion):
+    for name in ["all", "first"]:
+        reference = _load_output(context, "reference", f"masks-{name}")
+        if not reference.any():
+            raise AssertionError(f"The {name} masks are empty.")
+        _assert_converted(_load_output(context, "converted", f"masks-{name}"), reference, conversion)
+
+
+def _output_files(context, prefix):
+    # Return the files written for a prefix, by the part of the name after the prefix.
+    return {name[len(prefix):]: os.path.join(context.temp_dir.name, name) for name in os.listdir(context.temp_dir.name) if name.startswith(f"{prefix}-")}
+
+
+def _slot_paths(path):
+    with open(path) as stream:
+        return {record["slot"]: record["path"] for record in map(json.loads, stream) if "slot" in record}
+
+
+@then(u'the "{prefix}" outputs are identical to the "{reference}" outputs')
+def step_impl(context, prefix, reference):
+    outputs = _output_files(context, prefix)
+    references = _output_files(context, reference)
+    if sorted(outputs) != sorted(references):
+        raise AssertionError(f"Expected outputs {sorted(references)}, got {sorted(outputs)}.")
+    for name, path in references.items():
+        if name.endswith(".npy"):
+            expected, result = numpy.load(path), numpy.load(outputs[name])
+            if result.dtype != expected.dtype or not numpy.array_equal(result, expected, equal_nan=expected.dtype.kind == "f"):
+                raise AssertionError(f"Output {name} doesn't match.")
+        elif name.endswith(".npz"):
+            with numpy.load(path) as expected, numpy.load(outputs[name]) as result:
+                if sorted(result.files) != sorted(expected.files) or not all(numpy.array_equal(result[key], expected[key], equal_nan=expected[key].dtype.kind == "f") for key in expected.files):
+                    raise AssertionError(f"Output {name} doesn't match.")
+        elif name.endswith(".jsonl"):
+            if _slot_paths(outputs[name]) != _slot_paths(path):
+                raise AssertionError(f"Slots in {name} don't match.")
+        elif name.endswith(".pickle"):
+            with open(path, "rb") as expected, open(outputs[name], "rb") as result:
+                if pickle.load(result) != pickle.load(expected):
+                    raise AssertionError(f"Output {name} doesn't match.")
@@ -0,0 +1,761 @@
+# Copyright 2021 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+
+
+from behave import *
+
+import ast
+import json
+import os
+import shutil
+import tempfile
+
+import graphcat
+import imagecat
+import imagecat.operator.cryptomatte
+import numpy
+
+import limbo.data
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+data_dir = os.path.join(root_dir, "docs", "data")
+
+
+@given(u'a copy of the sample data')
+def step_impl(context):
+    context.temp_dir = tempfile.TemporaryDirectory()
+    context.add_cleanup(context.temp_dir.cleanup)
+    context.data_dir = os.path.join(context.temp_dir.name, "data")
+    shutil.copytree(data_dir, context.data_dir, ignore=shutil.ignore_patterns(".*"))
+
+
+def _index_stat(context):
+    info = os.stat(os.path.join(context.data_dir, limbo.data._index_filename))
+    return (info.st_ino, info.st_mtime_ns, info.st_size)
+
+
+def _open_counting_scans(context):
+    scans = []
+    scan_directory = limbo.data._scan_directory
+    def counting_scan(path, stat):
+        scans.append(path)
+        return scan_directory(path, stat)
+    limbo.data._scan_directory = counting_scan
+    try:
+        dataset = limbo.data.Dataset(context.data_dir, index=True)
+    finally:
+        limbo.data._scan_directory = scan_directory
+    return dataset, scans
+
+
+@when(u'the dataset is opened with an index')
+def step_impl(context):
+    context.first, context.first_scans = _open_counting_scans(context)
+    context.first_index = _index_stat(context)
+
+
+@when(u'the dataset is opened with an index again')
+def step_impl(context):
+    context.second, context.second_scans = _open_counting_scans(context)
+    context.second_index = _index_stat(context)
+
+
+@then(u'the second open doesn\'t rescan any directories')
+def step_impl(context):
+    if not context.first_scans:
+        raise AssertionError("The first open should scan the dataset.")
+    if context.second_scans:
+        raise AssertionError(f"Rescanned {context.second_scans}.")
+
+
+@then(u'the second open doesn\'t rewrite the index')
+def step_impl(context):
+    if context.first_index != context.second_index:
+        raise AssertionError("The index was rewritten.")
+
+
+@then(u'both opens find the same samples')
+def step_impl(context):
+    first = [sample.path for sample in context.first]
+    second = [sample.path for sample in context.second]
+    if not first or first != second:
+        raise AssertionError(f"Found {first} and {second}.")
+
+
+@when(u'the dataset is opened with an index while a sample is added')
+def step_impl(context):
+    # Add the sample while the index is being written, after the dataset root has been scanned.
+    json_dumps = limbo.data._json_dumps
+    def adding_dumps(data, indent=False):
+        shutil.copy(os.path.join(context.data_dir, "image_0014.json"), os.path.join(context.data_dir, "image_added.json"))
+        return json_dumps(data, indent)
+    limbo.data._json_dumps = adding_dumps
+    try:
+        context.first, context.first_scans = _open_counting_scans(context)
+    finally:
+        limbo.data._json_dumps = json_dumps
+
+
+@then(u'the second open finds the added sample')
+def step_impl(context):
+    names = [sample.name for sample in context.second]
+    if "image_added" not in names:
+        raise AssertionError(f"Found {names}.")
+    if "image_added" in [sample.name for sample in context.first]:
+        raise AssertionError("The first open shouldn't find the added sample.")
+
+
+@when(u'the catalog is cached')
+def step_impl(context):
+    context.first.catalog(cache=True)
+
+
+def _fail_for_sample_1(index, sample):
+    if index == 1:
+        raise ValueError("Bad sample.")
+    return index
+
+
+@given(u'the sample data')
+def step_impl(context):
+    context.dataset = limbo.data.Dataset(data_dir)
+
+
+@when(u'every sample is mapped serially with a function that maps the dataset')
+def step_impl(context):
+    def fn(sample):
+        list(context.dataset.map(lambda inner: inner.name, processes=1, progress=False))
+        context.dataset.catalog(processes=1)
+        return sample.path
+    context.results = list(context.dataset.map(fn, processes=1, progress=False))
+
+
+@then(u'the outer map returns every sample path')
+def step_impl(context):
+    expected = [sample.path for sample in context.dataset]
+    if context.results != expected:
+        raise AssertionError(f"Expected {expected}, got {context.results}.")
+
+
+@when(u'every sample is mapped with a function that fails for sample {index:d}')
+def step_impl(context, index):
+    context.failures = []
+    context.results = list(context.dataset.map(_fail_for_sample_1, processes=1, with_indices=True, progress=False, failures=context.failures))
+
+
+@then(u'the map returns results for every sample except sample 1')
+def step_impl(context):
+    if context.results != [index for index in range(len(context.dataset)) if index != 1]:
+        raise AssertionError(f"Got {context.results}.")
+
+
+@then(u'the map reports that sample 1 failed')
+def step_impl(context):
+    if [(index, path) for index, path, message in context.failures] != [(1, context.dataset[1].path)]:
+        raise AssertionError(f"Got {context.failures}.")
+
+
+@then(u'mapping with errors="raise" raises RuntimeError')
+def step_impl(context):
+    try:
+        list(context.dataset.map(_fail_for_sample_1, processes=1, with_indices=True, progress=False, errors="raise"))
+    except RuntimeError:
+        return
+    raise AssertionError("Expected RuntimeError.")
+
+
+@given(u'a shard containing the sample data')
+def step_impl(context):
+    context.temp_dir = tempfile.TemporaryDirectory()
+    context.add_cleanup(context.temp_dir.cleanup)
+    context.shard = os.path.join(context.temp_dir.name, "data.limbo.tar")
+    context.source = limbo.data.Dataset(data_dir)
+    with limbo.data.ShardWriter(context.shard) as writer:
+        for sample in context.source:
+            writer.add(sample)
+
+
+@when(u'the shard is opened with an index')
+def step_impl(context):
+    context.dataset = limbo.data.Dataset(context.shard, index=True)
+
+
+@then(u'the shard dataset contains every sample')
+def step_impl(context):
+    names = [sample.name for sample in context.dataset]
+    expected = [sample.name for sample in context.source]
+    if names != expected:
+        raise AssertionError(f"Expected {expected}, got {names}.")
+
+
+def _expected_catalog(dataset):
+    # Summarize each sample's metadata independently of limbo.data.Catalog.
+    rows = []
+    for sample in dataset:
+        with open(sample.path) as stream:
+            metadata = json.load(stream)
+        provenance = metadata.get("provenance")
+        annotations = [(annotation["category"], annotation.get("bbox"), len(annotation["contours"]) if "contours" in annotation else -1) for annotation in metadata.get("annotations", [])]
+        rows.append((
+            "image" in metadata,
+            "synthetic" in metadata,
+            "cryptomatte" in metadata.get("synthetic", {}),
+            provenance.get("license", "") if provenance is not None else None,
+            provenance.get("copyright", "") if provenance is not None else None,
+            metadata["image"].get("res") if "image" in metadata else None,
+            annotations,
+            ))
+    return rows
+
+
+def _catalog_rows(catalog):
+    # Convert a catalog back into per-sample rows.
+    def lookup(table, value):
+        return str(table[value]) if value >= 0 else None
+
+    rows = []
+    for index in range(len(catalog)):
+        annotations = []
+        for annotation in range(catalog.annotation_offsets[index], catalog.annotation_offsets[index + 1]):
+            bbox = catalog.annotation_bbox[annotation]
+            annotations.append((
+                str(catalog.categories[catalog.annotation_category[annotation]]),
+                None if numpy.isnan(bbox).any() else bbox.tolist(),
+                int(catalog.annotation_contours[annotation]),
+                ))
+        res = catalog.image_res[index].tolist()
+        rows.append((
+            bool(catalog.has_image[index]),
+            bool(catalog.has_synthetic[index]),
+            bool(catalog.has_cryptomatte[index]),
+            lookup(catalog.licenses, catalog.license[index]),
+            lookup(catalog.copyrights, catalog.copyright[index]),
+            res if res != [-1, -1] else None,
+            annotations,
+            ))
+    return rows
+
+
+def _assert_catalog(catalog, dataset):
+    expected = _expected_catalog(dataset)
+    rows = _catalog_rows(catalog)
+    if len(rows) != len(expected):
+        raise AssertionError(f"Expected {len(expected)} samples, got {len(rows)}.")
+    for index, (row, expected_row) in enumerate(zip(rows, expected)):
+        if row != expected_row:
+            raise AssertionError(f"Catalog row {index} doesn't match: {row} != {expected_row}.")
+
+
+def _load_counting_reads(context):
+    reads = []
+    catalog_row = limbo.data._sample_catalog_row
+    def counting_row(sample):
+        reads.append(sample.name)
+        return catalog_row(sample)
+    limbo.data._sample_catalog_row = counting_row
+    try:
+        context.dataset = limbo.data.Dataset(context.data_dir)
+        context.catalog = context.dataset.catalog(cache=True)
+    finally:
+        limbo.data._sample_catalog_row = catalog_row
+    return reads
+
+
+@when(u'the catalog is computed')
+def step_impl(context):
+    context.catalog = context.dataset.catalog()
+
+
+@then(u'the catalog matches the sample metadata')
+def step_impl(context):
+    _assert_catalog(context.catalog, context.dataset)
+
+
+@then(u'the catalog of a view matches the view\'s sample metadata')
+def step_impl(context):
+    view = context.dataset[[3, 0, 2]]
+    _assert_catalog(view.catalog(), view)
+    view = context.dataset[::-2]
+    _assert_catalog(view.catalog(), view)
+
+
+@when(u'the catalog is computed and cached')
+def step_impl(context):
+    context.reads = _load_counting_reads(context)
+
+
+@when(u'sample {name} is given a new annotation')
+def step_impl(context, name):
+    path = os.path.join(context.data_dir, f"{name}.json")
+    with open(path) as stream:
+        metadata = json.load(stream)
+    metadata["annotations"].append({"category": "new", "bbox": [1, 2, 3, 4], "bbox_mode": "XYWH_ABS"})
+    with open(path, "w") as stream:
+        json.dump(metadata, stream)
+
+
+@when(u'the catalog is reloaded from the cache')
+def step_impl(context):
+    context.reads = _load_counting_reads(context)
+
+
+@then(u'no sample metadata was read')
+def step_impl(context):
+    if context.reads:
+        raise AssertionError(f"Read {context.reads}.")
+
+
+@then(u'only sample {name} was read')
+def step_impl(context, name):
+    if context.reads != [name]:
+        raise AssertionError(f"Read {context.reads}.")
+
+
+@then(u'the reloaded catalog matches the sample metadata')
+def step_impl(context):
+    _assert_catalog(context.catalog, context.dataset)
+
+
+def _matches(metadata, category=None, license=None, annotation=None):
+    # Decide whether a sample matches filter criteria, independently of limbo.data.InvertedIndex.
+    def values(value):
+        return [value] if isinstance(value, str) else list(value)
+
+    def annotation_types(item):
+        types = [name for name in ["bbox", "contours"] if name in item]
+        return types or ["tag"]
+
+    items = metadata.get("annotations", [])
+    if category is not None:
+        items = [item for item in items if item["category"] in values(category)]
+    if annotation is not None:
+        items = [item for item in items if set(annotation_types(item)) & set(values(annotation))]
+    if (category is not None or annotation is not None) and not items:
+        return False
+    if license is not None and metadata.get("provenance", {}).get("license") not in values(license):
+        return False
+    return True
+
+
+@when(u'the dataset is filtered by category "{category}", annotation "{annotation}", and license "{license}"')
+def step_impl(context, category, annotation, license):
+    # "-" marks an unused criterion, and alternatives are separated by semicolons.
+    context.criteria = {name: value.split(";") for name, value in [("category", category), ("annotation", annotation), ("license", license)] if value != "-"}
+    context.filtered = context.dataset.filter(**context.criteria)
+
+
+@then(u'the filtered samples match')
+def step_impl(context):
+    expected = [sample.path for sample in context.dataset if _matches(sample.metadata, **context.criteria)]
+    paths = [sample.path for sample in context.filtered]
+    if paths != expected:
+        raise AssertionError(f"Expected {expected}, got {paths}.")
+
+
+@then(u'filtering a reversed view returns the same samples reversed')
+def step_impl(context):
+    paths = [sample.path for sample in context.dataset[::-1].filter(**context.criteria)]
+    expected = [sample.path for sample in context.filtered][::-1]
+    if paths != expected:
+        raise AssertionError(f"Expected {expected}, got {paths}.")
+
+
+@then(u'filtering without criteria raises ValueError')
+def step_impl(context):
+    try:
+        context.dataset.filter()
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Expected ValueError.")
+
+
+@then(u'filtering with an unknown annotation type raises ValueError')
+def step_impl(context):
+    try:
+        context.dataset.filter(annotation="polygon")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Expected ValueError.")
+
+
+@then(u'the inverted index maps every category, license, and annotation type to its samples')
+def step_impl(context):
+    index = context.dataset.inverted_index()
+    metadatas = [sample.metadata for sample in context.dataset]
+    for name, mapping, criterion in [("categories", index.categories, "category"), ("licenses", index.licenses, "license"), ("annotations", index.annotations, "annotation")]:
+        for value, indices in mapping.items():
+            expected = [i for i, metadata in enumerate(metadatas) if _matches(metadata, **{criterion: value})]
+            if indices.tolist() != expected:
+                raise AssertionError(f"{name}[{value!r}]: expected {expected}, got {indices.tolist()}.")
+    categories = sorted({item["category"] for metadata in metadatas for item in metadata.get("annotations", [])})
+    if sorted(index.categories) != categories:
+        raise AssertionError(f"Expected categories {categories}, got {sorted(index.categories)}.")
+
+
+def _parse_index(text):
+    # Parse a slice such as "::-1", or a Python literal such as "2" or "[True, False]".
+    if ":" in text:
+        return slice(*[int(value) if value else None for value in text.split(":")])
+    return ast.literal_eval(text)
+
+
+def _index_list(samples, index):
+    # Lists don't support index arrays or masks, so apply them by hand.
+    if not isinstance(index, list):
+        return samples[index]
+    if index and all(isinstance(value, bool) for value in index):
+        if len(index) != len(samples):
+            raise IndexError("Mask length doesn't match.")
+        return [sample for sample, value in zip(samples, index) if value]
+    return [samples[value] for value in index]
+
+
+def _index_dataset(dataset, first, second):
+    result = dataset[_parse_index(first)]
+    if second != "-":
+        result = result[_parse_index(second)]
+    return result
+
+
+@then(u'indexing the dataset with {first} then {second} matches indexing a list of its samples')
+def step_impl(context, first, second):
+    expected = _index_list([sample.path for sample in context.dataset], _parse_index(first))
+    if second != "-":
+        expected = _index_list(expected, _parse_index(second))
+    result = _index_dataset(context.dataset, first, second)
+    if isinstance(result, limbo.data.Sample):
+        if result.path != expected:
+            raise AssertionError(f"Expected {expected}, got {result.path}.")
+        return
+    result = [sample.path for sample in result]
+    if result != expected:
+        raise AssertionError(f"Expected {expected}, got {result}.")
+
+
+@then(u'indexing the dataset with {first} then {second} raises IndexError')
+def step_impl(context, first, second):
+    try:
+        _index_dataset(context.dataset, first, second)
+    except IndexError:
+        pass
+    else:
+        raise AssertionError("Expected IndexError.")
+
+
+def _imagecat_matte(path, instances):
+    # Decode a matte with imagecat's own Cryptomatte decoder.
+    graph = graphcat.StaticGraph()
+    imagecat.add_task(graph, "/load", imagecat.operator.load, path=path)
+    imagecat.add_task(graph, "/decode", imagecat.operator.cryptomatte.decoder, mattes=instances)
+    imagecat.add_links(graph, "/load", ("/decode", "image"))
+    return graph.output("/decode")
+
+
+@then(u'the {selection} mattes of every Cryptomatte match imagecat\'s decoder')
+def step_impl(context, selection):
+    count = 0
+    for sample in context.dataset:
+        if sample.synthetic is None or sample.synthetic.cryptomatte is None:
+            continue
+        cryptomatte = sample.synthetic.cryptomatte
+        instances = {
+            "all": list(cryptomatte.instances),
+            "first instance": cryptomatte.instances[:1],
+            "last two instances": cryptomatte.instances[-2:],
+            "missing instance": ["missing/0"],
+            "empty": [],
+            }[selection]
+        path = os.path.join(os.path.dirname(sample.path), sample.metadata["synthetic"]["cryptomatte"]["filename"])
+        expected = _imagecat_matte(path, instances).layers["M"].data
+        matte = cryptomatte.matte(None if selection == "all" else instances).layers["M"].data
+        if matte.shape != expected.shape or matte.dtype != expected.dtype:
+            raise AssertionError(f"{sample.name}: expected {expected.shape} {expected.dtype}, got {matte.shape} {matte.dtype}.")
+        if not numpy.array_equal(matte, expected):
+            raise AssertionError(f"{sample.name}: mattes differ by up to {numpy.abs(matte.astype(numpy.float64) - expected).max()}.")
+        count += 1
+    if not count:
+        raise AssertionError("No samples contain Cryptomattes.")
+
+
+@given(u'a sample with a Cryptomatte')
+def step_impl(context):
+    samples = [sample for sample in limbo.data.Dataset(data_dir) if sample.synthetic is not None and sample.synthetic.cryptomatte is not None]
+    context.sample = next(sample for sample in samples if len(sample.synthetic.cryptomatte.instances) > 1)
+    context.cryptomatte = context.sample.synthetic.cryptomatte
+
+
+@when(u'the matte for the first instance is requested twice')
+def step_impl(context):
+    context.mattes = [context.cryptomatte.matte(context.cryptomatte.instances[:1]) for i in range(2)]
+
+
+@when(u'the matte for the first instance is requested')
+def step_impl(context):
+    context.cryptomatte.matte(context.cryptomatte.instances[:1])
+
+
+@when(u'the matte for every instance is requested')
+def step_impl(context):
+    context.cryptomatte.matte()
+
+
+@then(u'the memo has {hits:d} hits and {misses:d} misses')
+def step_impl(context, hits, misses):
+    memo = context.sample.memo
+    if (memo.hits, memo.misses) != (hits, misses):
+        raise AssertionError(f"Expected {hits} hits and {misses} misses, got {memo.hits} and {memo.misses}.")
+
+
+@then(u'both requests return the same read-only matte')
+def step_impl(context):
+    first, second = context.mattes
+    if first is not second:
+        raise AssertionError("Expected the cached matte.")
+    try:
+        first.layers["M"].data[0, 0] = 1
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Cached mattes should be read-only.")
+
+
+@when(u'the memo budget is reduced to one matte')
+def step_impl(context):
+    context.sample.memo.maxbytes = context.mattes[0].layers["M"].data.nbytes
+
+
+@then(u'the memo contains {count:d} values within its budget')
+def step_impl(context, count):
+    memo = context.sample.memo
+    if len(memo) != count:
+        raise AssertionError(f"Expected {count} cached values, got {len(memo)}.")
+    if memo.nbytes > memo.maxbytes:
+        raise AssertionError(f"Cached values use {memo.nbytes} bytes, more than the {memo.maxbytes} byte budget.")
+
+
+@when(u'the memo is cleared')
+def step_impl(context):
+    context.sample.memo.clear()
+
+
+def _assert_images_equal(image, expected):
+    if list(image.layers) != list(expected.layers):
+        raise AssertionError(f"Expected layers {list(expected.layers)}, got {list(image.layers)}.")
+    for name, layer in expected.layers.items():
+        if image.layers[name].role != layer.role or not numpy.array_equal(image.layers[name].data, layer.data):
+            raise AssertionError(f"Layer {name} doesn't match.")
+
+
+def _image_samples(context):
+    return [sample for sample in limbo.data.Dataset(context.data_dir) if "image" in sample.metadata]
+
+
+def _image_path(sample):
+    return os.path.join(os.path.dirname(sample.path), sample.metadata["image"]["filename"])
+
+
+@given(u'an image cache')
+def step_impl(context):
+    context.cache = limbo.data.ImageCache(os.path.join(context.temp_dir.name, "cache"))
+
+
+@given(u'an image cache with room for one image')
+def step_impl(context):
+    image = _image_samples(context)[0].image
+    nbytes = sum(layer.data.nbytes for layer in image.layers.values())
+    context.cache = limbo.data.ImageCache(os.path.join(context.temp_dir.name, "cache"), maxbytes=int(nbytes * 1.5))
+
+
+@when(u'an image is stored in the image cache')
+def step_impl(context):
+    sample = _image_samples(context)[0]
+    context.path = _image_path(sample)
+    context.image = sample.image
+    context.cache.put(context.path, context.image)
+
+
+@then(u'the cached image matches the original image')
+def step_impl(context):
+    image = context.cache.get(context.path)
+    if image is None:
+        raise AssertionError("The image wasn't cached.")
+    _assert_images_equal(image, context.image)
+    if image.metadata != context.image.metadata:
+        raise AssertionError("The image metadata doesn't match.")
+
+
+@then(u'the cached image isn\'t returned for a different variant')
+def step_impl(context):
+    if context.cache.get(context.path, variant="other") is not None:
+        raise AssertionError("Expected a cache miss.")
+
+
+@then(u'the cached image isn\'t returned after the source file changes')
+def step_impl(context):
+    info = os.stat(context.path)
+    os.utime(context.path, ns=(info.st_atime_ns, info.st_mtime_ns + 10**9))
+    if context.cache.get(context.path) is not None:
+        raise AssertionError("Expected a cache miss.")
+
+
+@when(u'every sample image is loaded with the image cache')
+def step_impl(context):
+    dataset = limbo.data.Dataset(context.data_dir, image_cache=context.cache)
+    context.cached_images = [sample.image for sample in dataset if "image" in sample.metadata]
+
+
+@when(u'every sample image is loaded with the image cache again')
+def step_impl(context):
+    context.first_images = context.cached_images
+    dataset = limbo.data.Dataset(context.data_dir, image_cache=context.cache)
+    context.cached_images = [sample.image for sample in dataset if "image" in sample.metadata]
+
+
+@then(u'the second load reads memory mapped images from the cache')
+def step_impl(context):
+    for image in context.cached_images:
+        for name, layer in image.layers.items():
+            if not isinstance(layer.data, numpy.memmap):
+                raise AssertionError(f"Layer {name} wasn't loaded from the cache.")
+
+
+@then(u'the cached sample images match the uncached sample images')
+def step_impl(context):
+    images = [sample.image for sample in _image_samples(context)]
+    if len(images) != len(context.cached_images):
+        raise AssertionError(f"Expected {len(images)} images, got {len(context.cached_images)}.")
+    for image, first, cached in zip(images, context.first_images, context.cached_images):
+        _assert_images_equal(first, image)
+        _assert_images_equal(cached, image)
+
+
+@when(u'two images are stored in the image cache')
+def step_impl(context):
+    samples = _image_samples(context)[:2]
+    context.paths = [_image_path(sample) for sample in samples]
+    for sample, path in zip(samples, context.paths):
+        context.cache.put(path, sample.image)
+
+
+@then(u'only the most recently stored image is cached')
+def step_impl(context):
+    if context.cache.get(context.paths[0]) is not None:
+        raise AssertionError("The least recently stored image should have been evicted.")
+    if context.cache.get(context.paths[1]) is None:
+        raise AssertionError("The most recently stored image should be cached.")
+
+
+@then(u'the image cache is within its budget')
+def step_impl(context):
+    if not 0 < context.cache.nbytes <= context.cache.maxbytes:
+        raise AssertionError(f"The cache uses {context.cache.nbytes} bytes, with a budget of {context.cache.maxbytes}.")
+
+
+@when(u'the image cache is cleared')
+def step_impl(context):
+    context.cache.clear()
+
+
+@then(u'the image cache is empty')
+def step_impl(context):
+    if context.cache.nbytes or context.cache.get(context.paths[1]) is not None:
+        raise AssertionError("The cache should be empty.")
+
+
+def _parse_roi(text):
+    return tuple(int(value) for value in text.split(","))
+
+
+def _roi_slices(roi, shape):
+    # Clip a region of interest to the image bounds, independently of limbo.data.
+    x, y, width, height = roi
+    return slice(max(y, 0), min(y + height, shape[0])), slice(max(x, 0), min(x + width, shape[1]))
+
+
+def _assert_cropped(name, cropped, image, roi):
+    if list(cropped.layers) != list(image.layers):
+        raise AssertionError(f"{name}: expected layers {list(image.layers)}, got {list(cropped.layers)}.")
+    for layer_name, layer in image.layers.items():
+        expected = layer.data[_roi_slices(roi, layer.data.shape)]
+        data = cropped.layers[layer_name].data
+        if data.dtype != expected.dtype or not numpy.array_equal(data, expected):
+            raise AssertionError(f"{name} layer {layer_name}: expected {expected.shape} {expected.dtype}, got {data.shape} {data.dtype}.")
+
+
+@then(u'cropping every image to {roi} matches slicing the full image')
+def step_impl(context, roi):
+    roi = _parse_roi(roi)
+    for sample in context.dataset:
+        if "image" in sample.metadata:
+            _assert_cropped(f"{sample.name} image", sample.cropped_image(roi), sample.image, roi)
+        if sample.synthetic is not None:
+            _assert_cropped(f"{sample.name} synthetic image", sample.synthetic.cropped_image(roi), sample.synthetic.image, roi)
+            _assert_cropped(f"{sample.name} depth", sample.synthetic.cropped_depth(roi), sample.synthetic.depth, roi)
+
+
+@then(u'mattes for {roi} match slices of the full mattes')
+def step_impl(context, roi):
+    roi = _parse_roi(roi)
+    for sample in context.dataset:
+        if sample.synthetic is None or sample.synthetic.cryptomatte is None:
+            continue
+        cryptomatte = sample.synthetic.cryptomatte
+        for instances in [None, cryptomatte.instances[:1], cryptomatte.instances[-2:], []]:
+            _assert_cropped(f"{sample.name} matte {instances}", cryptomatte.matte(instances, roi=roi), cryptomatte.matte(instances), roi)
+
+
+def _parse_res(text):
+    return tuple(int(value) for value in text.split("x"))
+
+
+@given(u'a random {width:d}x{height:d} image')
+def step_impl(context, width, height):
+    context.data = numpy.random.default_rng(1234).random((height, width, 3))
+
+
+@given(u'a constant {width:d}x{height:d} {dtype} image with {channels:d} channels')
+def step_impl(context, width, height, dtype, channels):
+    context.value = 200 if dtype == "uint8" else 0.75
+    shape = (height, width, channels) if channels else (height, width)
+    context.data = numpy.full(shape, context.value, dtype=dtype)
+
+
+@when(u'the image is resized to {res} with the {filter} filter')
+def step_impl(context, res, filter):
+    context.res = _parse_res(res)
+    context.resized = limbo.data.Resizer(context.res, filter=filter)(context.data)
+
+
+@then(u'the resized image is the mean of each {width:d}x{height:d} block')
+def step_impl(context, width, height):
+    rows, columns, channels = context.data.shape
+    expected = context.data.reshape((rows // height, height, columns // width, width, channels)).mean(axis=(1, 3))
+    if not numpy.allclose(context.resized, expected, rtol=0, atol=1e-12):
+        raise AssertionError(f"Differs from the block mean by up to {numpy.abs(context.resized - expected).max()}.")
+
+
+@then(u'the resized image is constant with the same dtype')
+def step_impl(context):
+    shape = (context.res[1], context.res[0]) + context.data.shape[2:]
+    if context.resized.shape != shape or context.resized.dtype != context.data.dtype:
+        raise AssertionError(f"Expected {shape} {context.data.dtype}, got {context.resized.shape} {context.resized.dtype}.")
+    if not numpy.all(context.resized == context.value):
+        raise AssertionError(f"Expected {context.value}, got values from {context.resized.min()} to {context.resized.max()}.")
+
+
+@then(u'resized mattes at {res} with the {filter} filter match resizing each matte')
+def step_impl(context, res, filter):
+    res = _parse_res(res)
+    filter = None if filter == "default" else filter
+    cryptomatte = context.cryptomatte
+    groups = [cryptomatte.instances[:1], list(cryptomatte.instances), [], cryptomatte.instances[-2:], cryptomatte.instances[:1]]
+    mattes = cryptomatte.resized_mattes(groups, res, filter=filter)
+    if mattes.shape != (res[1], res[0], len(groups)):
+        raise AssertionError(f"Expected shape {(res[1], res[0], len(groups))}, got {mattes.shape}.")
+    for index, group in enumerate(groups):
+        expected = cryptomatte.resized_matte(group, res, filter=filter).layers["M"].data[:, :, 0]
+        if not numpy.array_equal(mattes[:, :, index], expected):
+            raise AssertionError(f"Matte {index} differs by up to {numpy.abs(mattes[:, :, index].astype(numpy.float64) - expected).max()}.")
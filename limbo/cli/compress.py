@@ -5,88 +5,599 @@
 """Implements the :ref:`limbo-compress` command."""
 
 import argparse
-import collections
-import copy
+import concurrent.futures
+import functools
+import io
+import itertools
+import json
+import logging
+import os
 import pickle
 import re
 
+import imagecat.color
 import limbo.data
 import numpy
-import tqdm
 
 
 def argument_parser():
     parser = argparse.ArgumentParser(description="Compress the contents of Limbo datasets for efficient loading.")
+    parser.add_argument("--category", nargs="+", help="Only compress samples with annotations in the given categories.  Default: all samples.")
     parser.add_argument("--end", type=int, help="Range of samples to extract. Default: all samples.")
+    parser.add_argument("--flush-interval", type=int, default=100, help="Number of samples processed between flushes to disk.  Default: %(default)s")
+    parser.add_argument("--format", choices=["npy", "shards"], default="npy", help="Output format.  npy writes one array per output.  shards writes .npz shards of up to --samples-per-shard samples each, listed in a {prefix}-manifest.json file that readers should use to locate samples: each shard entry gives the shard path, and the index and count of its first sample.  Every sample is compressed separately, as <output>/<position> members such as images/000000, with JSON metadata/<position> members or whole-shard metadata-* columnar arrays.  Default: %(default)s")
+    parser.add_argument("--image-cache", help="Directory used to cache decoded images between runs.  Default: no cache.")
+    parser.add_argument("--image-cache-size", type=float, default=10, help="Maximum image cache size in GiB.  Default: %(default)s")
+    parser.add_argument("--index", action="store_true", help="Use a persistent sample index in each dataset directory to speed startup.")
     parser.add_argument("--images", action="store_true", help="Generate image output.")
+    parser.add_argument("--image-dtype", choices=["float16", "float32", "uint8"], default="float16", help="Image output type.  uint8 images are sRGB encoded, others are linear.  Default: %(default)s")
     parser.add_argument("--image-size", type=int, nargs=2, default=(224, 224), help="Target image size. Default: %(default)s")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of samples to process in parallel.  Default: %(default)s")
     parser.add_argument("--mask", nargs="*", default=[], help="Name-pattern pairs of masks to extract. Default: no masks.")
+    parser.add_argument("--mask-dtype", choices=["bit", "float16", "float32", "uint8"], default="float32", help="Mask output type.  bit masks are thresholded at 0.5 and packed eight pixels per byte along the width.  Default: %(default)s")
     parser.add_argument("--metadata", action="store_true", help="Generate metadata output.")
+    parser.add_argument("--metadata-format", choices=["columnar", "pickle"], default="pickle", help="Metadata output format.  columnar writes a set of {prefix}-metadata-*.npy arrays that can be memory mapped.  Default: %(default)s")
     parser.add_argument("--prefix", default="compressed", help="Output file prefix. Default: %(default)s")
+    parser.add_argument("--resize-filter", choices=limbo.data.Resizer.filters, help="Resize images and masks using a fast, cached resampling filter.  Default: use imagecat's resize.")
+    parser.add_argument("--resume", "--update", action="store_true", help="Update existing outputs created with the same options, resuming an interrupted run.  Samples whose metadata and image files are unchanged since they were written are skipped, changed samples are rewritten, and new samples are appended.  With --format shards, shards with changed or removed samples are rewritten as new shards at the end of the manifest, and new samples are written to new shards, so repeated updates can leave many partly filled shards; rerun without --update to repack them.  The samples in npy outputs are recorded in {prefix}-manifest.jsonl, which must be kept with the outputs to update them.  While a run is in progress, metadata is also recorded in {prefix}-metadata.records, which is removed when the run finishes.")
+    parser.add_argument("--samples-per-shard", type=int, default=1000, help="Maximum number of samples stored in each shard with --format shards.  Default: %(default)s")
+    parser.add_argument("--stack-masks", action="store_true", help="Write all masks to a single {prefix}-masks.npy array with one channel per mask, in --mask order.")
     parser.add_argument("--start", type=int, help="Range of samples to extract. Default: all samples.")
     parser.add_argument("--strip-regions", action="store_true", help="Remove bounding-box and contour information from metadata output.")
     parser.add_argument("directory", nargs="+", help="Directory(ies) containing Limbo data.")
     return parser
 
 
+def _convert_image(data, dtype):
+    if dtype == "uint8":
+        data = imagecat.color.linear_to_srgb(numpy.clip(data.astype(numpy.float32), 0, 1))
+        return numpy.rint(data * 255).astype(numpy.uint8)
+    return data.astype(dtype)
+
+
+def _convert_mask(data, dtype):
+    if dtype == "bit":
+        return numpy.packbits(data >= 0.5, axis=1)
+    if dtype == "uint8":
+        return numpy.rint(numpy.clip(data, 0, 1) * 255).astype(numpy.uint8)
+    return data.astype(dtype)
+
+
+def _compress_arrays(arguments, mask_names, mask_patterns, sample):
+    arrays = {}
+    if arguments.images:
+        image = sample.resized_image(arguments.image_size, filter=arguments.resize_filter)
+        if "C" in image.layers:
+            image = image.layers["C"].data
+        elif "Y" in image.layers:
+            image = numpy.tile(image.layers["Y"].data, (1, 1, 3))
+        arrays["images"] = _convert_image(image, arguments.image_dtype)
+
+    if mask_names:
+        if sample.synthetic and sample.synthetic.cryptomatte:
+            cryptomatte = sample.synthetic.cryptomatte
+            groups = [[] for pattern in mask_patterns]
+            for instance in cryptomatte.instances:
+                for group, match in zip(groups, _match_instance(mask_patterns, instance)):
+                    if match:
+                        group.append(instance)
+            masks = cryptomatte.resized_mattes(groups, arguments.image_size, filter=arguments.resize_filter)
+        else:
+            masks = numpy.zeros((arguments.image_size[1], arguments.image_size[0], len(mask_names)), dtype=numpy.float32)
+        masks = _convert_mask(masks, arguments.mask_dtype)
+
+        if arguments.stack_masks:
+            arrays["masks"] = masks
+        else:
+            for index, name in enumerate(mask_names):
+                arrays[f"masks-{name}"] = masks[:, :, index:index + 1]
+
+    metadata = None
+    if arguments.metadata:
+        # Each sample parses its own metadata, so only modified fields need to be copied.
+        metadata = sample.metadata
+        if arguments.strip_regions:
+            categories = {annotation.get("category") for annotation in metadata.get("annotations", [])}
+            metadata = dict(metadata, annotations=[{"category":category} for category in categories])
+
+    return arrays, metadata
+
+
+@functools.lru_cache(maxsize=65536)
+def _match_instance(patterns, instance):
+    # Instance names repeat across samples, so remember which masks they belong to.
+    return tuple(pattern.search(instance) is not None for pattern in patterns)
+
+
+def _columnar_metadata(metadatas):
+    # Convert per-sample metadata to flat arrays.  Like limbo.data.Catalog,
+    # annotations are stored as ragged arrays with per-sample offsets, and
+    # strings as indices into sorted string tables, with -1 for missing values.
+    metadatas = [metadata if metadata is not None else {} for metadata in metadatas]
+    annotations = [annotation for metadata in metadatas for annotation in metadata.get("annotations", [])]
+    contours = [annotation.get("contours", []) for annotation in annotations]
+    vertices = [vertex for contour_list in contours for contour in contour_list for vertex in contour]
+
+    columns = {}
+    columns["categories"] = numpy.array(sorted({annotation["category"] for annotation in annotations}), dtype=str)
+    lookup = {category: index for index, category in enumerate(columns["categories"])}
+    columns["category"] = numpy.zeros((len(metadatas), len(lookup)), dtype=bool)
+    for index, metadata in enumerate(metadatas):
+        columns["category"][index, [lookup[annotation["category"]] for annotation in metadata.get("annotations", [])]] = True
+
+    for field, table in [("license", "licenses"), ("license-uri", "license-uris"), ("copyright", "copyrights"), ("uri", "uris")]:
+        values = [metadata.get("provenance", {}).get(field) for metadata in metadatas]
+        columns[table] = numpy.array(sorted({value for value in values if value is not None}), dtype=str)
+        strings = {value: index for index, value in enumerate(columns[table])}
+        columns[field] = numpy.array([strings.get(value, -1) for value in values], dtype=numpy.int32)
+
+    columns["annotation-offsets"] = numpy.concatenate(([0], numpy.cumsum([len(metadata.get("annotations", [])) for metadata in metadatas]))).astype(numpy.int64)
+    columns["annotation-category"] = numpy.array([lookup[annotation["category"]] for annotation in annotations], dtype=numpy.int32)
+    columns["annotation-bbox"] = numpy.array([annotation.get("bbox", [numpy.nan] * 4) for annotation in annotations], dtype=numpy.float64).reshape((-1, 4))
+    columns["annotation-bbox-integer"] = numpy.array([all(isinstance(value, int) and not isinstance(value, bool) for value in annotation.get("bbox", [0.0])) for annotation in annotations], dtype=bool)
+    for field, table, key in [("annotation-bbox-mode", "bbox-modes", "bbox_mode"), ("annotation-contour-mode", "contour-modes", "contour_mode")]:
+        values = [annotation.get(key) for annotation in annotations]
+        columns[table] = numpy.array(sorted({value for value in values if value is not None}), dtype=str)
+        strings = {value: index for index, value in enumerate(columns[table])}
+        columns[field] = numpy.array([strings.get(value, -1) for value in values], dtype=numpy.int32)
+    columns["contour-offsets"] = numpy.concatenate(([0], numpy.cumsum([len(contour_list) for contour_list in contours]))).astype(numpy.int64)
+    columns["vertex-offsets"] = numpy.concatenate(([0], numpy.cumsum([len(contour) for contour_list in contours for contour in contour_list]))).astype(numpy.int64)
+    columns["vertices"] = numpy.array(vertices, dtype=numpy.float64).reshape((-1, 2))
+    return columns
+
+
+def _compress_sample(arguments, mask_names, mask_patterns, slots, index, sample):
+    # Write the sample's images and masks straight into its output slots, so
+    # worker processes don't have to send them back to the parent.
+    # The sample is stat'ed before it's read, so changes made while it's
+    # being compressed are picked up by the next update.
+    slot = int(slots[index])
+    stat = list(sample.stat)
+    arrays, metadata = _compress_arrays(arguments, mask_names, mask_patterns, sample)
+    for output, data in arrays.items():
+        _write_slot(arguments, output, slot, data)
+    return slot, sample.path, stat, metadata
+
+
+def _compress_shard_sample(arguments, mask_names, mask_patterns, index, sample):
+    stat = list(sample.stat)
+    arrays, metadata = _compress_arrays(arguments, mask_names, mask_patterns, sample)
+    return index, stat, arrays, metadata
+
+
+def _shard_path(arguments, number):
+    return f"{arguments.prefix}-{number:06d}.npz"
+
+
+def _load_shard_manifest(arguments, options):
+    # Return the shards listed in an existing manifest, with the path, mtime
+    # and size of each of their samples, read from the shards themselves.
+    path = f"{arguments.prefix}-manifest.json"
+    if not os.path.exists(path):
+        logging.warning(f"Nothing to resume, {path} doesn't exist.")
+        return {}
+    with open(path) as stream:
+        manifest = json.load(stream)
+    if manifest.get("options") != options:
+        raise ValueError(f"Can't resume: {path} was created with different options.")
+
+    shards = {}
+    for shard in manifest["shards"]:
+        with numpy.load(os.path.join(os.path.dirname(path), shard["path"])) as arrays:
+            shards[shard["number"]] = json.loads(arrays["samples"].tobytes())
+    return shards
+
+
+def _write_shard_manifest(arguments, options, mask_names, specs, shards):
+    # The manifest is replaced atomically, so readers always see a complete
+    # list of complete shards.
+    manifest = {
+        "format": "shards",
+        "options": options,
+        "samples": 0,
+        "samples-per-shard": arguments.samples_per_shard,
+        "outputs": {output: {"dtype": dtype, "shape": shape} for output, (dtype, shape) in specs.items()},
+        "masks": mask_names,
+        "metadata": ("columnar" if arguments.metadata_format == "columnar" else "json") if arguments.metadata else None,
+        "shards": [],
+        }
+    for number, samples in sorted(shards.items()):
+        manifest["shards"].append({"number": number, "path": os.path.basename(_shard_path(arguments, number)), "start": manifest["samples"], "count": len(samples)})
+        manifest["samples"] += len(samples)
+
+    path = f"{arguments.prefix}-manifest.json"
+    with open(path + ".tmp", "w") as stream:
+        json.dump(manifest, stream, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _compress_shards(arguments, mask_names, mask_patterns, dataset, options):
+    # Shards are rebuilt if any of their samples changed or were removed, and
+    # new samples are added to new shards, so unchanged shards are never
+    # touched.  Rebuilt shards are written under a new number, and replace
+    # the old shard in the manifest once they're complete.
+    shards = _load_shard_manifest(arguments, options) if arguments.resume else {}
+    indices = {sample.path: index for index, sample in enumerate(dataset)}
+    stamps = _sample_stamps(dataset, [indices[entry["path"]] for entries in shards.values() for entry in entries if entry["path"] in indices])
+
+    plan = []
+    assigned = set()
+    for number, entries in sorted(shards.items()):
+        members = [indices.get(entry["path"]) for entry in entries]
+        assigned.update(member for member in members if member is not None)
+        if all(member is not None and stamps[member] == [entry["mtime"], entry["size"]] for member, entry in zip(members, entries)):
+            continue
+        plan.append((number, [member for member in members if member is not None]))
+
+    added = [index for index in range(len(dataset)) if index not in assigned]
+    for start in range(0, len(added), arguments.samples_per_shard):
+        plan.append((None, added[start:start + arguments.samples_per_shard]))
+    logging.info(f"Writing {len(plan)} shards, {len(shards) - sum(1 for number, members in plan if number is not None)} shards are up to date.")
+
+    specs = _output_specs(arguments, mask_names)
+    numbers = itertools.count(max(shards, default=-1) + 1)
+
+    def write_shard(replaces, members, results):
+        # Each sample is stored in its own compressed members, so readers only
+        # decompress the samples they use.
+        number = None
+        if members:
+            number = next(numbers)
+            results = sorted(results, key=lambda result: result[0])
+            arrays = {}
+            for position, (index, stat, outputs, metadata) in enumerate(results):
+                arrays.update({f"{output}/{position:06d}": outputs[output] for output in specs})
+                if arguments.metadata and arguments.metadata_format != "columnar":
+                    arrays[f"metadata/{position:06d}"] = numpy.frombuffer(json.dumps(metadata).encode("utf-8"), dtype=numpy.uint8)
+            if arguments.metadata and arguments.metadata_format == "columnar":
+                arrays.update({f"metadata-{name}": array for name, array in _columnar_metadata([result[3] for result in results]).items()})
+            samples = [{"path": dataset[member].path, "mtime": result[1][0], "size": result[1][1]} for member, result in zip(members, results)]
+            arrays["samples"] = numpy.frombuffer(json.dumps(samples).encode("utf-8"), dtype=numpy.uint8)
+
+            path = _shard_path(arguments, number)
+            with open(path + ".tmp", "wb") as stream:
+                numpy.savez_compressed(stream, **arrays)
+            os.replace(path + ".tmp", path)
+            shards[number] = samples
+
+        if replaces is not None:
+            del shards[replaces]
+        if number is not None or replaces is not None:
+            _write_shard_manifest(arguments, options, mask_names, specs, shards)
+        if replaces is not None and os.path.exists(_shard_path(arguments, replaces)):
+            os.remove(_shard_path(arguments, replaces))
+
+    # A single pool compresses the samples for every shard, and each shard is
+    # written as soon as all of its samples are ready.  Shards with failed
+    # samples are skipped.
+    for number, members in plan:
+        if not members:
+            write_shard(number, members, [])
+    plan = [(number, members) for number, members in plan if members]
+    owners = [position for position, (number, members) in enumerate(plan) for member in members]
+    remaining = [len(members) for number, members in plan]
+    complete = [[] for number, members in plan]
+    failed = set()
+    failures = []
+
+    def finish(position):
+        remaining[position] -= 1
+        if remaining[position]:
+            return
+        number, members = plan[position]
+        if position in failed:
+            logging.warning(f"Skipping a shard of {len(members)} samples because some samples failed; use --resume to retry it.")
+        else:
+            write_shard(number, members, complete[position])
+        complete[position] = None
+
+    def finish_failures():
+        while failures:
+            index, path, error = failures.pop()
+            failed.add(owners[index])
+            finish(owners[index])
+
+    compress = functools.partial(_compress_shard_sample, arguments, mask_names, mask_patterns)
+    subset = dataset.subset([member for number, members in plan for member in members])
+    for result in subset.map(compress, processes=arguments.jobs, ordered=False, with_indices=True, failures=failures):
+        finish_failures()
+        complete[owners[result[0]]].append(result)
+        finish(owners[result[0]])
+    finish_failures()
+
+    # Always write the manifest, even if no shards changed.
+    _write_shard_manifest(arguments, options, mask_names, specs, shards)
+
+    if failed:
+        logging.warning(f"{len(failed)} shards weren't written.")
+
+
+def _open_output(path, resume, dtype, shape):
+    if not resume:
+        return numpy.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+    _grow_output(path, shape[0])
+    output = numpy.lib.format.open_memmap(path, mode="r+")
+    if output.shape != shape or output.dtype != numpy.dtype(dtype):
+        raise ValueError(f"Can't resume: {path} has shape {output.shape} and dtype {output.dtype}, expected {shape} and {numpy.dtype(dtype)}.")
+    return output
+
+
+def _grow_output(path, count):
+    # Extend an .npy file in place to hold more samples.  NumPy pads array
+    # headers so the first dimension can grow without changing their size.
+    with open(path, "rb+") as stream:
+        version = numpy.lib.format.read_magic(stream)
+        if version not in [(1, 0), (2, 0)]:
+            raise ValueError(f"Can't grow {path} with format version {version}.")
+        read_header, write_header = {
+            (1, 0): (numpy.lib.format.read_array_header_1_0, numpy.lib.format.write_array_header_1_0),
+            (2, 0): (numpy.lib.format.read_array_header_2_0, numpy.lib.format.write_array_header_2_0),
+            }[version]
+        shape, fortran_order, dtype = read_header(stream)
+        offset = stream.tell()
+        if shape[0] >= count:
+            return
+
+        header = io.BytesIO()
+        write_header(header, {"descr": numpy.lib.format.dtype_to_descr(dtype), "fortran_order": fortran_order, "shape": (count,) + shape[1:]})
+        if len(header.getvalue()) != offset:
+            raise ValueError(f"Can't grow {path} in place.")
+        stream.truncate(offset + count * int(numpy.prod(shape[1:], dtype=numpy.int64)) * dtype.itemsize)
+        stream.seek(0)
+        stream.write(header.getvalue())
+
+
+def _open_outputs(arguments, mask_names, count, resume):
+    outputs = {}
+    for output, (dtype, shape) in _output_specs(arguments, mask_names).items():
+        outputs[output] = _open_output(_output_path(arguments, output), resume, dtype, (count,) + shape)
+    return outputs
+
+
+def _output_specs(arguments, mask_names):
+    # Return the dtype and per-sample shape of each output.
+    width, height = arguments.image_size
+
+    specs = {}
+    if arguments.images:
+        specs["images"] = (arguments.image_dtype, (height, width, 3))
+
+    mask_dtype, mask_width = arguments.mask_dtype, width
+    if mask_dtype == "bit":
+        mask_dtype, mask_width = "uint8", (width + 7) // 8
+    if arguments.stack_masks:
+        specs["masks"] = (mask_dtype, (height, mask_width, len(mask_names)))
+    else:
+        for name in mask_names:
+            specs[f"masks-{name}"] = (mask_dtype, (height, mask_width, 1))
+
+    return specs
+
+
+def _sample_stamps(dataset, indices):
+    # Return the stat of previously compressed samples, to check them for
+    # changes.  Sample.stat reads each sample's metadata and stats its images,
+    # so use threads to hide the per-file latency.
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        return dict(zip(indices, executor.map(lambda sample: list(sample.stat), dataset.subset(indices))))
+
+
+def _output_path(arguments, output):
+    return f"{arguments.prefix}-{output}.npy"
+
+
+# Outputs opened by this process, keyed by path.
+_slot_outputs = {}
+
+
+def _write_slot(arguments, output, slot, data):
+    # The outputs are opened once by every process that writes to them,
+    # sharing the same pages through the operating system's page cache.
+    path = _output_path(arguments, output)
+    if path not in _slot_outputs:
+        _slot_outputs[path] = numpy.lib.format.open_memmap(path, mode="r+")
+    _slot_outputs[path][slot] = data
+
+
+def _load_manifest(path):
+    # Return the latest header and every record in a manifest.  A line
+    # truncated by a crash is ignored, and the manifest is truncated to its
+    # last complete line.
+    header = {}
+    records = []
+    with open(path, "rb+") as stream:
+        offset = 0
+        for line in stream:
+            if not line.endswith(b"\n"):
+                break
+            record = json.loads(line)
+            if "options" in record:
+                header = record
+            else:
+                records.append(record)
+            offset += len(line)
+        stream.truncate(offset)
+    return header, records
+
+
+def _manifest_options(arguments):
+    # Arguments that affect the contents of the outputs, which can't change
+    # between runs that update the same outputs.
+    names = ["format", "image_dtype", "image_size", "images", "mask", "mask_dtype", "metadata", "metadata_format", "resize_filter", "samples_per_shard", "stack_masks", "strip_regions"]
+    return json.loads(json.dumps({name: getattr(arguments, name) for name in names}))
+
+
+def _load_metadata_records(path, completed):
+    # Return the latest metadata for completed slots from a metadata records file,
+    # truncating any record that was partly written by a crash.
+    metadata = {}
+    with open(path, "rb+") as stream:
+        offset = 0
+        while True:
+            try:
+                slot, record = pickle.load(stream)
+            except (EOFError, pickle.UnpicklingError, ValueError):
+                break
+            if slot in completed:
+                metadata[slot] = record
+            offset = stream.tell()
+        stream.truncate(offset)
+    return metadata
+
+
+def _write_metadata_records(path, metadata):
+    with open(path + ".tmp", "wb") as stream:
+        for slot, record in sorted(metadata.items()):
+            pickle.dump((slot, record), stream, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+
+
+def _load_compressed_metadata(arguments, completed):
+    # Return the metadata for completed slots from the metadata output of a
+    # previous run.  Columnar metadata only contains the annotations and
+    # provenance, which is all that's needed to recreate it.
+    dataset = limbo.data.CompressedDataset(arguments.prefix)
+    if dataset.metadata(0) is None:
+        raise ValueError(f"Can't resume: the metadata output for {arguments.prefix} is missing.")
+    return {slot: dataset.metadata(slot) for slot in completed}
+
+
 def main():
     parser = argument_parser()
     arguments = parser.parse_args()
 
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    logging.getLogger("imagecat").setLevel(logging.WARN)
+
     mask_names = arguments.mask[0::2]
-    mask_patterns = arguments.mask[1::2]
+    mask_patterns = tuple(re.compile(pattern) for pattern in arguments.mask[1::2])
     if len(mask_names) != len(mask_patterns):
         raise ValueError("--mask must specify one or more <mask name> <mask pattern> pairs")
+    if arguments.flush_interval < 1:
+        raise ValueError("--flush-interval must be at least 1.")
+    if arguments.samples_per_shard < 1:
+        raise ValueError("--samples-per-shard must be at least 1.")
+
+    image_cache = None
+    if arguments.image_cache:
+        image_cache = limbo.data.ImageCache(arguments.image_cache, maxbytes=int(arguments.image_cache_size * 2**30))
+
+    dataset = limbo.data.Dataset(arguments.directory, index=arguments.index, image_cache=image_cache)
+    if arguments.category:
+        dataset = dataset.filter(category=arguments.category)
+    dataset = dataset[arguments.start:arguments.end]
+    if not len(dataset):
+        raise ValueError("No samples to compress.")
+
+    options = _manifest_options(arguments)
+    if arguments.format == "shards":
+        _compress_shards(arguments, mask_names, mask_patterns, dataset, options)
+        return
 
-    images = []
-    masks = collections.defaultdict(list)
-    metadatas = []
+    # The manifest records the options used and every sample that has been
+    # written, so later runs can skip unchanged samples.
+    manifest_path = f"{arguments.prefix}-manifest.jsonl"
+    header, records = {}, []
+    resume = arguments.resume and os.path.exists(manifest_path)
+    if resume:
+        header, records = _load_manifest(manifest_path)
+        if header.get("options") != options:
+            raise ValueError(f"Can't resume: {manifest_path} was created with different options.")
+    elif arguments.resume:
+        logging.warning(f"Nothing to resume, {manifest_path} doesn't exist.")
 
-    dataset = limbo.data.Dataset(arguments.directory)
-    for index, sample in enumerate(tqdm.tqdm(dataset)):
-        if arguments.start is not None:
-            if index < arguments.start:
+    # Unchanged samples keep their slots and are skipped.  Changed samples are
+    # rewritten in place, and new samples fill unused slots, then are appended.
+    completed = {record["slot"]: record for record in records}
+    slots_by_path = {record["path"]: slot for slot, record in completed.items()}
+    count = header.get("samples", 0)
+    unused = iter(sorted(set(range(count)) - set(completed)))
+    indices, slots = [], []
+    seen = 0
+    stamps = _sample_stamps(dataset, [index for index, sample in enumerate(dataset) if sample.path in slots_by_path])
+    for index, sample in enumerate(dataset):
+        slot = slots_by_path.get(sample.path)
+        if slot is not None:
+            seen += 1
+            if [completed[slot]["mtime"], completed[slot]["size"]] == stamps[index]:
                 continue
+        else:
+            slot = next(unused, None)
+            if slot is None:
+                slot = count
+                count += 1
+        indices.append(index)
+        slots.append(slot)
+    slots = numpy.array(slots, dtype=numpy.int64)
 
-        if arguments.end is not None:
-            if index >= arguments.end:
-                break
+    if resume:
+        logging.info(f"Resuming with {len(dataset) - len(slots)} of {len(dataset)} samples up to date.")
+        if seen < len(slots_by_path):
+            logging.warning(f"{len(slots_by_path) - seen} previously compressed samples are no longer in the dataset, and will remain in the outputs.")
 
-        if arguments.images:
-            image = sample.resized_image(arguments.image_size)
-            if "C" in image.layers:
-                image = image.layers["C"].data
-            elif "Y" in image.layers:
-                image = numpy.tile(image.layers["Y"].data, (1, 1, 3))
-            images.append(image)
-
-        for name, pattern in zip(mask_names, mask_patterns):
-            if sample.synthetic.cryptomatte:
-                instances = sample.synthetic.cryptomatte.instances
-                instances = [instance for instance in instances if re.search(pattern, instance)]
-                mask = sample.synthetic.cryptomatte.resized_matte(instances, arguments.image_size)
-                mask = mask.layers["M"].data
-            else:
-                mask = numpy.zeros((arguments.image_size[0], arguments.image_size[1], 1))
-            masks[name].append(mask)
+    manifest_stream = open(manifest_path, "a" if resume else "w")
+    if count != header.get("samples"):
+        manifest_stream.write(json.dumps({"options": options, "samples": count}) + "\n")
+        manifest_stream.flush()
 
-        if arguments.metadata:
-            metadata = copy.deepcopy(sample.metadata)
-            if arguments.strip_regions:
-                categories = {annotation.get("category") for annotation in metadata.get("annotations", [])}
-                metadata["annotations"] = [{"category":category} for category in categories]
-            metadatas.append(metadata)
+    # Metadata is recorded as each sample finishes, and only written to the
+    # metadata output at the end of the run.  The records are removed once
+    # the output is written, and recreated from it when it's updated.
+    metadata_path = f"{arguments.prefix}-metadata.records"
+    if arguments.metadata and resume and os.path.exists(metadata_path):
+        # Discard any partly-written record left by an interrupted run.
+        _load_metadata_records(metadata_path, completed)
+    elif arguments.metadata and resume:
+        _write_metadata_records(metadata_path, _load_compressed_metadata(arguments, completed))
+    metadata_stream = open(metadata_path, "ab" if resume else "wb") if arguments.metadata else None
 
+    # Samples are written to their output slots as soon as they're ready,
+    # in whatever order they finish.
+    outputs = _open_outputs(arguments, mask_names, count, resume)
+    _slot_outputs.clear()
+    _slot_outputs.update({_output_path(arguments, output): array for output, array in outputs.items()})
 
-    if arguments.images:
-        images = numpy.stack(images, axis=0)
-        numpy.save(f"{arguments.prefix}-images.npy", images)
+    # Data is flushed to disk before the samples are recorded in the
+    # manifest, so an interrupted run can be resumed.
+    pending = []
+    def checkpoint():
+        for output in outputs.values():
+            output.flush()
+        if metadata_stream is not None:
+            metadata_stream.flush()
+        for slot, path, stat in pending:
+            completed[slot] = {"slot": slot, "path": path, "mtime": stat[0], "size": stat[1]}
+            manifest_stream.write(json.dumps(completed[slot]) + "\n")
+        manifest_stream.flush()
+        pending.clear()
+
+    compress = functools.partial(_compress_sample, arguments, mask_names, mask_patterns, slots)
+    for slot, path, stat, metadata in dataset.subset(indices).map(compress, processes=arguments.jobs, ordered=False, with_indices=True):
+        if metadata_stream is not None:
+            pickle.dump((slot, metadata), metadata_stream, protocol=pickle.HIGHEST_PROTOCOL)
+
+        pending.append((slot, path, stat))
+        if len(pending) >= arguments.flush_interval:
+            checkpoint()
 
-    for name in masks:
-        masks[name] = numpy.stack(masks[name], axis=0)
-        numpy.save(f"{arguments.prefix}-masks-{name}.npy", masks[name])
+    checkpoint()
+    manifest_stream.close()
+    if metadata_stream is not None:
+        metadata_stream.close()
+    outputs.clear()
+    _slot_outputs.clear()
 
     if arguments.metadata:
-        with open(f"{arguments.prefix}-metadata.pickle", "wb") as stream:
-            pickle.dump(metadatas, stream)
+        metadata = _load_metadata_records(metadata_path, completed)
+        metadata = [metadata.get(slot) for slot in range(count)]
+        if arguments.metadata_format == "columnar":
+            for name, array in _columnar_metadata(metadata).items():
+                numpy.save(f"{arguments.prefix}-metadata-{name}.npy", array)
+        else:
+            with open(f"{arguments.prefix}-metadata.pickle", "wb") as stream:
+                pickle.dump(metadata, stream)
+        os.remove(metadata_path)
 
+    if len(completed) < count:
+        logging.warning(f"{count - len(completed)} samples failed and were left empty; use --resume to retry them.")
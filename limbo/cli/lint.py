@@ -6,12 +6,11 @@
 
 
 import argparse
+import functools
 import logging
 import os
 import sys
 
-import tqdm
-
 import limbo.data
 
 
@@ -22,10 +21,51 @@ def argument_parser():
     parser.add_argument("--delete-missing-image", action="store_true", help="Remove samples that don't have a reference image.")
     parser.add_argument("--delete-missing-synthetic", action="store_true", help="Remove samples that don't have synthetic image data.")
     parser.add_argument("--dry-run", action="store_true", help="Don't make changes.")
+    parser.add_argument("--index", action="store_true", help="Use a persistent sample index in each dataset directory to speed startup.")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of samples to process in parallel.  Default: %(default)s")
     parser.add_argument("datadir", nargs="+", default=[], help="Limbo dataset director(ies).")
     return parser
 
 
+def _lint_sample(arguments, sample):
+    delete_sample = False
+
+    if arguments.delete_empty_bboxes:
+        if "annotations" in sample.metadata:
+            annotations = []
+            for annotation in sample.metadata["annotations"]:
+                if "bbox" in annotation:
+                    x, y, width, height = annotation["bbox"]
+                    if width == 0 and height == 0:
+                        logging.error(f"Found empty bounding box in {sample.path}")
+                        continue
+                annotations.append(annotation)
+            if annotations != sample.metadata["annotations"]:
+                logging.info(f"Updating {sample.path} metadata.")
+                if not arguments.dry_run:
+                    sample.update_metadata({"annotations": annotations})
+
+    if arguments.delete_missing_cryptomatte:
+        if not os.path.exists(sample.default_cryptomatte_path):
+            logging.error(f"Missing Cryptomatte image {sample.default_synthetic_path}")
+            delete_sample = True
+
+    if arguments.delete_missing_image:
+        if not os.path.exists(sample.default_image_path):
+            logging.error(f"Missing reference image {sample.default_image_path}")
+            delete_sample = True
+
+    if arguments.delete_missing_synthetic:
+        if not os.path.exists(sample.default_synthetic_path):
+            logging.error(f"Missing synthetic image {sample.default_synthetic_path}")
+            delete_sample = True
+
+    if delete_sample:
+        logging.info(f"Deleting {sample.path}")
+        if not arguments.dry_run:
+            sample.delete()
+
+
 def main():
     parser = argument_parser()
     arguments = parser.parse_args()
@@ -37,42 +77,7 @@ def main():
     for path in arguments.datadir:
         logging.info(f"  {path}")
 
-    dataset = limbo.data.Dataset(arguments.datadir)
-
-    for sample in tqdm.tqdm(dataset, desc="Samples", unit="sample"):
-        delete_sample = False
-
-        if arguments.delete_empty_bboxes:
-            if "annotations" in sample.metadata:
-                annotations = []
-                for annotation in sample.metadata["annotations"]:
-                    if "bbox" in annotation:
-                        x, y, width, height = annotation["bbox"]
-                        if width == 0 and height == 0:
-                            logging.error(f"Found empty bounding box in {sample.path}")
-                            continue
-                    annotations.append(annotation)
-                if annotations != sample.metadata["annotations"]:
-                    logging.info(f"Updating {sample.path} metadata.")
-                    if not arguments.dry_run:
-                        sample.update_metadata({"annotations": annotations})
-
-        if arguments.delete_missing_cryptomatte:
-            if not os.path.exists(sample.default_cryptomatte_path):
-                logging.error(f"Missing Cryptomatte image {sample.default_synthetic_path}")
-                delete_sample = True
-
-        if arguments.delete_missing_image:
-            if not os.path.exists(sample.default_image_path):
-                logging.error(f"Missing reference image {sample.default_image_path}")
-                delete_sample = True
-
-        if arguments.delete_missing_synthetic:
-            if not os.path.exists(sample.default_synthetic_path):
-                logging.error(f"Missing synthetic image {sample.default_synthetic_path}")
-                delete_sample = True
-
-        if delete_sample:
-            logging.info(f"Deleting {sample.path}")
-            if not arguments.dry_run:
-                sample.delete()
+    dataset = limbo.data.Dataset(arguments.datadir, index=arguments.index)
+
+    for result in dataset.map(functools.partial(_lint_sample, arguments), processes=arguments.jobs):
+        pass
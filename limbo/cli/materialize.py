@@ -5,23 +5,39 @@
 """Implements the :ref:`limbo-materialize` command."""
 
 import argparse
+import functools
 import logging
 import os
 
-import tqdm
-
 import limbo.data
 
 
 def argument_parser():
     parser = argparse.ArgumentParser(description="Extract commonly-used data from raw Limbo datasets.")
     parser.add_argument("--all", action="store_true", help="Materialize everything.")
+    parser.add_argument("--bboxes", action="store_true", help="Materialize bounding box metadata only, computed directly from Cryptomatte data.  Much faster than --bounds.")
     parser.add_argument("--bounds", action="store_true", help="Materialize bounding box / bounding polygon metadata.")
     parser.add_argument("--images", action="store_true", help="Materialize PNG images from the EXR originals.")
+    parser.add_argument("--image-cache", help="Directory used to cache decoded images between runs.  Default: no cache.")
+    parser.add_argument("--image-cache-size", type=float, default=10, help="Maximum image cache size in GiB.  Default: %(default)s")
+    parser.add_argument("--index", action="store_true", help="Use a persistent sample index in each dataset directory to speed startup.")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of samples to process in parallel.  Default: %(default)s")
     parser.add_argument("datadir", nargs="+", default=[], help="Limbo dataset director(ies).")
     return parser
 
 
+def _materialize_sample(arguments, sample):
+    if sample.synthetic and sample.synthetic.cryptomatte and (arguments.all or arguments.bounds):
+        sample.synthetic.cryptomatte.materialize_bounds()
+        #logging.info(f"Materialized bounding box / polygon metadata.")
+    elif sample.synthetic and sample.synthetic.cryptomatte and arguments.bboxes:
+        sample.synthetic.cryptomatte.materialize_bounds(contours=False)
+
+    if sample.synthetic and (arguments.all or arguments.images):
+        sample.synthetic.materialize_image()
+        #logging.info(f"Materialized {sample.metadata['image']['filename']}")
+
+
 def main():
     parser = argument_parser()
     arguments = parser.parse_args()
@@ -29,18 +45,13 @@ def main():
     logging.basicConfig(level=logging.INFO)
     logging.getLogger("imagecat").setLevel(logging.WARN)
 
-    dataset = limbo.data.Dataset(arguments.datadir)
-    for sample in tqdm.tqdm(dataset, desc="Samples", unit="sample"):
-        #logging.info(f"Processing {sample.name}")
-        try:
-            if sample.synthetic and sample.synthetic.cryptomatte and (arguments.all or arguments.bounds):
-                sample.synthetic.cryptomatte.materialize_bounds()
-                #logging.info(f"Materialized bounding box / polygon metadata.")
-
-            if sample.synthetic and (arguments.all or arguments.images):
-                sample.synthetic.materialize_image()
-                #logging.info(f"Materialized {sample.metadata['image']['filename']}")
-        except KeyboardInterrupt:
-            break
-        except Exception as e:
-            logging.info(f"Skipping {sample.name}: {e}")
+    image_cache = None
+    if arguments.image_cache:
+        image_cache = limbo.data.ImageCache(arguments.image_cache, maxbytes=int(arguments.image_cache_size * 2**30))
+
+    dataset = limbo.data.Dataset(arguments.datadir, index=arguments.index, image_cache=image_cache)
+    try:
+        for result in dataset.map(functools.partial(_materialize_sample, arguments), processes=arguments.jobs):
+            pass
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,65 @@
+# Copyright 2021 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+
+"""Implements the :ref:`limbo-pack` command."""
+
+
+import argparse
+import logging
+import os
+import sys
+
+import tqdm
+
+import limbo.data
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description="Pack Limbo datasets into shards.")
+    parser.add_argument("--index", action="store_true", help="Use a persistent sample index in each dataset directory to speed startup.")
+    parser.add_argument("--output", default=".", help="Output directory.  Default: %(default)s")
+    parser.add_argument("--prefix", default="shard", help="Output shard filename prefix.  Default: %(default)s")
+    parser.add_argument("--samples-per-shard", type=int, default=1000, help="Maximum number of samples stored in each shard.  Default: %(default)s")
+    parser.add_argument("datadir", nargs="+", default=[], help="Limbo dataset director(ies).")
+    return parser
+
+
+def main():
+    parser = argument_parser()
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    logging.getLogger("imagecat").setLevel(logging.WARN)
+
+    if arguments.samples_per_shard < 1:
+        raise ValueError("--samples-per-shard must be at least 1.")
+
+    logging.info("Packing data from:")
+    for path in arguments.datadir:
+        logging.info(f"  {path}")
+
+    dataset = limbo.data.Dataset(arguments.datadir, index=arguments.index)
+    os.makedirs(arguments.output, exist_ok=True)
+
+    # Keep each sample's location relative to its dataset directory, so
+    # samples with the same filenames in different directories don't collide.
+    def prefix(sample):
+        for root in dataset.paths:
+            if sample.path.startswith(os.path.join(root, "")):
+                return os.path.relpath(os.path.dirname(sample.path), root).replace(os.sep, "/")
+        return ""
+
+    shard = None
+    shards = 0
+    for index, sample in enumerate(tqdm.tqdm(dataset, desc="Samples", unit="sample")):
+        if index % arguments.samples_per_shard == 0:
+            if shard is not None:
+                shard.close()
+            shard = limbo.data.ShardWriter(os.path.join(arguments.output, f"{arguments.prefix}-{shards:06d}.limbo.tar"))
+            shards += 1
+        shard.add(sample, prefix=prefix(sample))
+    if shard is not None:
+        shard.close()
+
+    logging.info(f"Packed {len(dataset)} samples into {shards} shards.")
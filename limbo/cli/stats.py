@@ -5,14 +5,11 @@
 """Implements the :ref:`limbo-stats` command."""
 
 import argparse
-import itertools
 import logging
 import os
 import sys
 
 import numpy
-import scipy.sparse
-import tqdm
 
 import limbo.data
 
@@ -20,8 +17,11 @@ import limbo.data
 def argument_parser():
     parser = argparse.ArgumentParser(description="Print information about Limbo datasets.")
     parser.add_argument("--annotations", action="store_true", help="Display annotation statistics.")
+    parser.add_argument("--cache", action="store_true", help="Cache metadata in each dataset directory, so subsequent runs only read new and modified samples.")
     parser.add_argument("--copyright", action="store_true", help="Display copyright statistics.")
     parser.add_argument("--empty-bbox", action="store_true", help="Display samples that have empty bounding boxes.")
+    parser.add_argument("--index", action="store_true", help="Use a persistent sample index in each dataset directory to speed startup.")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of samples to process in parallel.  Default: %(default)s")
     parser.add_argument("--license", action="store_true", help="Display license statistics.")
     parser.add_argument("--license-csv", action="store_true", help="Display license statistics as CSV data.")
     parser.add_argument("datadir", nargs="+", default=[], help="Limbo dataset director(ies).")
@@ -39,102 +39,59 @@ def main():
     for path in arguments.datadir:
         logging.info(f"  {path}")
 
-    dataset = limbo.data.Dataset(arguments.datadir)
-
-    # Setup column indices for a sparse matrix.
-    column = itertools.count()
-
-    bbox_column = next(column)
-    empty_bbox_column = next(column)
-    category_columns = {}
-    contour_column = next(column)
-    copyright_columns = {}
-    cryptomatte_column = next(column)
-    image_column = next(column)
-    index_column = next(column)
-    license_columns = {}
-    provenance_column = next(column)
-    synthetic_column = next(column)
-    tag_column = next(column)
-
-    # Iterate over samples, incrementally populating a sparse matrix in coordinate format.
-    i = []
-    j = []
-    data = []
-
-    def mark(row, col, value=1):
-        i.append(row)
-        j.append(col)
-        data.append(value)
-
-    for row, sample in enumerate(tqdm.tqdm(dataset, desc="Samples", unit="sample")):
-        mark(row, index_column) # This guarantees that there will be a row for every sample in the sparse data.
-
-        for category in sample.categories:
-            if category not in category_columns:
-                category_columns[category] = next(column)
-            mark(row, category_columns[category])
-
-        if "annotations" in sample.metadata:
-            for annotation in sample.metadata["annotations"]:
-                if "bbox" in annotation:
-                    mark(row, bbox_column)
-                    x, y, width, height = annotation["bbox"]
-                    if width == 0 and height == 0:
-                        mark(row, empty_bbox_column)
-                if "contours" in annotation:
-                    mark(row, contour_column)
-                else:
-                    mark(row, tag_column)
-
-        if "image" in sample.metadata:
-            mark(row, image_column)
-
-        if "provenance" in sample.metadata:
-            mark(row, provenance_column)
-
-            copyright = sample.metadata["provenance"].get("copyright", "")
-            if copyright not in copyright_columns:
-                copyright_columns[copyright] = next(column)
-            mark(row, copyright_columns[copyright])
-
-            license = sample.metadata["provenance"].get("license", "")
-            if license not in license_columns:
-                license_columns[license] = next(column)
-            mark(row, license_columns[license])
-
-        if sample.synthetic:
-            mark(row, synthetic_column)
-            if sample.synthetic.cryptomatte:
-                mark(row, cryptomatte_column)
+    dataset = limbo.data.Dataset(arguments.datadir, index=arguments.index)
+    catalog = dataset.catalog(cache=arguments.cache, processes=arguments.jobs)
+
+    # Summarize annotations by sample.
+    annotation_sample = catalog.annotation_sample
+    has_bbox = ~numpy.isnan(catalog.annotation_bbox[:,0])
+    has_empty_bbox = has_bbox & (catalog.annotation_bbox[:,2] == 0) & (catalog.annotation_bbox[:,3] == 0)
+    has_contours = catalog.annotation_contours >= 0
+
+    def samples_with(annotations):
+        result = numpy.zeros(len(catalog), dtype=int)
+        result[annotation_sample[annotations]] = 1
+        return result
+
+    category_samples = numpy.zeros((len(catalog), len(catalog.categories)), dtype=int)
+    category_samples[annotation_sample, catalog.annotation_category] = 1
+
+    copyright_samples = numpy.zeros((len(catalog), len(catalog.copyrights)), dtype=int)
+    copyright_samples[catalog.has_provenance, catalog.copyright[catalog.has_provenance]] = 1
+
+    license_samples = numpy.zeros((len(catalog), len(catalog.licenses)), dtype=int)
+    license_samples[catalog.has_provenance, catalog.license[catalog.has_provenance]] = 1
+
+    # Only report values that are actually used by this dataset.
+    category_columns = {category: column for column, category in enumerate(catalog.categories) if category_samples[:,column].any()}
+    copyright_columns = {copyright: column for column, copyright in enumerate(catalog.copyrights) if copyright_samples[:,column].any()}
+    license_columns = {license: column for column, license in enumerate(catalog.licenses) if license_samples[:,column].any()}
 
     categories = sorted(category_columns.keys())
     copyrights = sorted(copyright_columns.keys())
     licenses = sorted(license_columns.keys())
 
-    samples = scipy.sparse.coo_matrix((data, (i, j))).toarray()
-
     print(f"Total samples: {len(dataset)}.")
     print("")
-    print(f"- Samples with provenance: {numpy.count_nonzero(samples[:,provenance_column])}")
-    print(f"- Samples with images: {numpy.count_nonzero(samples[:,image_column])}")
-    print(f"- Samples with synthetic data: {numpy.count_nonzero(samples[:,synthetic_column])}")
-    print(f"- Samples with cryptomatte data: {numpy.count_nonzero(samples[:,cryptomatte_column])}")
-    print(f"- Samples with bounding-boxes: {numpy.count_nonzero(samples[:,bbox_column])}")
-    print(f"- Samples with empty bounding-boxes: {numpy.count_nonzero(samples[:,empty_bbox_column])}")
-    print(f"- Samples with contours: {numpy.count_nonzero(samples[:,contour_column])}")
-    print(f"- Samples with tags: {numpy.count_nonzero(samples[:,tag_column])}")
+    print(f"- Samples with provenance: {numpy.count_nonzero(catalog.has_provenance)}")
+    print(f"- Samples with images: {numpy.count_nonzero(catalog.has_image)}")
+    print(f"- Samples with synthetic data: {numpy.count_nonzero(catalog.has_synthetic)}")
+    print(f"- Samples with cryptomatte data: {numpy.count_nonzero(catalog.has_cryptomatte)}")
+    print(f"- Samples with bounding-boxes: {numpy.count_nonzero(samples_with(has_bbox))}")
+    print(f"- Samples with empty bounding-boxes: {numpy.count_nonzero(samples_with(has_empty_bbox))}")
+    print(f"- Samples with contours: {numpy.count_nonzero(samples_with(has_contours))}")
+    print(f"- Samples with tags: {numpy.count_nonzero(samples_with(~has_contours))}")
     print("")
 
     print("Categories:")
     print("")
     for category in categories:
-        print(f"- Category *{category}* samples: {numpy.count_nonzero(samples[:,category_columns[category]])}")
+        print(f"- Category *{category}* samples: {numpy.count_nonzero(category_samples[:,category_columns[category]])}")
     print("")
 
     old_columns = [category_columns[category] for category in categories]
     new_columns = [index for index, column in enumerate(old_columns)]
-    new_samples = samples[:, old_columns]
+    new_samples = category_samples[:, old_columns]
 
     if arguments.annotations:
         print("Annotations:")
@@ -149,13 +106,13 @@ def main():
         print("Copyrights:")
         print("")
         for copyright in copyrights:
-            print(f"- Copyright *{copyright}* samples: {numpy.count_nonzero(samples[:,copyright_columns[copyright]])}")
+            print(f"- Copyright *{copyright}* samples: {numpy.count_nonzero(copyright_samples[:,copyright_columns[copyright]])}")
         print("")
 
     if arguments.empty_bbox:
         print("Empty Bounding Boxes:")
         print("")
-        indices = numpy.flatnonzero(samples[:, empty_bbox_column])
+        indices = numpy.flatnonzero(samples_with(has_empty_bbox))
         indices = " ".join([str(index) for index in indices])
         print(indices)
 
@@ -163,14 +120,14 @@ def main():
         print("Licenses:")
         print("")
         for license in licenses:
-            print(f"- License *{license}* samples: {numpy.count_nonzero(samples[:,license_columns[license]])}")
+            print(f"- License *{license}* samples: {numpy.count_nonzero(license_samples[:,license_columns[license]])}")
         print("")
 
     if arguments.license_csv:
         print("count,original,indices\n")
         for license in licenses:
-            indices = numpy.flatnonzero(samples[:, license_columns[license]])
+            indices = numpy.flatnonzero(license_samples[:, license_columns[license]])
             indices = " ".join([str(index) for index in indices])
-            print(f"{numpy.count_nonzero(samples[:,license_columns[license]])},\"{license}\",{indices}\n")
+            print(f"{numpy.count_nonzero(license_samples[:,license_columns[license]])},\"{license}\",{indices}\n")
 
 
@@ -7,24 +7,128 @@
 """
 
 import collections
+import concurrent.futures
+import functools
 import glob
+import hashlib
+import io
 import itertools
 import json
 import logging
+import multiprocessing
 import os
+import pickle
+import posixpath
 import re
+import shutil
+import sys
+import tarfile
 
 import graphcat
+import Imath
 import imagecat
 import imagecat.color.brewer
 import numpy
+import OpenEXR
 import skia
 import skimage.measure
+import skimage.transform
+import tqdm
+
+try:
+    import orjson
+except ImportError: # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError: # pragma: no cover
+    ujson = None
 
 
 log = logging.getLogger()
 
 
+def _json_loads(data):
+    # Use the fastest available JSON parser.
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return json.loads(data) # Handles non-standard values like NaN.
+    if ujson is not None:
+        return ujson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(data, indent=False):
+    # Always serialize with the standard library, returning UTF-8 encoded bytes.  The fast
+    # backends differ in how they write NaN, infinities, and non-ASCII text.
+    if indent:
+        return json.dumps(data, indent=2, sort_keys=True).encode("utf-8")
+    return json.dumps(data).encode("utf-8")
+
+
+_shard_extension = ".limbo.tar"
+_shard_magic = b"LIMBOIDX"
+_shard_version = 1
+
+
+def _split_shard_path(path):
+    # Return the shard path and member name for a path within a shard, or None.
+    marker = _shard_extension + os.sep
+    position = path.rfind(marker)
+    if position < 0:
+        return None
+    return path[:position + len(_shard_extension)], path[position + len(marker):].replace(os.sep, "/")
+
+
+def _read_shard_index(stream):
+    # The index is stored as JSON after the end of the tar archive, followed by its length and a magic number.
+    stream.seek(0, os.SEEK_END)
+    if stream.tell() < 16:
+        raise ValueError("Not a Limbo shard.")
+    stream.seek(-16, os.SEEK_END)
+    footer = stream.read(16)
+    if footer[8:] != _shard_magic:
+        raise ValueError("Not a Limbo shard.")
+    length = int.from_bytes(footer[:8], "little")
+    stream.seek(-16 - length, os.SEEK_END)
+    index = _json_loads(stream.read(length))
+    if index.get("version") != _shard_version:
+        raise ValueError(f"Unsupported Limbo shard version: {index.get('version')}")
+    return index["members"]
+
+
+@functools.lru_cache(maxsize=64)
+def _cached_shard_index(path, mtime, size):
+    with open(path, "rb") as stream:
+        return _read_shard_index(stream)
+
+
+def _shard_index(path):
+    # Return the offset index for a shard, reusing it until the shard is modified.
+    info = os.stat(path)
+    return _cached_shard_index(path, info.st_mtime_ns, info.st_size)
+
+
+def _read_file(path):
+    # Return the contents of a file, which may be a member of a shard.
+    shard = _split_shard_path(path)
+    if shard is None:
+        with open(path, "rb") as stream:
+            return stream.read()
+
+    shard_path, member = shard
+    try:
+        offset, size = _shard_index(shard_path)[member]
+    except KeyError:
+        raise FileNotFoundError(f"No such file in shard: {path}")
+    with open(shard_path, "rb") as stream:
+        stream.seek(offset)
+        return stream.read(size)
+
+
 def signed_area(contour):
     """Return the signed area of a contour.
 
@@ -62,6 +166,535 @@ def ccw(contour):
     return signed_area(contour) > 0
 
 
+def _nbytes(value):
+    # Estimate the memory used by a cached value.
+    if isinstance(value, numpy.ndarray):
+        return value.nbytes
+    if isinstance(value, imagecat.data.Image):
+        return sum(layer.data.nbytes for layer in value.layers.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def _freeze(value):
+    # Make the arrays in a cached value read-only, since every caller shares them.
+    if isinstance(value, numpy.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, imagecat.data.Image):
+        for layer in value.layers.values():
+            _freeze(layer.data)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _freeze(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            _freeze(item)
+    return value
+
+
+class MemoCache(object):
+    """Least-recently-used cache with a memory budget.
+
+    Callers typically use the cache returned by :attr:`Sample.memo` instead
+    of creating their own.
+
+    Cached values are shared by every caller that requests them, so the
+    :class:`numpy.ndarray` objects they contain are made read-only; copy
+    them before modifying them.
+
+    Parameters
+    ----------
+    maxbytes: :class:`int`, optional
+        Approximate maximum amount of memory used by cached values.  When the
+        budget is exceeded, the least-recently-used values are discarded.
+        Values larger than the budget aren't cached.
+    """
+    def __init__(self, maxbytes=256 * 2**20):
+        self._maxbytes = maxbytes
+        self._values = collections.OrderedDict()
+        self._nbytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return f"limbo.data.MemoCache(maxbytes={self._maxbytes!r}, nbytes={self._nbytes!r}, hits={self._hits!r}, misses={self._misses!r})"
+
+
+    def clear(self):
+        """Discard every cached value, and reset the hit and miss counters."""
+        self._values.clear()
+        self._nbytes = 0
+        self._hits = 0
+        self._misses = 0
+
+
+    @property
+    def hits(self):
+        """Number of requests that were satisfied by the cache.
+
+        Returns
+        -------
+        hits: :class:`int`
+        """
+        return self._hits
+
+
+    @property
+    def maxbytes(self):
+        """Approximate maximum amount of memory used by cached values.
+
+        Returns
+        -------
+        maxbytes: :class:`int`
+        """
+        return self._maxbytes
+
+    @maxbytes.setter
+    def maxbytes(self, value):
+        self._maxbytes = value
+        self._evict()
+
+
+    def memoize(self, key, fn):
+        """Return a cached value, computing and caching it if necessary.
+
+        Parameters
+        ----------
+        key: hashable object, required
+            Key that uniquely identifies the value.
+        fn: callable, required
+            Function called with no arguments to compute the value if it isn't cached.
+
+        Returns
+        -------
+        value: object
+            The cached or newly-computed value.  Arrays within the value are
+            read-only, even if it wasn't cached.
+        """
+        if key in self._values:
+            self._hits += 1
+            self._values.move_to_end(key)
+            return self._values[key][0]
+
+        self._misses += 1
+        value = _freeze(fn())
+        nbytes = _nbytes(value)
+        if nbytes <= self._maxbytes:
+            self._values[key] = (value, nbytes)
+            self._nbytes += nbytes
+            self._evict()
+        return value
+
+
+    @property
+    def misses(self):
+        """Number of requests that had to be computed.
+
+        Returns
+        -------
+        misses: :class:`int`
+        """
+        return self._misses
+
+
+    @property
+    def nbytes(self):
+        """Approximate amount of memory used by cached values.
+
+        Returns
+        -------
+        nbytes: :class:`int`
+        """
+        return self._nbytes
+
+
+    def _evict(self):
+        while self._nbytes > self._maxbytes and self._values:
+            key, (value, nbytes) = self._values.popitem(last=False)
+            self._nbytes -= nbytes
+
+
+class ImageCache(object):
+    """Disk cache of decoded images.
+
+    Decoding images, particularly OpenEXR renders, is often the slowest part of
+    working with a dataset.  An image cache stores the decoded layers of each
+    image as ``.npy`` files in a directory, keyed by the path, modification
+    time, and size of the source file.  Cached layers are opened as read-only
+    memory maps, so loading a cached image copies no data until it is used.
+    Cached images are discarded in least-recently-used order when the cache
+    grows larger than ``maxbytes``.
+
+    Pass an image cache to :any:`Dataset` or :any:`Sample` to use it.  The cache
+    directory can be shared by multiple processes.
+
+    Parameters
+    ----------
+    directory: :class:`str`, required
+        Directory where decoded images will be stored.  It is created if
+        it doesn't exist.
+    maxbytes: :class:`int`, optional
+        Approximate maximum size of the cache on disk.
+    """
+    def __init__(self, directory, maxbytes=10 * 2**30):
+        self._directory = os.path.abspath(directory)
+        self._maxbytes = maxbytes
+        self._unchecked = None
+
+    def __repr__(self):
+        return f"limbo.data.ImageCache(directory={self._directory!r}, maxbytes={self._maxbytes!r})"
+
+
+    def clear(self):
+        """Remove every cached image."""
+        for entry in self._entries():
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+    @property
+    def directory(self):
+        """Directory where decoded images are stored.
+
+        Returns
+        -------
+        directory: :class:`str`
+        """
+        return self._directory
+
+
+    def get(self, path, variant=""):
+        """Return a cached image, if it exists.
+
+        Parameters
+        ----------
+        path: :class:`str`, required
+            Path of the source image file.
+        variant: :class:`str`, optional
+            Distinguishes different images decoded from the same source file.
+
+        Returns
+        -------
+        image: :class:`imagecat.data.Image` or :any:`None`
+            The cached image, with memory-mapped layers, or :any:`None` if
+            the image isn't cached or the source file has changed.
+        """
+        key = self._key(path, variant)
+        if key is None:
+            return None
+        entry = os.path.join(self._directory, key)
+        try:
+            with open(os.path.join(entry, "image.json"), "rb") as stream:
+                contents = _json_loads(stream.read())
+            layers = {}
+            for layer in contents["layers"]:
+                data = numpy.load(os.path.join(entry, layer["filename"]), mmap_mode="r", allow_pickle=False)
+                layers[layer["name"]] = imagecat.data.Layer(data=data, role=imagecat.data.Role[layer["role"]])
+            os.utime(entry)
+        except (OSError, ValueError, KeyError):
+            return None
+        return imagecat.data.Image(layers=layers, metadata=contents["metadata"])
+
+
+    def load(self, path, loader, variant=""):
+        """Return a cached image, decoding and caching it if necessary.
+
+        Parameters
+        ----------
+        path: :class:`str`, required
+            Path of the source image file.
+        loader: callable, required
+            Function called with no arguments to decode the image, if it isn't cached.
+        variant: :class:`str`, optional
+            Distinguishes different images decoded from the same source file.
+
+        Returns
+        -------
+        image: :class:`imagecat.data.Image`
+        """
+        image = self.get(path, variant)
+        if image is None:
+            image = loader()
+            self.put(path, image, variant)
+        return image
+
+
+    @property
+    def maxbytes(self):
+        """Approximate maximum size of the cache on disk.
+
+        Returns
+        -------
+        maxbytes: :class:`int`
+        """
+        return self._maxbytes
+
+
+    @property
+    def nbytes(self):
+        """Current size of the cache on disk.
+
+        Returns
+        -------
+        nbytes: :class:`int`
+        """
+        return sum(size for entry, size in self._entry_sizes())
+
+
+    def put(self, path, image, variant=""):
+        """Store a decoded image in the cache.
+
+        Parameters
+        ----------
+        path: :class:`str`, required
+            Path of the source image file.
+        image: :class:`imagecat.data.Image`, required
+            Decoded image to be stored.
+        variant: :class:`str`, optional
+            Distinguishes different images decoded from the same source file.
+        """
+        key = self._key(path, variant)
+        if key is None:
+            return
+
+        entry = os.path.join(self._directory, key)
+        temp_entry = f"{entry}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(temp_entry, exist_ok=True)
+            layers = []
+            nbytes = 0
+            for index, (name, layer) in enumerate(image.layers.items()):
+                filename = f"layer-{index}.npy"
+                numpy.save(os.path.join(temp_entry, filename), numpy.ascontiguousarray(layer.data), allow_pickle=False)
+                layers.append({"name": name, "role": layer.role.name, "filename": filename})
+                nbytes += layer.data.nbytes
+            with open(os.path.join(temp_entry, "image.json"), "wb") as stream:
+                stream.write(_json_dumps({"path": path, "variant": variant, "layers": layers, "metadata": image.metadata}))
+            os.rename(temp_entry, entry)
+        except (OSError, TypeError, ValueError) as e:
+            # Another process may have cached the same image first, or the image metadata may not be JSON serializable.
+            if not os.path.isdir(entry):
+                log.warning(f"Couldn't cache {path}: {e}")
+            shutil.rmtree(temp_entry, ignore_errors=True)
+            return
+
+        # Only rescan the cache occasionally, since it can be large.
+        if self._unchecked is None or self._unchecked + nbytes > self._maxbytes // 16:
+            self._evict()
+            self._unchecked = 0
+        else:
+            self._unchecked += nbytes
+
+
+    def _entries(self):
+        try:
+            with os.scandir(self._directory) as entries:
+                return [entry for entry in entries if entry.is_dir() and not entry.name.endswith(".tmp")]
+        except OSError:
+            return []
+
+
+    def _entry_sizes(self):
+        sizes = []
+        for entry in self._entries():
+            try:
+                with os.scandir(entry.path) as files:
+                    sizes.append((entry, sum(file.stat().st_size for file in files)))
+            except OSError:
+                pass
+        return sizes
+
+
+    def _evict(self):
+        sizes = self._entry_sizes()
+        nbytes = sum(size for entry, size in sizes)
+        if nbytes <= self._maxbytes:
+            return
+
+        def mtime(item):
+            try:
+                return item[0].stat().st_mtime_ns
+            except OSError:
+                return 0
+
+        for entry, size in sorted(sizes, key=mtime):
+            if nbytes <= self._maxbytes:
+                break
+            shutil.rmtree(entry.path, ignore_errors=True)
+            nbytes -= size
+
+
+    def _key(self, path, variant):
+        mtime, size = _stat_sample(path)
+        if size < 0:
+            return None
+        return hashlib.sha1(_json_dumps([path, mtime, size, variant])).hexdigest()
+
+
+def _cubic_kernel(x):
+    # Keys cubic convolution kernel, with a = -0.5.
+    x = numpy.abs(x)
+    return numpy.where(x < 1, (1.5 * x - 2.5) * x * x + 1, numpy.where(x < 2, ((-0.5 * x + 2.5) * x - 4) * x + 2, 0))
+
+
+def _linear_kernel(x):
+    return numpy.clip(1 - numpy.abs(x), 0, None)
+
+
+def _resize_weights(source, target, filter):
+    # Compute the input indices and weights that contribute to each output
+    # pixel when resizing one axis, as (target, taps) arrays.
+    scale = source / target
+    centers = (numpy.arange(target) + 0.5) * scale
+
+    if filter == "nearest":
+        indices = numpy.minimum(numpy.floor(centers), source - 1).astype(numpy.int64)[:, None]
+        return indices, numpy.ones(indices.shape, dtype=numpy.float32)
+
+    if filter == "area":
+        # Each output pixel averages the input pixels that it overlaps, weighted by the overlap.
+        starts = numpy.arange(target) * scale
+        first = numpy.floor(starts).astype(numpy.int64)
+        taps = int(numpy.ceil(scale)) + 1
+        indices = first[:, None] + numpy.arange(taps)
+        overlap = numpy.minimum(indices + 1, (starts + scale)[:, None]) - numpy.maximum(indices, starts[:, None])
+        weights = numpy.clip(overlap, 0, None)
+    else:
+        kernel, radius = {"cubic": (_cubic_kernel, 2), "linear": (_linear_kernel, 1)}[filter]
+        # Widen the kernel when downsampling, to avoid aliasing.
+        stretch = max(scale, 1)
+        centers = centers - 0.5
+        first = numpy.ceil(centers - radius * stretch).astype(numpy.int64)
+        taps = int(numpy.ceil(2 * radius * stretch)) + 1
+        indices = first[:, None] + numpy.arange(taps)
+        weights = kernel((indices - centers[:, None]) / stretch)
+
+    weights = weights / weights.sum(axis=1, keepdims=True)
+    return numpy.clip(indices, 0, source - 1), weights.astype(numpy.float32)
+
+
+class Resizer(object):
+    """Resizes images to a fixed size, reusing precomputed sampling weights.
+
+    Resizing is separable: each output pixel is a weighted sum of nearby input
+    pixels along each axis.  The indices and weights depend only on the input
+    and output sizes, so they are computed once for each input size and reused
+    for every image with that size.  This is much faster than
+    :func:`imagecat.operator.transform.resize` when many images are resized
+    to the same size, as in :ref:`limbo-compress`.
+
+    Callers typically use the ``filter`` parameter of :meth:`Sample.resized_image`
+    or :meth:`Cryptomatte.resized_matte` instead of creating their own.
+
+    Parameters
+    ----------
+    res: (width, height) tuple, required
+        Output size, in pixels.
+    filter: :class:`str`, optional
+        Resampling filter, one of "area" (the average of the input pixels
+        covered by each output pixel, which is ideal for downsampling mattes),
+        "cubic", "linear", or "nearest".  The cubic and linear filters are
+        widened when downsampling to avoid aliasing.
+    """
+    filters = ["area", "cubic", "linear", "nearest"]
+
+    def __init__(self, res, filter="area"):
+        if filter not in self.filters:
+            raise ValueError(f"Unknown filter: {filter}")
+        self._res = (int(res[0]), int(res[1]))
+        self._filter = filter
+        self._weights = {}
+
+    def __call__(self, data):
+        """Resize an array.
+
+        Parameters
+        ----------
+        data: :class:`numpy.ndarray`, required
+            Array with shape (height, width) or (height, width, channels).
+
+        Returns
+        -------
+        data: :class:`numpy.ndarray`
+            Resized array with the same dtype as the input.
+        """
+        dtype = data.dtype
+        data = self._resize(data, axis=0, size=self._res[1])
+        data = self._resize(data, axis=1, size=self._res[0])
+        if numpy.issubdtype(dtype, numpy.integer):
+            data = numpy.rint(data)
+        return data.astype(dtype, copy=False)
+
+    def __repr__(self):
+        return f"limbo.data.Resizer(res={self._res!r}, filter={self._filter!r})"
+
+
+    @property
+    def filter(self):
+        """Resampling filter.
+
+        Returns
+        -------
+        filter: :class:`str`
+        """
+        return self._filter
+
+
+    @property
+    def res(self):
+        """Output size.
+
+        Returns
+        -------
+        res: (width, height) tuple
+        """
+        return self._res
+
+
+    def resize_image(self, image):
+        """Resize every layer in an image.
+
+        Parameters
+        ----------
+        image: :class:`imagecat.data.Image`, required
+
+        Returns
+        -------
+        image: :class:`imagecat.data.Image`
+            A new image containing the resized layers.
+        """
+        layers = {name: imagecat.data.Layer(data=self(layer.data), role=layer.role) for name, layer in image.layers.items()}
+        return imagecat.data.Image(layers=layers, metadata=image.metadata)
+
+
+    def _resize(self, data, axis, size):
+        source = data.shape[axis]
+        key = (axis, source)
+        if key not in self._weights:
+            self._weights[key] = _resize_weights(source, size, self._filter)
+        indices, weights = self._weights[key]
+
+        # Accumulate one tap at a time, to limit temporary memory.
+        shape = [1] * data.ndim
+        shape[axis] = size
+        result = None
+        for tap in range(indices.shape[1]):
+            term = numpy.take(data, indices[:, tap], axis=axis) * weights[:, tap].reshape(shape)
+            result = term if result is None else numpy.add(result, term, out=result)
+        return result
+
+
+@functools.lru_cache(maxsize=16)
+def _resizer(res, filter):
+    return Resizer(res, filter)
+
+
 class Cryptomatte(object):
     """Provides access to extra information provided by synthetic samples.
 
@@ -73,6 +706,8 @@ class Cryptomatte(object):
     There is no reason to create an instance of this class yourself, callers
     should obtain instances from the :meth:`Synthetic.cryptomatte` property.
     """
+    __slots__ = ["_sample", "_synthetic"]
+
     def __init__(self, sample, synthetic):
         self._sample = sample
         self._synthetic = synthetic
@@ -95,12 +730,24 @@ class Cryptomatte(object):
         bbox: (left, top, width, height) tuple
             Returns the bounding box using absolute pixel values.
         """
-        if instances is None:
-            instances = self.instances
-        elif isinstance(instances, str):
-            instances = [instances]
-        self._sample.graph.set_task("/cryptomatte/mattes", graphcat.constant(instances))
-        return self._sample.graph.output("/bbox")
+        return self._output("/bbox", "/cryptomatte/mattes", instances)
+
+
+    def bboxes(self):
+        """Compute bounding boxes for every visible instance at once.
+
+        Unlike :meth:`bbox`, the bounding boxes are computed directly from the
+        Cryptomatte data instead of contours, which is much faster.  See
+        :meth:`instance_stats` for details.
+
+        Returns
+        -------
+        bboxes: :class:`dict`
+            Maps instance labels to (left, top, width, height) tuples in
+            absolute pixel values.  Instances that aren't visible are omitted.
+        """
+        stats = self.instance_stats()
+        return {instance: (float(row["x"]), float(row["y"]), float(row["width"]), float(row["height"])) for instance, row in zip(self.instances, stats) if row["area"]}
 
 
     def contours(self, instances=None):
@@ -121,12 +768,7 @@ class Cryptomatte(object):
             Returns a :math:`N \\times 2` :class:`numpy.ndarray` for each contour,
             containing absolute pixel values.
         """
-        if instances is None:
-            instances = self.instances
-        elif isinstance(instances, str):
-            instances = [instances]
-        self._sample.graph.set_task("/cryptomatte/mattes", graphcat.constant(instances))
-        return self._sample.graph.output("/contours")
+        return self._output("/contours", "/cryptomatte/mattes", instances)
 
 
     @property
@@ -160,11 +802,56 @@ class Cryptomatte(object):
         return self._sample.metadata["synthetic"]["cryptomatte"]["manifest"]
 
 
-    def materialize_bounds(self):
+    def instance_stats(self):
+        """Compute statistics for every instance in one pass over the Cryptomatte data.
+
+        An instance covers the pixels where its matte is at least 0.5, the same
+        threshold used for :meth:`contours`.  Bounding boxes enclose those
+        pixels, with edges halfway between pixel centers, which is where
+        contours cross a hard-edged matte.  Because contours interpolate
+        between pixels, boxes computed by :meth:`bbox` may differ slightly
+        where mattes are antialiased.
+
+        Returns
+        -------
+        stats: :class:`numpy.ndarray`
+            Structured array with one row for each of the :attr:`instances`,
+            containing fields "x", "y", "width", and "height" for the bounding
+            box in absolute pixel values (:any:`numpy.nan` for instances that
+            aren't visible), "area" containing the number of covered pixels,
+            and "coverage" containing the sum of the matte, i.e. the subpixel
+            area of the instance.
+        """
+        return self._sample.graph.output("/instance-stats")
+
+
+    def materialize_bounds(self, contours=True):
+        """Store bounding box and contour annotations in the sample metadata.
+
+        Existing bounding box and contour annotations are replaced.
+
+        Parameters
+        ----------
+        contours: :class:`bool`, optional
+            If :any:`True` (the default), store contour annotations, with
+            bounding boxes computed from the contours.  Otherwise, store just
+            bounding boxes, computed with :meth:`bboxes`, which is much faster.
+        """
         annotations = [annotation for annotation in self._sample.metadata.get("annotations", [])]
         annotations = [annotation for annotation in annotations if "bbox" not in annotation]
         annotations = [annotation for annotation in annotations if "contours" not in annotation]
 
+        if not contours:
+            for instance, bbox in self.bboxes().items():
+                category, index = instance.rsplit("/", 1)
+                annotations.append({
+                    "category": category,
+                    "bbox": bbox,
+                    "bbox_mode": "XYWH_ABS",
+                })
+            self._sample.update_metadata({"annotations": annotations})
+            return
+
         for instance in self.instances:
             category, index = instance.rsplit("/", 1)
 
@@ -172,13 +859,13 @@ class Cryptomatte(object):
             if contours:
                 annotations.append({
                     "category": category,
-                    "contours": [contour.tolist() for contour in self.contours(instance)],
+                    "contours": [contour.tolist() for contour in contours],
                     "contour_mode": "XY_ABS",
                 })
 
                 annotations.append({
                     "category": category,
-                    "bbox": self.bbox(instance),
+                    "bbox": _contours_bbox(contours),
                     "bbox_mode": "XYWH_ABS",
                 })
         self._sample.update_metadata({"annotations": annotations})
@@ -202,7 +889,7 @@ class Cryptomatte(object):
 #        self._sample.update_metadata(updates)
 
 
-    def matte(self, instances=None):
+    def matte(self, instances=None, roi=None):
         """Compute matte images.
 
         Note that mattes are computed from Cryptomatte data, and are subpixel accurate:
@@ -216,34 +903,119 @@ class Cryptomatte(object):
             Otherwise, returns a matte that contains just the given object
             instances.
 
+        roi: (x, y, width, height) tuple, optional
+            If specified, only the given region of the Cryptomatte is read
+            and decoded, and the returned matte contains just that region,
+            clipped to the image bounds.
+
         Returns
         -------
         matte: :class:`imagecat.data.Image`
             Imagecat image containing the given matte.
         """
+        if roi is None:
+            return self._output("/cryptomatte", "/cryptomatte/mattes", instances)
+
         if instances is None:
             instances = self.instances
         elif isinstance(instances, str):
             instances = [instances]
-        self._sample.graph.set_task("/cryptomatte/mattes", graphcat.constant(instances))
-        return self._sample.graph.output("/cryptomatte")
+        instances = list(instances)
+        roi = tuple(int(value) for value in roi)
 
+        def decode():
+            filename = self._sample.metadata["synthetic"]["cryptomatte"]["filename"]
+            image = self._sample._cropped("/load-cryptomatte", filename, None, roi)
+            return _decode_cryptomatte(image, self.instances)
 
-    def resized_matte(self, instances, res):
+        def extract():
+            return _extract_matte(self._sample.memo.memoize(("/cryptomatte-decode", roi), decode), instances)
+
+        return self._sample.memo.memoize(("/cryptomatte", tuple(instances), roi), extract)
+
+
+    def resized_matte(self, instances, res, filter=None):
         """Compute a resized matte image.
 
+        Parameters
+        ----------
+        instances: :class:`str`, :class:`list` of :class:`str`, or :any:`None`, required
+            Object instances to include in the matte, see :meth:`matte`.
+        res: (width, height) tuple, required
+            Size of the resized matte.
+        filter: :class:`str`, optional
+            If :any:`None` (the default), the matte is resized with
+            :func:`imagecat.operator.transform.resize`.  Otherwise, it is
+            resized by a :any:`Resizer` using the given filter.  "area" is
+            recommended for mattes.
+
         Returns
         -------
         image: :class:`imagecat.data.Image` or :any:`None`
             Imagecat image containing the resized matte.
         """
+        if filter is None:
+            return self._output("/resize-cryptomatte", "/cryptomatte/mattes", instances, res=res)
+
         if instances is None:
             instances = self.instances
         elif isinstance(instances, str):
             instances = [instances]
-        self._sample.graph.set_task("/cryptomatte/mattes", graphcat.constant(instances))
-        self._sample.graph.set_task("/resize-cryptomatte/res", graphcat.constant(res))
-        return self._sample.graph.output("/resize-cryptomatte")
+        res = tuple(res)
+        resizer = _resizer(res, filter)
+        return self._sample.memo.memoize(("/resize-cryptomatte", tuple(instances), res, filter), lambda: resizer.resize_image(self.matte(instances)))
+
+
+    def resized_mattes(self, groups, res, filter=None):
+        """Compute several resized mattes at once.
+
+        The Cryptomatte is decoded once and every matte is extracted in a
+        single pass over the data, which is much faster than calling
+        :meth:`resized_matte` once for each matte.  If a filter is specified,
+        the mattes are also resized together in a single pass.
+
+        Parameters
+        ----------
+        groups: :class:`list`, required
+            One entry per matte, each containing the object instances to
+            include in that matte, see :meth:`matte`.
+        res: (width, height) tuple, required
+            Size of the resized mattes.
+        filter: :class:`str`, optional
+            Resampling filter, see :meth:`resized_matte`.
+
+        Returns
+        -------
+        mattes: :class:`numpy.ndarray`
+            Array with shape (height, width, len(groups)) containing one
+            resized matte per group.
+        """
+        groups = [[group] if isinstance(group, str) else list(group) for group in groups]
+        res = tuple(res)
+
+        def compute():
+            # Identical groups share a matte, and empty groups are left empty.
+            decoded = self._sample.graph.output("/cryptomatte-decode")
+            unique = list(dict.fromkeys(tuple(group) for group in groups if group))
+            result = numpy.zeros((res[1], res[0], len(groups)), dtype=decoded.coverage[0].dtype)
+            if not unique:
+                return result
+
+            data = _extract_mattes(decoded, unique)
+            if filter is not None:
+                data = _resizer(res, filter)(data)
+            else:
+                # Same resampling as imagecat.operator.transform.resize, one matte
+                # at a time, since skimage would also interpolate across mattes.
+                data = numpy.concatenate([skimage.transform.resize(data[:, :, [index]].astype(numpy.float32), (res[1], res[0]), anti_aliasing=True, order=3).astype(data.dtype) for index in range(data.shape[2])], axis=2)
+
+            for index, group in enumerate(groups):
+                if group:
+                    result[:, :, index] = data[:, :, unique.index(tuple(group))]
+            return result
+
+        key = ("/resize-mattes", tuple(tuple(group) for group in groups), res, filter)
+        return self._sample.memo.memoize(key, compute)
 
 
     def preview(self, show_bboxes=False, show_contours=False, instances=None):
@@ -345,12 +1117,28 @@ class Cryptomatte(object):
         matte: :class:`imagecat.data.Image`
             Imagecat image containing the given segmentation.
         """
+        return self._output("/cryptomatte-clown", "/cryptomatte-clown/mattes", instances)
+
+
+    def _output(self, task, mattes, instances, **parameters):
+        # Return a graph output for the given instances and parameters.  Outputs
+        # are memoized by the sample, so switching between instances doesn't
+        # recompute them.
         if instances is None:
             instances = self.instances
         elif isinstance(instances, str):
             instances = [instances]
-        self._sample.graph.set_task("/cryptomatte-clown/mattes", graphcat.constant(instances))
-        return self._sample.graph.output("/cryptomatte-clown")
+        instances = list(instances)
+        parameters = {name: tuple(value) if isinstance(value, list) else value for name, value in parameters.items()}
+
+        def compute():
+            self._sample._set_parameter(mattes, instances)
+            for name, value in parameters.items():
+                self._sample._set_parameter(f"{task}/{name}", value)
+            return self._sample.graph.output(task)
+
+        key = (task, tuple(instances), tuple(sorted(parameters.items())))
+        return self._sample.memo.memoize(key, compute)
 
 
 class Synthetic(object):
@@ -359,6 +1147,8 @@ class Synthetic(object):
     There is no reason to create an instance of this class yourself, callers
     should obtain instances from the :meth:`Sample.synthetic` property.
     """
+    __slots__ = ["_sample", "_cryptomatte"]
+
     def __init__(self, sample):
         self._sample = sample
 
@@ -384,15 +1174,51 @@ class Synthetic(object):
         return self._cryptomatte
 
 
-    @property
-    def depth(self):
-        """Rendered depth (LIDAR) image for this sample.
+    def cropped_depth(self, roi):
+        """Region of the rendered depth image for this sample.
 
-        Returns
-        -------
-        image: :class:`imagecat.data.Image`
+        Only the scanlines containing the region are read and decoded.
+
+        Parameters
+        ----------
+        roi: (x, y, width, height) tuple, required
+            Region of interest, in pixels.  The region is clipped to the image bounds.
+
+        Returns
+        -------
+        image: :class:`imagecat.data.Image`
         """
-        return self._sample.graph.output("/remap-render-depth")
+        filename = self._sample.metadata["synthetic"]["image"]["filename"]
+        return self._sample._cropped("/load-render-depth", filename, _render_depth_mapping, roi)
+
+
+    def cropped_image(self, roi):
+        """Region of the rendered image for this sample.
+
+        Only the scanlines containing the region are read and decoded.
+
+        Parameters
+        ----------
+        roi: (x, y, width, height) tuple, required
+            Region of interest, in pixels.  The region is clipped to the image bounds.
+
+        Returns
+        -------
+        image: :class:`imagecat.data.Image`
+        """
+        filename = self._sample.metadata["synthetic"]["image"]["filename"]
+        return self._sample._cropped("/load-render-image", filename, _render_image_mapping, roi)
+
+
+    @property
+    def depth(self):
+        """Rendered depth (LIDAR) image for this sample.
+
+        Returns
+        -------
+        image: :class:`imagecat.data.Image`
+        """
+        return self._sample.graph.output("/load-render-depth")
 
 
     @property
@@ -408,7 +1234,7 @@ class Synthetic(object):
         -------
         image: :class:`imagecat.data.Image`
         """
-        return self._sample.graph.output("/remap-render-image")
+        return self._sample.graph.output("/load-render-image")
 
 
     def materialize_image(self):
@@ -434,8 +1260,8 @@ class Synthetic(object):
         self._sample.update_metadata(updates)
 
 
-def _bbox_task(graph, name, inputs):
-    contours = inputs.getone("contours")
+def _contours_bbox(contours):
+    # Compute an (x, y, width, height) bounding box from a collection of contours.
     if not contours:
         return None
 
@@ -444,10 +1270,210 @@ def _bbox_task(graph, name, inputs):
     ymin = points[:, 1].min(axis=0)
     xmax = points[:, 0].max(axis=0)
     ymax = points[:, 1].max(axis=0)
+    return (xmin, ymin, xmax-xmin, ymax-ymin)
 
-    log.info(f"Task {name} completed.")
 
-    return (xmin, ymin, xmax-xmin, ymax-ymin)
+def _bbox_task(graph, name, inputs):
+    contours = inputs.getone("contours")
+    if not contours:
+        return None
+
+    bbox = _contours_bbox(contours)
+
+    log.debug(f"Task {name} completed.")
+
+    return bbox
+
+
+_DecodedCryptomatte = collections.namedtuple("_DecodedCryptomatte", ["instances", "ids", "labels", "coverage"])
+
+
+def _cryptomatte_layers(image):
+    # Return the (id, coverage) layer names for each rank in an image
+    # containing a single Cryptomatte, in the same order as imagecat.
+    names = [value for key, value in image.metadata.items() if re.fullmatch(r"cryptomatte/(.{7})/name", key)]
+    if not names:
+        raise RuntimeError("No matching Cryptomattes were found.")
+    if len(names) > 1:
+        raise ValueError("A specific Cryptomatte must be chosen.")
+
+    pattern = f"{names[0]}\\d{{2}}[.](red|green|blue|alpha|r|g|b|a)"
+    layers = [layer for layer in image.layers.keys() if re.match(pattern, layer, re.IGNORECASE)]
+    if not layers:
+        raise RuntimeError("No matching Cryptomatte layers were found.")
+
+    channels = {"red":0, "r":0, "green":1, "g":1, "blue":2, "b":2, "alpha":3, "a":3}
+    layers = sorted(layers, key=lambda layer: channels.get(layer.rsplit(".", 1)[1].lower()))
+    layers = sorted(layers, key=lambda layer: layer.rsplit(".", 1)[0])
+    return list(zip(layers[0::2], layers[1::2]))
+
+
+def _cryptomatte_id(instance):
+    return numpy.float32(imagecat.operator.cryptomatte._name_to_float32(instance))
+
+
+def _decode_cryptomatte(image, instances):
+    # Decode every rank of a Cryptomatte in a single pass, labelling each
+    # pixel with the index of the instance it contains, or -1.
+    hashes = numpy.array([_cryptomatte_id(instance) for instance in instances], dtype=numpy.float32)
+    order = numpy.argsort(hashes, kind="stable")
+    hashes = hashes[order]
+
+    ids = []
+    labels = []
+    coverage = []
+    for id_layer, coverage_layer in _cryptomatte_layers(image):
+        rank_ids = image.layers[id_layer].data
+        if len(hashes):
+            positions = numpy.searchsorted(hashes, rank_ids).clip(max=len(hashes) - 1)
+            rank_labels = numpy.where(hashes[positions] == rank_ids, order[positions], -1).astype(numpy.int32)
+        else:
+            rank_labels = numpy.full(rank_ids.shape, -1, dtype=numpy.int32)
+        ids.append(rank_ids)
+        labels.append(rank_labels)
+        coverage.append(image.layers[coverage_layer].data)
+    return _DecodedCryptomatte(list(instances), ids, labels, coverage)
+
+
+def _cryptomatte_decode_task(graph, name, inputs):
+    image = inputs.getone("image")
+    instances = inputs.getone("instances")
+
+    decoded = _decode_cryptomatte(image, instances)
+
+    log.debug(f"Task {name} completed.")
+    return decoded
+
+
+_instance_stats_dtype = numpy.dtype([
+    ("x", numpy.float64),
+    ("y", numpy.float64),
+    ("width", numpy.float64),
+    ("height", numpy.float64),
+    ("area", numpy.int64),
+    ("coverage", numpy.float64),
+    ])
+
+
+def _instance_stats_task(graph, name, inputs):
+    # Compute statistics for every instance in a decoded Cryptomatte using
+    # per-instance row and column histograms, without tracing contours.
+    decoded = inputs.getone("decoded")
+    count = len(decoded.instances)
+    height, width = decoded.ids[0].shape[:2]
+
+    coverage = numpy.zeros(count, dtype=numpy.float64)
+    columns = numpy.zeros(count * width, dtype=numpy.int64)
+    rows = numpy.zeros(count * height, dtype=numpy.int64)
+    for rank_labels, rank_coverage in zip(decoded.labels, decoded.coverage):
+        rank_labels = rank_labels[:,:,0]
+        rank_coverage = rank_coverage[:,:,0]
+        coverage += numpy.bincount(rank_labels.ravel() + 1, weights=rank_coverage.ravel(), minlength=count + 1)[1:]
+
+        # Pixels inside an instance are the same ones enclosed by its contours.
+        y, x = numpy.nonzero((rank_labels >= 0) & (rank_coverage >= 0.5))
+        labels = rank_labels[y, x]
+        columns += numpy.bincount(labels * width + x, minlength=count * width)
+        rows += numpy.bincount(labels * height + y, minlength=count * height)
+
+    columns = columns.reshape((count, width))
+    rows = rows.reshape((count, height)) > 0
+
+    stats = numpy.zeros(count, dtype=_instance_stats_dtype)
+    stats["area"] = columns.sum(axis=1)
+    stats["coverage"] = coverage
+    columns = columns > 0
+    visible = columns.any(axis=1)
+    xmin = numpy.argmax(columns, axis=1)
+    xmax = width - 1 - numpy.argmax(columns[:, ::-1], axis=1)
+    ymin = numpy.argmax(rows, axis=1)
+    ymax = height - 1 - numpy.argmax(rows[:, ::-1], axis=1)
+    # Box edges fall halfway between pixel centers, where contours cross a hard edge.
+    stats["x"] = numpy.where(visible, xmin - 0.5, numpy.nan)
+    stats["y"] = numpy.where(visible, ymin - 0.5, numpy.nan)
+    stats["width"] = numpy.where(visible, xmax - xmin + 1, numpy.nan)
+    stats["height"] = numpy.where(visible, ymax - ymin + 1, numpy.nan)
+
+    log.debug(f"Task {name} completed.")
+    return stats
+
+
+def _cryptomatte_selection(decoded, rank, mattes):
+    # Return a boolean mask of the pixels in one rank that belong to the given mattes.
+    lookup = {instance: index for index, instance in reversed(list(enumerate(decoded.instances)))}
+    selected = numpy.zeros(len(decoded.instances) + 1, dtype=bool)
+    selection = None
+    for matte in mattes:
+        index = lookup.get(matte)
+        if index is not None:
+            selected[index] = True
+        else:
+            # Instances outside the manifest are matched by their ID.
+            matches = decoded.ids[rank] == _cryptomatte_id(matte)
+            selection = matches if selection is None else selection | matches
+    # Unlabelled pixels (-1) index the last, unselected entry.
+    result = selected[decoded.labels[rank]]
+    return result if selection is None else result | selection
+
+
+def _extract_matte(decoded, mattes):
+    # Extract a matte from a decoded Cryptomatte, with the same results as imagecat.operator.cryptomatte.decoder.
+    data = numpy.zeros(decoded.ids[0].shape, dtype=decoded.ids[0].dtype)
+    for rank, rank_coverage in enumerate(decoded.coverage):
+        numpy.add(data, rank_coverage, out=data, where=_cryptomatte_selection(decoded, rank, mattes))
+    return imagecat.data.Image(layers={"M": imagecat.data.Layer(data=data, role=imagecat.data.Role.MATTE)})
+
+
+def _extract_mattes(decoded, groups):
+    # Extract one matte per group in a single pass over the Cryptomatte ranks,
+    # stacked along the last axis, with the same results as _extract_matte.
+    lookup = {instance: index for index, instance in reversed(list(enumerate(decoded.instances)))}
+    dtype = decoded.coverage[0].dtype
+    table = numpy.zeros((len(decoded.instances) + 1, len(groups)), dtype=dtype)
+    fallback = []
+    for column, group in enumerate(groups):
+        indices = [lookup.get(instance) for instance in group]
+        if None in indices:
+            # Instances outside the manifest have to be matched by their ID.
+            fallback.append(column)
+        table[[index for index in indices if index is not None], column] = 1
+
+    # Only pixels labelled with an instance in at least one group contribute.
+    selected = table.any(axis=1)
+    mattes = numpy.zeros(decoded.coverage[0].shape[:2] + (len(groups),), dtype=dtype)
+    flat = mattes.reshape(-1, len(groups))
+    for labels, coverage in zip(decoded.labels, decoded.coverage):
+        labels = labels.reshape(-1)
+        pixels = numpy.flatnonzero(selected[labels])
+        flat[pixels] += table[labels[pixels]] * coverage.reshape(-1, 1)[pixels]
+    for column in fallback:
+        mattes[:, :, column:column + 1] = _extract_matte(decoded, groups[column]).layers["M"].data
+    return mattes
+
+
+def _matte_task(graph, name, inputs):
+    decoded = inputs.getone("decoded")
+    mattes = list(inputs.getone("mattes"))
+
+    matte = _extract_matte(decoded, mattes)
+
+    log.debug(f"Task {name} completed.")
+    return matte
+
+
+def _clown_task(graph, name, inputs):
+    # Assign a unique color to each matte, using the top-ranked instance in each pixel, like imagecat.
+    decoded = inputs.getone("decoded")
+    mattes = list(inputs.getone("mattes"))
+
+    rank_ids = decoded.ids[0]
+    data = numpy.zeros((rank_ids.shape[0], rank_ids.shape[1], 3), dtype=numpy.float32)
+    for matte in mattes:
+        selection = _cryptomatte_selection(decoded, 0, [matte])[:,:,0]
+        data[selection] = numpy.random.default_rng(imagecat.operator.cryptomatte._float32_to_int32(_cryptomatte_id(matte))).uniform(size=3)
+
+    log.debug(f"Task {name} completed.")
+    return imagecat.data.Image(layers={"M": imagecat.data.Layer(data=data, role=imagecat.data.Role.RGB)})
 
 
 def _contours_task(graph, name, inputs):
@@ -467,32 +1493,193 @@ def _contours_task(graph, name, inputs):
     # Swap coordinates from (row, col) to (x, y)
     contours = [contour[:,[1, 0]] for contour in contours]
 
-    log.info(f"Task {name} completed.")
+    log.debug(f"Task {name} completed.")
     return contours
 
 
+class _OpenEXRMetadataEncoder(json.JSONEncoder):
+    # Converts OpenEXR header values to JSON, the same way as imagecat.
+    def default(self, o):
+        if isinstance(o, bytes):
+            return o.decode("UTF-8")
+        elif isinstance(o, Imath.Channel):
+            return (o.type, o.xSampling, o.ySampling)
+        elif isinstance(o, (Imath.Compression, Imath.LineOrder, Imath.PixelType)):
+            return str(o)
+        elif isinstance(o, (Imath.V2f, Imath.V2i, Imath.point)):
+            return (o.x, o.y)
+        elif isinstance(o, (Imath.Box, Imath.Box2f, Imath.Box2i)):
+            return (o.min.x, o.min.y, o.max.x, o.max.y)
+        return super().default(o)
+
+
+_openexr_dtypes = {
+    Imath.PixelType.HALF: numpy.float16,
+    Imath.PixelType.FLOAT: numpy.float32,
+    Imath.PixelType.UINT: numpy.int32, # Matches imagecat.
+    }
+
+
+def _roi_bounds(roi, width, height):
+    # Convert an (x, y, width, height) region of interest to (x0, y0, x1, y1) bounds, clipped to an image.
+    x, y, w, h = roi
+    x0, y0, x1, y1 = max(x, 0), max(y, 0), min(x + w, width), min(y + h, height)
+    if x0 >= x1 or y0 >= y1:
+        raise ValueError(f"Region of interest {tuple(roi)} doesn't overlap the {width}x{height} image.")
+    return x0, y0, x1, y1
+
+
+def _read_openexr_channels(reader, header, names, rows):
+    # Decode channels as 2D arrays, reading only the given range of scanlines, if any.
+    if rows is None:
+        return dict(zip(names, reader.channels(names)))
+
+    # Channels with the same pixel type are read together.
+    first = header["dataWindow"].min.y
+    pixels = {}
+    for name in names:
+        if name not in pixels:
+            pixel_type = header["channels"][name].type
+            group = [other for other in names if other not in pixels and header["channels"][other].type.v == pixel_type.v]
+            pixels.update(zip(group, reader.channels(group, pixel_type, first + rows[0], first + rows[1] - 1)))
+    return pixels
+
+
+def _load_openexr(source, mapping=None, roi=None):
+    # Load an OpenEXR image from a path or file-like object.  By default, every
+    # channel is loaded with the same layers and metadata as imagecat.operator.load.
+    # Otherwise, only the channels selected by a mapping in the same format as
+    # imagecat.operator.remap are decoded.  If a region of interest is given,
+    # only the scanlines that it contains are decoded.
+    reader = OpenEXR.InputFile(source)
+    header = reader.header()
+    width = header["dataWindow"].max.x - header["dataWindow"].min.x + 1
+    height = header["dataWindow"].max.y - header["dataWindow"].min.y + 1
+    metadata = json.loads(json.dumps(header, cls=_OpenEXRMetadataEncoder))
+
+    rows = None
+    columns = slice(None)
+    if roi is not None:
+        x0, y0, x1, y1 = _roi_bounds(roi, width, height)
+        rows = (y0, y1)
+        columns = slice(x0, x1)
+        height = y1 - y0
+
+    if mapping is None:
+        names = list(header["channels"])
+        pixels = _read_openexr_channels(reader, header, names, rows)
+        layers = {}
+        for name in names:
+            data = numpy.frombuffer(pixels.pop(name), dtype=_openexr_dtypes[header["channels"][name].type.v]).reshape((height, width, 1))
+            layers[name] = imagecat.data.Layer(data=data[:, columns], role=imagecat.data.Role.NONE)
+        return imagecat.data.Image(layers=layers, metadata=metadata)
+
+    names = [name for spec in mapping.values() for name in spec["selection"]]
+    pixels = _read_openexr_channels(reader, header, names, rows)
+
+    layers = {}
+    for layer, spec in mapping.items():
+        selection = spec["selection"]
+        channel_dtypes = [_openexr_dtypes[header["channels"][name].type.v] for name in selection]
+        data = numpy.empty((height, len(range(width)[columns]), len(selection)), dtype=numpy.result_type(*channel_dtypes))
+        for index, (name, dtype) in enumerate(zip(selection, channel_dtypes)):
+            data[:,:,index] = numpy.frombuffer(pixels.pop(name), dtype=dtype).reshape((height, width))[:, columns]
+        layers[layer] = imagecat.data.Layer(data=data, role=spec["role"])
+    return imagecat.data.Image(layers=layers, metadata=metadata)
+
+
+def _crop_image(image, roi):
+    # Return an image containing views of a region of interest.
+    height, width = next(iter(image.layers.values())).data.shape[:2]
+    x0, y0, x1, y1 = _roi_bounds(roi, width, height)
+    layers = {name: imagecat.data.Layer(data=layer.data[y0:y1, x0:x1], role=layer.role) for name, layer in image.layers.items()}
+    return imagecat.data.Image(layers=layers, metadata=image.metadata)
+
+
+def _load_image(name, path, mapping=None, roi=None):
+    # Load an image from a file, which may be a member of a shard.
+    if os.path.splitext(path)[1].lower() == ".exr":
+        if _split_shard_path(path) is None:
+            return _load_openexr(path, mapping, roi)
+        return _load_openexr(io.BytesIO(_read_file(path)), mapping, roi)
+
+    if _split_shard_path(path) is None:
+        for loader in imagecat.io.loaders:
+            image = loader(name, path, "*")
+            if image is not None:
+                break
+        else:
+            raise RuntimeError(f"Task {name} could not load {path} from disk.")
+    else:
+        image = imagecat.io.pil_loader(name, io.BytesIO(_read_file(path)), "*")
+
+    # Other formats must be decoded in their entirety.
+    if roi is not None:
+        image = _crop_image(image, roi)
+    return image
+
+
+def _load_variant(mapping):
+    # Identify the channels loaded by a mapping, for the image cache.
+    if mapping is None:
+        return ""
+    return ";".join(f"{layer}={','.join(spec['selection'])}" for layer, spec in mapping.items())
+
+
+_render_image_mapping = {"C":{"role": imagecat.data.Role.RGB, "selection":["R", "G", "B"]}}
+_render_depth_mapping = {"Z":{"role": imagecat.data.Role.DEPTH, "selection":["Z"]}}
+
+
+def _load_task(graph, name, inputs):
+    path = inputs.getone("path")
+    cache = inputs.getone("cache")
+    mapping = inputs.get("mapping")
+
+    if cache is None:
+        image = _load_image(name, path, mapping)
+    else:
+        image = cache.load(path, functools.partial(_load_image, name, path, mapping), variant=_load_variant(mapping))
+
+    log.debug(f"Task {name} completed.")
+    return image
+
+
 class Sample(object):
     """Provides access to one sample within a :ref:`specification` dataset.
 
     Although callers are free to create :any:`Sample` objects directly, they
     are typically returned from an instance of :any:`Dataset`.
 
+    Samples can be used as context managers, calling :meth:`release` on exit::
+
+        with dataset[0] as sample:
+            image = sample.image
+
     Parameters
     ----------
     path: :class:`str`, required
-        Absolute path to the JSON metadata file for a sample.
+        Absolute path to the JSON metadata file for a sample.  Samples stored
+        in a shard (see :any:`ShardWriter`) use the path of the shard followed
+        by the name of the metadata file within the shard, e.g.
+        ``/data/shard-000000.limbo.tar/image_0000000.json``.
+    image_cache: :any:`ImageCache`, optional
+        If specified, decoded images are stored in and loaded from the given cache.
     """
-    def __init__(self, path):
-        self._path = os.path.abspath(path)
-        with open(path, "rb") as stream:
-            self._metadata = json.load(stream)
+    __slots__ = ["_path", "_image_cache", "_metadata", "_synthetic", "_graph", "_memo"]
 
+    def __init__(self, path, image_cache=None):
+        self._path = os.path.abspath(path)
+        self._image_cache = image_cache
+        self._metadata = None
+        self._synthetic = None
         self._graph = None
+        self._memo = None
 
-        if "synthetic" in self._metadata:
-            self._synthetic = Synthetic(self)
-        else:
-            self._synthetic = None
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
 
     def __repr__(self):
         return f"limbo.data.Sample(path={self._path!r})"
@@ -506,7 +1693,28 @@ class Sample(object):
         -------
         categories: :class:`set` of :class:`str`
         """
-        return {annotation["category"] for annotation in self._metadata.get("annotations", [])}
+        return {annotation["category"] for annotation in self.metadata.get("annotations", [])}
+
+
+    def cropped_image(self, roi):
+        """Region of the reference image for this sample, if it exists.
+
+        Reference images are stored in formats that must be decoded in their
+        entirety, so this is a convenience that doesn't save decoding time,
+        unlike :meth:`Synthetic.cropped_image`.
+
+        Parameters
+        ----------
+        roi: (x, y, width, height) tuple, required
+            Region of interest, in pixels.  The region is clipped to the image bounds.
+
+        Returns
+        -------
+        image: :class:`imagecat.data.Image` or :any:`None`
+        """
+        if "image" not in self.metadata:
+            return None
+        return self._cropped("/load-image", self.metadata["image"]["filename"], None, roi)
 
 
     @property
@@ -531,7 +1739,14 @@ class Sample(object):
 
 
     def delete(self):
-        """Unconditionally remove this sample and related files."""
+        """Unconditionally remove this sample and related files.
+
+        Raises
+        ------
+        :class:`RuntimeError`
+            If the sample is stored in a shard, which is read-only.
+        """
+        self._require_writable()
         paths = [self.default_cryptomatte_path, self.default_image_path, self.default_synthetic_path, self.path]
         for path in paths:
             if os.path.exists(path):
@@ -552,47 +1767,51 @@ class Sample(object):
             graph = graphcat.StaticGraph()
 
             # Prepare to load the training image, if it exists.
-            if "image" in self._metadata:
-                filename = self._metadata["image"]["filename"]
+            if "image" in self.metadata:
+                filename = self.metadata["image"]["filename"]
                 path = os.path.join(os.path.dirname(self._path), filename)
-                imagecat.add_task(graph, "/load-image", imagecat.operator.load, path=path)
+                imagecat.add_task(graph, "/load-image", _load_task, path=path, cache=self._image_cache)
                 imagecat.add_task(graph, "/resize-image", imagecat.operator.transform.resize, res=None)
                 imagecat.add_links(graph, "/load-image", ("/resize-image", "image"))
 
     #        imagecat.add_task(graph, "/load-segmentation", imagecat.operator.load, path=None)
 
             # Prepare to load the synthetic image, if it exists.
-            if "synthetic" in self._metadata:
-                filename = self._metadata["synthetic"]["image"]["filename"]
+            if "synthetic" in self.metadata:
+                filename = self.metadata["synthetic"]["image"]["filename"]
                 path = os.path.join(os.path.dirname(self._path), filename)
 
-                imagecat.add_task(graph, "/load-render-image", imagecat.operator.load, path=path)
-                imagecat.add_task(graph, "/remap-render-image", imagecat.operator.remap, mapping={"C":{"role": imagecat.data.Role.RGB, "selection":["R", "G", "B"]}})
-                imagecat.add_task(graph, "/remap-render-depth", imagecat.operator.remap, mapping={"Z":{"role": imagecat.data.Role.DEPTH, "selection":["Z"]}})
+                # The color and depth channels are loaded separately, so callers only decode what they use.
+                imagecat.add_task(graph, "/load-render-image", _load_task, path=path, cache=self._image_cache, mapping=_render_image_mapping)
+                imagecat.add_task(graph, "/load-render-depth", _load_task, path=path, cache=self._image_cache, mapping=_render_depth_mapping)
                 imagecat.add_task(graph, "/save-image", imagecat.operator.save, path=None)
-                imagecat.add_links(graph, "/load-render-image", ("/remap-render-image", "image"))
-                imagecat.add_links(graph, "/load-render-image", ("/remap-render-depth", "image"))
-                imagecat.add_links(graph, "/remap-render-image", ("/save-image", "image"))
+                imagecat.add_links(graph, "/load-render-image", ("/save-image", "image"))
 
                 # Prepare to load the cryptomatte image, if it exists.
-                if "cryptomatte" in self._metadata["synthetic"]:
-                    filename = self._metadata["synthetic"]["cryptomatte"]["filename"]
+                if "cryptomatte" in self.metadata["synthetic"]:
+                    filename = self.metadata["synthetic"]["cryptomatte"]["filename"]
                     path = os.path.join(os.path.dirname(self._path), filename)
 
-                    imagecat.add_task(graph, "/load-cryptomatte", imagecat.operator.load, path=path)
-                    imagecat.add_task(graph, "/cryptomatte", imagecat.operator.cryptomatte.decoder, mattes=None)
+                    # The Cryptomatte is decoded once, and every matte is extracted from the decoded data.
+                    instances = self.metadata["synthetic"]["cryptomatte"]["manifest"]
+                    imagecat.add_task(graph, "/load-cryptomatte", _load_task, path=path, cache=self._image_cache)
+                    imagecat.add_task(graph, "/cryptomatte-decode", _cryptomatte_decode_task, instances=instances)
+                    imagecat.add_task(graph, "/cryptomatte", _matte_task, mattes=None)
                     imagecat.add_task(graph, "/resize-cryptomatte", imagecat.operator.transform.resize, res=None)
-                    imagecat.add_task(graph, "/cryptomatte-clown", imagecat.operator.cryptomatte.decoder, clown=True, mattes=None)
+                    imagecat.add_task(graph, "/cryptomatte-clown", _clown_task, mattes=None)
     #        imagecat.add_task(graph, "/save-segmentation", imagecat.operator.save, path=None)
 
                     imagecat.add_task(graph, "/contours", _contours_task)
                     imagecat.add_task(graph, "/bbox", _bbox_task)
+                    imagecat.add_task(graph, "/instance-stats", _instance_stats_task)
 
-                    imagecat.add_links(graph, "/load-cryptomatte", ("/cryptomatte", "image"))
+                    imagecat.add_links(graph, "/load-cryptomatte", ("/cryptomatte-decode", "image"))
+                    imagecat.add_links(graph, "/cryptomatte-decode", ("/cryptomatte", "decoded"))
+                    imagecat.add_links(graph, "/cryptomatte-decode", ("/instance-stats", "decoded"))
                     imagecat.add_links(graph, "/cryptomatte", ("/contours", "image"))
                     imagecat.add_links(graph, "/cryptomatte", ("/resize-cryptomatte", "image"))
                     imagecat.add_links(graph, "/contours", ("/bbox", "contours"))
-                    imagecat.add_links(graph, "/load-cryptomatte", ("/cryptomatte-clown", "image"))
+                    imagecat.add_links(graph, "/cryptomatte-decode", ("/cryptomatte-clown", "decoded"))
     #        imagecat.add_links(graph, "/cryptomatte-clown", ("/save-segmentation", "image"))
 
             self._graph = graph
@@ -607,22 +1826,41 @@ class Sample(object):
         -------
         image: :class:`imagecat.data.Image` or :any:`None`
         """
-        if "image" not in self._metadata:
+        if "image" not in self.metadata:
             return None
         return self.graph.output("/load-image")
 
 
-    def resized_image(self, res):
+    def resized_image(self, res, filter=None):
         """Resized reference image for this sample, if it exists.
 
+        Parameters
+        ----------
+        res: (width, height) tuple, required
+            Size of the resized image.
+        filter: :class:`str`, optional
+            If :any:`None` (the default), the image is resized with
+            :func:`imagecat.operator.transform.resize`.  Otherwise, it is
+            resized by a :any:`Resizer` using the given filter, which is much
+            faster.
+
         Returns
         -------
         image: :class:`imagecat.data.Image` or :any:`None`
         """
-        if "image" not in self._metadata:
+        if "image" not in self.metadata:
             return None
-        self.graph.set_task("/resize-image/res", graphcat.constant(res))
-        return self.graph.output("/resize-image")
+        res = tuple(res)
+
+        if filter is not None:
+            resizer = _resizer(res, filter)
+            return self.memo.memoize(("/resize-image", res, filter), lambda: resizer.resize_image(self.image))
+
+        def compute():
+            self._set_parameter("/resize-image/res", res)
+            return self.graph.output("/resize-image")
+
+        return self.memo.memoize(("/resize-image", res), compute)
 
 
     @property
@@ -633,20 +1871,42 @@ class Sample(object):
         -------
         image: :class:`str` or :any:`None`
         """
-        if "image" in self._metadata:
-            filename = self._metadata["image"]["filename"]
+        if "image" in self.metadata:
+            filename = self.metadata["image"]["filename"]
             return os.path.join(os.path.dirname(self._path), filename)
         return None
 
 
+    @property
+    def memo(self):
+        """Cache of images and annotations computed for this sample.
+
+        Mattes, contours, bounding boxes, segmentations, and resized images are
+        cached using the instances and resolution they were computed for, so
+        repeated requests don't recompute them.  Use :attr:`MemoCache.maxbytes`
+        to control how much memory is used.
+
+        Returns
+        -------
+        memo: :any:`MemoCache`
+        """
+        if self._memo is None:
+            self._memo = MemoCache()
+        return self._memo
+
+
     @property
     def metadata(self):
         """Metadata for this sample.
 
+        The metadata is read from disk the first time it is accessed.
+
         Returns
         -------
         metadata: :class:`dict`
         """
+        if self._metadata is None:
+            self._metadata = _json_loads(_read_file(self._path))
         return self._metadata
 
 
@@ -707,7 +1967,7 @@ class Sample(object):
         color = itertools.cycle(imagecat.color.brewer.palette("Set1").colors)
         colors = {}
         categories = {}
-        annotations = self._metadata.get("annotations", [])
+        annotations = self.metadata.get("annotations", [])
         for annotation in annotations:
             category = annotation["category"]
             if category not in categories:
@@ -715,7 +1975,7 @@ class Sample(object):
             colors[category] = categories[category]
 
         # Start drawing.
-        res = self._metadata["image"]["res"]
+        res = self.metadata["image"]["res"]
         surface = skia.Surface(res[0], res[1])
         canvas = surface.getCanvas()
         canvas.clear(skia.Color4f.kWhite)
@@ -729,7 +1989,7 @@ class Sample(object):
 
         # Draw contours.
         if show_contours:
-            for annotation in self._metadata.get("annotations", []):
+            for annotation in self.metadata.get("annotations", []):
                 if "contours" not in annotation:
                     continue
                 if not include(annotation):
@@ -777,6 +2037,55 @@ class Sample(object):
         return surface
 
 
+    def release(self):
+        """Free memory used by this sample.
+
+        Discards the image processing graph along with any decoded images,
+        the :attr:`memo` cache, and the parsed metadata, leaving only the
+        sample path.  Everything is reloaded from disk on demand if the sample
+        is used again, so unsaved changes to :attr:`metadata` are lost.
+        """
+        self._metadata = None
+        self._synthetic = None
+        self._graph = None
+        self._memo = None
+
+
+    @property
+    def stat(self):
+        """Modification time and size of this sample's files.
+
+        Useful for detecting samples that have changed since they were last
+        processed.  Returns the latest modification time and total size of
+        the sample's metadata file and the image files it references, so
+        replacing an image is detected even if the metadata is unchanged.
+        For samples stored in a shard, the modification time and size of
+        the shard are returned.  Note that this reads the sample's metadata.
+
+        Returns
+        -------
+        stat: (mtime, size) tuple
+            Modification time in nanoseconds and size in bytes, or (-1, -1)
+            if any of the files can't be accessed.
+        """
+        mtime, size = _stat_sample(self._path)
+        if size < 0 or _split_shard_path(self._path) is not None:
+            return (mtime, size)
+
+        try:
+            filenames = _sample_filenames(self.metadata)
+        except (OSError, ValueError, KeyError, TypeError):
+            return (-1, -1)
+        directory = os.path.dirname(self._path)
+        for filename in filenames:
+            file_mtime, file_size = _stat_sample(os.path.join(directory, filename))
+            if file_size < 0:
+                return (-1, -1)
+            mtime = max(mtime, file_mtime)
+            size += file_size
+        return (mtime, size)
+
+
     @property
     def synthetic(self):
         """Optional synthetic data for this sample.
@@ -790,6 +2099,8 @@ class Sample(object):
         -------
         synthetic: :any:`Synthetic` or :any:`None`
         """
+        if self._synthetic is None and "synthetic" in self.metadata:
+            self._synthetic = Synthetic(self)
         return self._synthetic
 
 
@@ -801,10 +2112,909 @@ class Sample(object):
         updates: :class:`dict`, required
             Metadata information that will be merged
             with the existing metadata, and saved to disk.
+
+        Raises
+        ------
+        :class:`RuntimeError`
+            If the sample is stored in a shard, which is read-only.
+        """
+        self._require_writable()
+        self.metadata.update(updates)
+        data = _json_dumps(self._metadata, indent=True)
+        with open(self._path, "wb") as stream:
+            stream.write(data)
+
+
+    def _cropped(self, task, filename, mapping, roi):
+        # Load a region of an image, reusing a cached copy of the entire image if one exists.
+        roi = tuple(int(value) for value in roi)
+        path = os.path.join(os.path.dirname(self._path), filename)
+
+        def compute():
+            if self._image_cache is not None:
+                image = self._image_cache.get(path, _load_variant(mapping))
+                if image is not None:
+                    return _crop_image(image, roi)
+            return _load_image(task, path, mapping, roi)
+
+        return self.memo.memoize((task, roi), compute)
+
+
+    def _set_parameter(self, parameter, value):
+        # Change a graph parameter, unless it already has the given value, so
+        # downstream results are only recomputed when necessary.
+        if self.graph.output(parameter) != value:
+            self.graph.set_task(parameter, graphcat.constant(value))
+
+
+    def _require_writable(self):
+        if _split_shard_path(self._path) is not None:
+            raise RuntimeError(f"Samples stored in shards are read-only: {self._path}")
+
+
+class ShardWriter(object):
+    """Packs samples into a shard, a single file that stores many samples.
+
+    Datasets stored as millions of small files are slow to traverse and read
+    on many filesystems.  A shard stores the metadata and image files for
+    many samples in a single, tar-compatible file, followed by an index of
+    the offset and size of every file.  Reading a sample from a shard
+    requires a single seek and read, with no directory traversal.  Shards
+    are opened transparently by :any:`Dataset`, and are read-only.
+
+    Shard filenames must end with ".limbo.tar".  Use :ref:`limbo-pack` to
+    create shards from the command line.
+
+    Parameters
+    ----------
+    path: :class:`str`, required
+        Path of the shard to be written.  The shard is written to a temporary
+        file and moved into place when it is closed.
+    """
+    def __init__(self, path):
+        if not path.endswith(_shard_extension):
+            raise ValueError(f"Shard filenames must end with {_shard_extension}: {path}")
+        self._path = path
+        self._temp_path = f"{path}.{os.getpid()}.tmp"
+        self._stream = open(self._temp_path, "wb")
+        self._archive = tarfile.open(fileobj=self._stream, mode="w", format=tarfile.PAX_FORMAT)
+        self._members = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._archive.close()
+            self._stream.close()
+            os.remove(self._temp_path)
+
+    def __len__(self):
+        return len([member for member in self._members if member.endswith(".json")])
+
+    def __repr__(self):
+        return f"limbo.data.ShardWriter(path={self._path!r})"
+
+
+    def add(self, sample, prefix=""):
+        """Add a sample to the shard, along with its images.
+
+        Parameters
+        ----------
+        sample: :any:`Sample`, required
+            The sample to be added.
+        prefix: :class:`str`, optional
+            Directory within the shard where the sample will be stored.  Use this
+            to keep samples from different directories with the same filenames
+            apart.
+
+        Raises
+        ------
+        :class:`ValueError`
+            If the shard already contains a file with the same name.
+        """
+        directory = os.path.dirname(sample.path)
+        for filename in _sample_filenames(sample.metadata):
+            self._add_file(posixpath.join(prefix, filename), _read_file(os.path.join(directory, filename)))
+        self._add_file(posixpath.join(prefix, os.path.basename(sample.path)), _read_file(sample.path))
+
+
+    def close(self):
+        """Write the shard index, and move the shard into place."""
+        self._archive.close()
+        index = _json_dumps({"version": _shard_version, "members": self._members})
+        self._stream.write(index)
+        self._stream.write(len(index).to_bytes(8, "little"))
+        self._stream.write(_shard_magic)
+        self._stream.close()
+        os.replace(self._temp_path, self._path)
+
+
+    @property
+    def path(self):
+        """Path of the shard being written.
+
+        Returns
+        -------
+        path: :class:`str`
+        """
+        return self._path
+
+
+    def _add_file(self, name, data):
+        name = posixpath.normpath(name)
+        if name in self._members:
+            raise ValueError(f"Shard already contains {name}.")
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self._archive.addfile(info, io.BytesIO(data))
+        # File data is padded to a whole number of blocks, and follows the member header.
+        blocks = -(-info.size // tarfile.BLOCKSIZE)
+        self._members[name] = [self._archive.offset - blocks * tarfile.BLOCKSIZE, info.size]
+
+
+def _catalog_row(metadata):
+    # Summarize the metadata for one sample, for use by Catalog.
+    provenance = metadata.get("provenance") if "provenance" in metadata else None
+    synthetic = metadata.get("synthetic")
+    image_res = metadata["image"].get("res") if "image" in metadata else None
+
+    annotations = []
+    for annotation in metadata.get("annotations", []):
+        contours = len(annotation["contours"]) if "contours" in annotation else -1
+        annotations.append((annotation["category"], annotation.get("bbox"), contours))
+
+    return (
+        "image" in metadata,
+        synthetic is not None,
+        synthetic is not None and "cryptomatte" in synthetic,
+        provenance.get("license", "") if provenance is not None else None,
+        provenance.get("copyright", "") if provenance is not None else None,
+        image_res,
+        annotations,
+        )
+
+
+def _string_ids(values, table):
+    # Map strings to indices in a sorted string table, using -1 for missing values.
+    lookup = {value: index for index, value in enumerate(table)}
+    return numpy.array([lookup[value] if value is not None else -1 for value in values], dtype=numpy.int32)
+
+
+def _remap_ids(ids, table, new_table):
+    # Convert indices into one string table to indices into another.
+    mapping = numpy.searchsorted(new_table, table).astype(numpy.int32)
+    return numpy.where(ids >= 0, mapping[numpy.maximum(ids, 0)] if len(mapping) else -1, -1).astype(numpy.int32)
+
+
+class Catalog(object):
+    """Columnar summary of the metadata for every sample in a :any:`Dataset`.
+
+    Per-sample fields are stored in :class:`numpy.ndarray` objects with one
+    row per sample, in the same order as the dataset.  Annotations are stored
+    as ragged arrays: the annotations for sample ``i`` are rows
+    ``annotation_offsets[i]`` through ``annotation_offsets[i+1]`` of the
+    per-annotation arrays.  String values (categories, licenses, and
+    copyrights) are stored as integer indices into sorted string tables, with
+    -1 representing a missing value.
+
+    There is no reason to create an instance of this class yourself, callers
+    should obtain instances from :meth:`Dataset.catalog`.
+    """
+    _fields = [
+        "has_image",
+        "has_synthetic",
+        "has_cryptomatte",
+        "license",
+        "copyright",
+        "image_res",
+        "annotation_offsets",
+        "annotation_category",
+        "annotation_bbox",
+        "annotation_contours",
+        "categories",
+        "licenses",
+        "copyrights",
+        ]
+
+    def __init__(self, **fields):
+        for field in self._fields:
+            setattr(self, "_" + field, fields[field])
+
+
+    def __len__(self):
+        return len(self._has_image)
+
+
+    def __repr__(self):
+        return f"limbo.data.Catalog(samples={len(self)}, annotations={len(self._annotation_category)})"
+
+
+    @classmethod
+    def _from_rows(cls, rows):
+        annotations = [annotation for row in rows for annotation in row[6]]
+        categories = numpy.array(sorted({annotation[0] for annotation in annotations}), dtype=str)
+        licenses = numpy.array(sorted({row[3] for row in rows if row[3] is not None}), dtype=str)
+        copyrights = numpy.array(sorted({row[4] for row in rows if row[4] is not None}), dtype=str)
+
+        annotation_bbox = numpy.full((len(annotations), 4), numpy.nan)
+        for index, annotation in enumerate(annotations):
+            if annotation[1] is not None:
+                annotation_bbox[index] = annotation[1]
+
+        return cls(
+            has_image=numpy.array([row[0] for row in rows], dtype=bool),
+            has_synthetic=numpy.array([row[1] for row in rows], dtype=bool),
+            has_cryptomatte=numpy.array([row[2] for row in rows], dtype=bool),
+            license=_string_ids([row[3] for row in rows], licenses),
+            copyright=_string_ids([row[4] for row in rows], copyrights),
+            image_res=numpy.array([row[5] if row[5] is not None else (-1, -1) for row in rows], dtype=numpy.int32).reshape((-1, 2)),
+            annotation_offsets=numpy.concatenate(([0], numpy.cumsum([len(row[6]) for row in rows], dtype=numpy.int64))).astype(numpy.int64),
+            annotation_category=_string_ids([annotation[0] for annotation in annotations], categories),
+            annotation_bbox=annotation_bbox,
+            annotation_contours=numpy.array([annotation[2] for annotation in annotations], dtype=numpy.int32),
+            categories=categories,
+            licenses=licenses,
+            copyrights=copyrights,
+            )
+
+
+    @classmethod
+    def concatenate(cls, catalogs):
+        """Combine catalogs into a single catalog.
+
+        Parameters
+        ----------
+        catalogs: sequence of :any:`Catalog`, required
+            The catalogs to be combined, in order.
+
+        Returns
+        -------
+        catalog: :any:`Catalog`
+        """
+        catalogs = list(catalogs)
+        if not catalogs:
+            return cls._from_rows([])
+
+        fields = {}
+        for table, column in [("categories", "annotation_category"), ("licenses", "license"), ("copyrights", "copyright")]:
+            fields[table] = numpy.unique(numpy.concatenate([getattr(catalog, "_" + table) for catalog in catalogs])).astype(str)
+            fields[column] = numpy.concatenate([_remap_ids(getattr(catalog, "_" + column), getattr(catalog, "_" + table), fields[table]) for catalog in catalogs])
+
+        for field in ["has_image", "has_synthetic", "has_cryptomatte", "image_res", "annotation_bbox", "annotation_contours"]:
+            fields[field] = numpy.concatenate([getattr(catalog, "_" + field) for catalog in catalogs])
+
+        offsets = [numpy.zeros(1, dtype=numpy.int64)]
+        for catalog in catalogs:
+            offsets.append(catalog._annotation_offsets[1:] + offsets[-1][-1])
+        fields["annotation_offsets"] = numpy.concatenate(offsets)
+
+        return cls(**fields)
+
+
+    def take(self, indices):
+        """Return a catalog containing a subset of samples.
+
+        Parameters
+        ----------
+        indices: sequence of :class:`int`, required
+            Indices of the samples to keep, in order.  Indices may be repeated.
+
+        Returns
+        -------
+        catalog: :any:`Catalog`
+        """
+        indices = numpy.asarray(indices, dtype=numpy.int64).reshape(-1)
+        starts = self._annotation_offsets[indices]
+        counts = self._annotation_offsets[indices + 1] - starts
+        offsets = numpy.concatenate(([0], numpy.cumsum(counts))).astype(numpy.int64)
+        annotations = numpy.repeat(starts - offsets[:-1], counts) + numpy.arange(offsets[-1], dtype=numpy.int64)
+
+        return Catalog(
+            has_image=self._has_image[indices],
+            has_synthetic=self._has_synthetic[indices],
+            has_cryptomatte=self._has_cryptomatte[indices],
+            license=self._license[indices],
+            copyright=self._copyright[indices],
+            image_res=self._image_res[indices],
+            annotation_offsets=offsets,
+            annotation_category=self._annotation_category[annotations],
+            annotation_bbox=self._annotation_bbox[annotations],
+            annotation_contours=self._annotation_contours[annotations],
+            categories=self._categories,
+            licenses=self._licenses,
+            copyrights=self._copyrights,
+            )
+
+
+    @property
+    def annotation_bbox(self):
+        """Bounding box for each annotation.
+
+        Returns
+        -------
+        bbox: :class:`numpy.ndarray`
+            :math:`A \\times 4` array of (left, top, width, height) values, containing
+            NaN for annotations without a bounding box.
+        """
+        return self._annotation_bbox
+
+
+    @property
+    def annotation_category(self):
+        """Category for each annotation.
+
+        Returns
+        -------
+        category: :class:`numpy.ndarray`
+            Integer indices into :attr:`categories`.
+        """
+        return self._annotation_category
+
+
+    @property
+    def annotation_contours(self):
+        """Number of contours for each annotation.
+
+        Returns
+        -------
+        contours: :class:`numpy.ndarray`
+            Integer contour counts, containing -1 for annotations without contours.
+        """
+        return self._annotation_contours
+
+
+    @property
+    def annotation_offsets(self):
+        """Offsets of each sample's annotations.
+
+        Returns
+        -------
+        offsets: :class:`numpy.ndarray`
+            :math:`N + 1` integer offsets into the per-annotation arrays.
+        """
+        return self._annotation_offsets
+
+
+    @property
+    def annotation_sample(self):
+        """Sample index for each annotation.
+
+        Returns
+        -------
+        sample: :class:`numpy.ndarray`
+        """
+        return numpy.repeat(numpy.arange(len(self), dtype=numpy.int64), numpy.diff(self._annotation_offsets))
+
+
+    @property
+    def categories(self):
+        """Sorted table of annotation categories.
+
+        Returns
+        -------
+        categories: :class:`numpy.ndarray` of :class:`str`
+        """
+        return self._categories
+
+
+    @property
+    def copyright(self):
+        """Provenance copyright for each sample.
+
+        Returns
+        -------
+        copyright: :class:`numpy.ndarray`
+            Integer indices into :attr:`copyrights`, containing -1 for samples without provenance.
+        """
+        return self._copyright
+
+
+    @property
+    def copyrights(self):
+        """Sorted table of provenance copyrights.
+
+        Returns
+        -------
+        copyrights: :class:`numpy.ndarray` of :class:`str`
+        """
+        return self._copyrights
+
+
+    @property
+    def has_cryptomatte(self):
+        """Whether each sample has Cryptomatte data.
+
+        Returns
+        -------
+        has_cryptomatte: :class:`numpy.ndarray` of :class:`bool`
+        """
+        return self._has_cryptomatte
+
+
+    @property
+    def has_image(self):
+        """Whether each sample has a reference image.
+
+        Returns
+        -------
+        has_image: :class:`numpy.ndarray` of :class:`bool`
+        """
+        return self._has_image
+
+
+    @property
+    def has_provenance(self):
+        """Whether each sample has provenance metadata.
+
+        Returns
+        -------
+        has_provenance: :class:`numpy.ndarray` of :class:`bool`
+        """
+        return self._license >= 0
+
+
+    @property
+    def has_synthetic(self):
+        """Whether each sample has synthetic data.
+
+        Returns
+        -------
+        has_synthetic: :class:`numpy.ndarray` of :class:`bool`
+        """
+        return self._has_synthetic
+
+
+    @property
+    def image_res(self):
+        """Reference image resolution for each sample.
+
+        Returns
+        -------
+        res: :class:`numpy.ndarray`
+            :math:`N \\times 2` array of (width, height) values, containing -1 for
+            samples without a reference image.
         """
-        self._metadata.update(updates)
-        with open(self._path, "w") as stream:
-            json.dump(self._metadata, stream, indent=2, sort_keys=True)
+        return self._image_res
+
+
+    @property
+    def license(self):
+        """Provenance license for each sample.
+
+        Returns
+        -------
+        license: :class:`numpy.ndarray`
+            Integer indices into :attr:`licenses`, containing -1 for samples without provenance.
+        """
+        return self._license
+
+
+    @property
+    def licenses(self):
+        """Sorted table of provenance licenses.
+
+        Returns
+        -------
+        licenses: :class:`numpy.ndarray` of :class:`str`
+        """
+        return self._licenses
+
+
+def _invert(keys, samples, count, labels):
+    # Group unique (key, sample) pairs by key.
+    pairs = numpy.unique(keys.astype(numpy.int64) * count + samples)
+    keys, samples = numpy.divmod(pairs, count)
+    boundaries = numpy.flatnonzero(numpy.diff(keys)) + 1
+    return {labels[group_keys[0]]: group for group_keys, group in zip(numpy.split(keys, boundaries), numpy.split(samples, boundaries)) if len(group)}
+
+
+class InvertedIndex(object):
+    """Maps categories, licenses, and annotation types to sample indices.
+
+    Sample indices are sorted, and refer to the rows of the :any:`Catalog`
+    used to create the index.
+
+    There is no reason to create an instance of this class yourself, callers
+    should obtain instances from :meth:`Dataset.inverted_index`.
+
+    Parameters
+    ----------
+    catalog: :any:`Catalog`, required
+        Catalog containing the metadata to be indexed.
+    """
+    annotation_types = ["bbox", "contours", "tag"]
+
+    def __init__(self, catalog):
+        count = max(len(catalog), 1)
+        annotation_sample = catalog.annotation_sample
+        has_bbox = ~numpy.isnan(catalog.annotation_bbox[:,0])
+        has_contours = catalog.annotation_contours >= 0
+        annotation_type = numpy.where(has_contours, 1, numpy.where(has_bbox, 0, 2))
+
+        # Bounding boxes and contours may share an annotation, so index both.
+        both = has_bbox & has_contours
+        types = numpy.concatenate((annotation_type, numpy.zeros(numpy.count_nonzero(both), dtype=annotation_type.dtype)))
+        type_samples = numpy.concatenate((annotation_sample, annotation_sample[both]))
+        type_categories = numpy.concatenate((catalog.annotation_category, catalog.annotation_category[both]))
+
+        self._categories = _invert(catalog.annotation_category, annotation_sample, count, catalog.categories.tolist())
+        self._licenses = _invert(catalog.license[catalog.has_provenance], numpy.flatnonzero(catalog.has_provenance), count, catalog.licenses.tolist())
+        self._annotations = _invert(types, type_samples, count, self.annotation_types)
+
+        pair_labels = [(category, annotation) for category in catalog.categories.tolist() for annotation in self.annotation_types]
+        self._category_annotations = _invert(type_categories * len(self.annotation_types) + types, type_samples, count, pair_labels)
+
+
+    def __repr__(self):
+        return f"limbo.data.InvertedIndex(categories={len(self._categories)}, licenses={len(self._licenses)})"
+
+
+    @property
+    def annotations(self):
+        """Samples containing each type of annotation.
+
+        Returns
+        -------
+        annotations: :class:`dict`
+            Maps "bbox", "contours", and "tag" to :class:`numpy.ndarray` sample indices.
+        """
+        return self._annotations
+
+
+    @property
+    def categories(self):
+        """Samples containing each annotation category.
+
+        Returns
+        -------
+        categories: :class:`dict`
+            Maps categories to :class:`numpy.ndarray` sample indices.
+        """
+        return self._categories
+
+
+    @property
+    def licenses(self):
+        """Samples with each provenance license.
+
+        Returns
+        -------
+        licenses: :class:`dict`
+            Maps licenses to :class:`numpy.ndarray` sample indices.
+        """
+        return self._licenses
+
+
+    def query(self, category=None, license=None, annotation=None):
+        """Return the samples that match the given criteria.
+
+        See :meth:`Dataset.filter` for details.
+
+        Returns
+        -------
+        indices: :class:`numpy.ndarray`
+            Sorted sample indices.
+        """
+        def union(groups):
+            groups = list(groups)
+            if not groups:
+                return numpy.zeros(0, dtype=numpy.int64)
+            return numpy.unique(numpy.concatenate(groups))
+
+        def values(value):
+            return [value] if isinstance(value, str) else list(value)
+
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        for annotation_type in values(annotation) if annotation is not None else []:
+            if annotation_type not in self.annotation_types:
+                raise ValueError(f"Unknown annotation type: {annotation_type}")
+
+        criteria = []
+        if category is not None and annotation is not None:
+            criteria.append(union(self._category_annotations.get((c, a), empty) for c in values(category) for a in values(annotation)))
+        elif category is not None:
+            criteria.append(union(self._categories.get(c, empty) for c in values(category)))
+        elif annotation is not None:
+            criteria.append(union(self._annotations.get(a, empty) for a in values(annotation)))
+        if license is not None:
+            criteria.append(union(self._licenses.get(l, empty) for l in values(license)))
+
+        if not criteria:
+            raise ValueError("At least one criterion must be specified.")
+
+        result = criteria[0]
+        for criterion in criteria[1:]:
+            result = numpy.intersect1d(result, criterion, assume_unique=True)
+        return result
+
+
+# Cached indices and catalogs are stored in a hidden subdirectory of each
+# dataset root, so writing them doesn't change the root's modification time.
+_cache_directory = ".limbo"
+_catalog_filename = os.path.join(_cache_directory, "catalog.npz")
+_catalog_version = 1
+
+
+def _load_catalog(root):
+    # Returns a cached catalog for a dataset root, along with the paths,
+    # modification times, and sizes of its samples.
+    path = os.path.join(root, _catalog_filename)
+    try:
+        with numpy.load(path, allow_pickle=False) as arrays:
+            if int(arrays["version"]) != _catalog_version:
+                return None
+            catalog = Catalog(**{field: arrays[field] for field in Catalog._fields})
+            return catalog, [os.path.join(root, sample) for sample in arrays["paths"].tolist()], arrays["stats"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _save_catalog(root, catalog, paths, stats):
+    path = os.path.join(root, _catalog_filename)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    arrays = {field: getattr(catalog, "_" + field) for field in Catalog._fields}
+    arrays["paths"] = numpy.array([os.path.relpath(sample, root) for sample in paths], dtype=str)
+    arrays["stats"] = stats
+    arrays["version"] = numpy.array(_catalog_version)
+    try:
+        os.makedirs(os.path.join(root, _cache_directory), exist_ok=True)
+        with open(temp_path, "wb") as stream:
+            numpy.savez(stream, **arrays)
+        os.replace(temp_path, path)
+    except OSError as e:
+        log.warning(f"Couldn't save catalog {path}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _sample_filenames(metadata):
+    # Return the files referenced by a sample's metadata, relative to the sample.
+    filenames = []
+    if "image" in metadata:
+        filenames.append(metadata["image"]["filename"])
+    if "synthetic" in metadata:
+        filenames.append(metadata["synthetic"]["image"]["filename"])
+        if "cryptomatte" in metadata["synthetic"]:
+            filenames.append(metadata["synthetic"]["cryptomatte"]["filename"])
+    return filenames
+
+
+def _stat_sample(path):
+    # Samples within a shard use the shard's modification time and size.
+    shard = _split_shard_path(path)
+    if shard is not None:
+        path = shard[0]
+    try:
+        info = os.stat(path)
+        return (info.st_mtime_ns, info.st_size)
+    except OSError:
+        return (-1, -1)
+
+
+def _sample_catalog_row(sample):
+    return _catalog_row(sample.metadata)
+
+
+_map_function = None
+_map_with_indices = False
+_map_image_cache = None
+
+
+def _map_initialize(fn, with_indices, image_cache):
+    global _map_function, _map_with_indices, _map_image_cache
+    _map_function = fn
+    _map_with_indices = with_indices
+    _map_image_cache = image_cache
+
+
+def _map_sample(task):
+    # Process one sample in a worker process, using the worker's globals.
+    return _process_sample(_map_function, _map_with_indices, _map_image_cache, task)
+
+
+def _process_sample(fn, with_indices, image_cache, task):
+    # Process one sample, returning errors instead of raising them, so a
+    # single bad sample doesn't end the run.
+    index, path = task
+    try:
+        sample = Sample(path, image_cache=image_cache)
+        if with_indices:
+            return index, path, None, fn(index, sample)
+        return index, path, None, fn(sample)
+    except Exception as e:
+        return index, path, f"{type(e).__name__}: {e}", None
+
+
+def _map_samples(paths, fn, processes, chunksize, ordered, with_indices, image_cache=None):
+    """Yield (index, path, error, result) for each sample path."""
+    tasks = enumerate(paths)
+    if processes == 1:
+        # Bind the function locally instead of using the worker globals, so
+        # fn can map other samples itself.
+        process = functools.partial(_process_sample, fn, with_indices, image_cache)
+        for task in tasks:
+            yield process(task)
+        return
+
+    pool = multiprocessing.Pool(processes, initializer=_map_initialize, initargs=(fn, with_indices, image_cache))
+    try:
+        if ordered:
+            results = pool.imap(_map_sample, tasks, chunksize)
+        else:
+            results = pool.imap_unordered(_map_sample, tasks, chunksize)
+        for result in results:
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _prefetch_sample(path, load, image_cache):
+    # Create a sample and decode the given images, so they're cached by the sample graph.
+    sample = Sample(path, image_cache=image_cache)
+    synthetic = sample.synthetic
+    cryptomatte = synthetic.cryptomatte if synthetic else None
+
+    if "image" in load:
+        sample.image
+    if "synthetic" in load and synthetic:
+        synthetic.image
+    if "depth" in load and synthetic:
+        synthetic.depth
+    if "cryptomatte" in load and cryptomatte:
+        cryptomatte.image
+    return sample
+
+
+_index_filename = os.path.join(_cache_directory, "index.json")
+_index_version = 1
+
+
+def _scan_shard(path, prefix, stat):
+    # Return the sample metadata files in a shard, which share the shard's modification time and size.
+    try:
+        info = os.stat(path)
+        members = _cached_shard_index(path, info.st_mtime_ns, info.st_size)
+    except (OSError, ValueError, KeyError, AttributeError) as e:
+        log.warning(f"Couldn't read shard {path}: {e}")
+        return {}
+    value = [info.st_mtime_ns, info.st_size] if stat else None
+    return {prefix + member: value for member in members if member.endswith(".json")}
+
+
+def _scan_directory(path, stat):
+    # Return the subdirectories and sample metadata files in a single directory,
+    # using the same rules as glob("**/*.json") - hidden entries are ignored.
+    # The contents of shards are treated as samples within the directory.
+    # Sample modification times and sizes are only as fresh as the last scan,
+    # since editing a file in-place doesn't change its directory.
+    if path.endswith(_shard_extension + os.sep) and os.path.isfile(path[:-1]):
+        return [], _scan_shard(path[:-1], "", stat)
+
+    subdirectories = []
+    samples = {}
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    subdirectories.append(entry.name)
+                elif entry.name.endswith(_shard_extension):
+                    samples.update(_scan_shard(entry.path, entry.name + "/", stat))
+                elif entry.name.endswith(".json"):
+                    samples[entry.name] = None
+                    if stat:
+                        try:
+                            info = entry.stat()
+                            samples[entry.name] = [info.st_mtime_ns, info.st_size]
+                        except OSError:
+                            pass
+    except OSError:
+        pass
+    return sorted(subdirectories), samples
+
+
+def _load_index(root):
+    # Create the cache directory before the root is scanned, so the root's
+    # recorded modification time already includes it.
+    if os.path.isdir(root):
+        try:
+            os.makedirs(os.path.join(root, _cache_directory), exist_ok=True)
+        except OSError:
+            pass
+
+    path = os.path.join(root, _index_filename)
+    try:
+        with open(path, "rb") as stream:
+            index = _json_loads(stream.read())
+        if index.get("version") != _index_version:
+            return {}
+        return index["directories"]
+    except (OSError, ValueError, KeyError, AttributeError):
+        return {}
+
+
+def _save_index(root, directories):
+    path = os.path.join(root, _index_filename)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.join(root, _cache_directory), exist_ok=True)
+        with open(temp_path, "wb") as stream:
+            stream.write(_json_dumps({"version": _index_version, "directories": directories}))
+        os.replace(temp_path, path)
+    except OSError as e:
+        log.warning(f"Couldn't save sample index {path}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _visit_directory(path, cached, index):
+    # A shard used as a dataset root isn't a directory, so it's always read from its own index.
+    if path.endswith(_shard_extension + os.sep) and os.path.isfile(path[:-1]):
+        subdirectories, samples = _scan_directory(path, stat=index)
+        return {"mtime": None, "subdirectories": subdirectories, "samples": samples}
+
+    # When using an index, only rescan directories whose modification time has changed.
+    mtime = None
+    if index:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError as e:
+            log.warning(f"Couldn't read directory {path}: {e}")
+            return None
+        if cached is not None and cached.get("mtime") == mtime:
+            return cached
+
+    subdirectories, samples = _scan_directory(path, stat=index)
+    return {"mtime": mtime, "subdirectories": subdirectories, "samples": samples}
+
+
+def _discover_samples(roots, index, threads):
+    """Return sample paths for one-or-more dataset roots.
+
+    Directories are visited concurrently using a pool of threads, since
+    per-directory latency dominates on network storage.
+    """
+    previous = [_load_index(root) if index else {} for root in roots]
+    results = [{} for root in roots]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = {}
+
+        def submit(root_index, relative):
+            path = os.path.join(roots[root_index], relative)
+            future = executor.submit(_visit_directory, path, previous[root_index].get(relative), index)
+            pending[future] = (root_index, relative)
+
+        for root_index in range(len(roots)):
+            submit(root_index, "")
+
+        while pending:
+            done, not_done = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                root_index, relative = pending.pop(future)
+                directory = future.result()
+                if directory is None:
+                    continue
+                results[root_index][relative] = directory
+                for name in directory["subdirectories"]:
+                    submit(root_index, os.path.join(relative, name))
+
+    if index:
+        for root, directories, refreshed in zip(roots, previous, results):
+            if refreshed != directories and os.path.isdir(root):
+                _save_index(root, refreshed)
+
+    samples = []
+    for root, directories in zip(roots, results):
+        for relative, directory in directories.items():
+            samples += [os.path.join(root, relative, name) for name in directory["samples"]]
+    return sorted(samples)
 
 
 class Dataset(object):
@@ -812,48 +3022,388 @@ class Dataset(object):
 
     Use ``len(dataset)`` to retrieve the number of samples in the dataset.
 
-    Use ``dataset[index]`` to retrieve the :any:`Sample` at the given integer index.
+    Use ``dataset[index]`` to retrieve the :any:`Sample` at the given integer
+    index.  Slices, integer arrays, and boolean masks return views of the
+    dataset instead, which don't read any files until their samples are
+    accessed.
 
     Use ``for sample in dataset:`` to iterate over :any:`samples<Sample>`.
 
+    Use :meth:`filter` or :meth:`subset` to create views containing samples
+    that match metadata criteria or arbitrary indices.
+
     Parameters
     ----------
     paths: :class:`str` or :class:`list` of :class:`str`, required
         Paths to one-or-more directories containing data in
         :ref:`specification`.  The resulting dataset object can be used to
-        access the union of the data from the given paths.
-
+        access the union of the data from the given paths.  Shards created
+        by :any:`ShardWriter` are opened transparently, whether they are
+        listed explicitly or found within the directories.
+    index: :class:`bool`, optional
+        If :any:`True`, sample discovery uses a persistent index stored in
+        a hidden ".limbo" directory within each of the given directories,
+        recording every sample path along with its modification time and
+        size.  Only directories whose modification time has changed since
+        the index was written are rescanned, and the index is updated
+        in-place.  The resulting samples are identical to those discovered
+        without an index.  Note that editing a sample in-place doesn't change
+        its directory's modification time, so the recorded modification
+        times and sizes are only as fresh as the last rescan of each
+        directory; use :any:`Sample.stat` to detect changed samples.
+    threads: :class:`int`, optional
+        Maximum number of threads used to scan directories during sample
+        discovery.  Default: :any:`None`, which uses the
+        :class:`concurrent.futures.ThreadPoolExecutor` default.
+    image_cache: :any:`ImageCache`, optional
+        If specified, samples store decoded images in and load them from the
+        given cache.
     """
-    def __init__(self, paths):
+    def __init__(self, paths, index=False, threads=None, image_cache=None):
         if isinstance(paths, str):
             paths = [paths]
         paths = [os.path.abspath(path) for path in paths]
 
-        samples = []
-        for path in paths:
-            samples += glob.glob(os.path.join(path, "**/*.json"), recursive=True)
-
         self._paths = paths
-        self._samples = sorted(samples)
+        self._samples = _discover_samples(paths, index=index, threads=threads)
+        self._threads = threads
+        self._image_cache = image_cache
+        self._indices = None
+        self._catalog = None
+        self._inverted_index = None
 
 
     def __len__(self):
-        return len(self._samples)
+        if self._indices is None:
+            return len(self._samples)
+        return len(self._indices)
 
 
     def __getitem__(self, index):
-        return Sample(self._samples[index])
+        if isinstance(index, (int, numpy.integer)):
+            return Sample(self._sample_path(index), image_cache=self._image_cache)
+        if isinstance(index, slice):
+            if self._indices is None:
+                return self._view(range(len(self._samples))[index])
+            return self._view(self._indices[index])
+        return self.subset(index)
 
 
     def __iter__(self):
         for index in range(len(self)):
-            yield Sample(self._samples[index])
+            yield Sample(self._sample_path(index), image_cache=self._image_cache)
 
 
     def __repr__(self):
         return f"limbo.data.Dataset(paths={self._paths!r})"
 
 
+    def catalog(self, cache=False, processes=1):
+        """Return a columnar summary of the metadata for every sample.
+
+        The catalog is computed once and reused by subsequent calls.
+
+        Parameters
+        ----------
+        cache: :class:`bool`, optional
+            If :any:`True`, the catalog for each dataset directory is cached
+            in a ``.npz`` file within the directory.  Cached metadata is reused
+            for samples whose modification time and size haven't changed, so
+            only new and modified samples are read.
+        processes: :class:`int`, optional
+            Number of processes used to read sample metadata, see :meth:`map`.
+
+        Returns
+        -------
+        catalog: :any:`Catalog`
+        """
+        if self._catalog is None:
+            self._catalog = self._load_catalog(cache, processes)
+        if self._indices is None:
+            return self._catalog
+        return self._catalog.take(self._indices)
+
+
+    def filter(self, category=None, license=None, annotation=None, cache=False):
+        """Return a view containing the samples that match the given criteria.
+
+        Each criterion may be a single value or a list of values, in which
+        case samples matching any of the values are returned.  Samples must
+        match every criterion that is specified.  If both ``category`` and
+        ``annotation`` are specified, samples must contain an annotation that
+        matches both, e.g. a bounding box with the given category.
+
+        Parameters
+        ----------
+        category: :class:`str` or :class:`list` of :class:`str`, optional
+            Annotation categories to match.
+        license: :class:`str` or :class:`list` of :class:`str`, optional
+            Provenance licenses to match.
+        annotation: :class:`str` or :class:`list` of :class:`str`, optional
+            Annotation types to match, any of "bbox", "contours", or "tag".
+        cache: :class:`bool`, optional
+            Passed to :meth:`catalog`.
+
+        Returns
+        -------
+        dataset: :any:`Dataset`
+            A view of the matching samples, in their original order.
+        """
+        indices = self.inverted_index(cache=cache).query(category=category, license=license, annotation=annotation)
+        return self.subset(indices)
+
+
+    def inverted_index(self, cache=False):
+        """Return an index from metadata values to samples.
+
+        The index is computed once from :meth:`catalog` and reused by
+        subsequent calls.
+
+        Parameters
+        ----------
+        cache: :class:`bool`, optional
+            Passed to :meth:`catalog`.
+
+        Returns
+        -------
+        index: :any:`InvertedIndex`
+        """
+        if self._inverted_index is None:
+            self._inverted_index = InvertedIndex(self.catalog(cache=cache))
+        return self._inverted_index
+
+
+    def iter(self, prefetch=8, workers=4, load=()):
+        """Iterate over samples, loading them in the background.
+
+        Samples are created and their images decoded by a pool of threads,
+        ahead of the caller.  Samples are yielded in order, and at most
+        ``prefetch`` samples are loaded ahead of the caller at any time.
+
+        Parameters
+        ----------
+        prefetch: :class:`int`, optional
+            Maximum number of samples to load ahead of the caller.
+        workers: :class:`int`, optional
+            Number of threads used to load samples.
+        load: :class:`str` or sequence of :class:`str`, optional
+            Images to be decoded in the background for each sample, any of
+            "image" (:attr:`Sample.image`), "synthetic"
+            (:attr:`Synthetic.image`), "depth" (:attr:`Synthetic.depth`), or
+            "cryptomatte" (:attr:`Cryptomatte.image`).  Images that a sample
+            doesn't have are ignored.
+
+        Yields
+        ------
+        sample: :any:`Sample`
+        """
+        if isinstance(load, str):
+            load = [load]
+        for name in load:
+            if name not in ["image", "synthetic", "depth", "cryptomatte"]:
+                raise ValueError(f"Unknown image: {name}")
+
+        indices = iter(range(len(self)))
+        pending = collections.deque()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        try:
+            for index in itertools.islice(indices, max(prefetch, 1)):
+                pending.append(executor.submit(_prefetch_sample, self._sample_path(index), load, self._image_cache))
+            while pending:
+                sample = pending.popleft().result()
+                for index in itertools.islice(indices, 1):
+                    pending.append(executor.submit(_prefetch_sample, self._sample_path(index), load, self._image_cache))
+                yield sample
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+    def map(self, fn, processes=None, chunksize=1, ordered=True, with_indices=False, progress=True, errors="log", failures=None):
+        """Apply a function to every sample using a pool of processes.
+
+        Only sample paths are sent to the worker processes, which create their
+        own :any:`Sample` objects.  Results are yielded as they become
+        available.  By default, if ``fn`` raises an exception for a sample,
+        the error is logged and processing continues with the remaining
+        samples; no result is yielded for the failed sample.  Use
+        ``failures`` to find out which samples failed, or ``errors="raise"``
+        to stop at the first failure.
+
+        Parameters
+        ----------
+        fn: callable, required
+            Function to be called as ``fn(sample)``, or ``fn(index, sample)``
+            if ``with_indices`` is :any:`True`.  Since ``fn`` is sent to the
+            worker processes, it must be picklable, e.g. a module-level
+            function or a :func:`functools.partial` wrapping one.
+        processes: :class:`int`, optional
+            Number of worker processes.  Default: :any:`None`, which uses one
+            process per CPU.  If 1, samples are processed serially, in the
+            calling process.
+        chunksize: :class:`int`, optional
+            Number of samples sent to a worker process at a time.
+        ordered: :class:`bool`, optional
+            If :any:`True` (the default), results are yielded in sample order.
+            Otherwise, they are yielded as soon as they are ready.
+        with_indices: :class:`bool`, optional
+            If :any:`True`, pass the sample's index within this dataset to ``fn``.
+        progress: :class:`bool`, optional
+            If :any:`True` (the default), display a progress bar.
+        errors: :class:`str`, optional
+            If "log" (the default), failures are logged and skipped.  If
+            "raise", a :class:`RuntimeError` is raised for the first failure.
+        failures: :class:`list`, optional
+            If specified, an (index, path, message) tuple is appended to the
+            list for each sample that fails.
+
+        Yields
+        ------
+        result: object
+            The return value of ``fn`` for each sample that didn't fail.
+        """
+        if errors not in ["log", "raise"]:
+            raise ValueError(f"Unknown errors value: {errors}")
+
+        paths = (self._sample_path(index) for index in range(len(self)))
+        results = _map_samples(paths, fn, processes=processes, chunksize=chunksize, ordered=ordered, with_indices=with_indices, image_cache=self._image_cache)
+
+        count = 0
+        for index, path, error, result in tqdm.tqdm(results, total=len(self), desc="Samples", unit="sample", disable=not progress):
+            if error is not None:
+                if errors == "raise":
+                    raise RuntimeError(f"Failed to process {path}: {error}")
+                log.error(f"Failed to process {path}: {error}")
+                if failures is not None:
+                    failures.append((index, path, error))
+                count += 1
+                continue
+            yield result
+
+        if count:
+            log.warning(f"Failed to process {count} of {len(self)} samples.")
+
+
+    def subset(self, indices):
+        """Return a view containing a subset of this dataset's samples.
+
+        The view shares the list of sample paths with this dataset, so no
+        copies are made and no files are read.
+
+        Parameters
+        ----------
+        indices: sequence of :class:`int` or :class:`bool`, required
+            Indices of the samples to include in the view, in order, or a
+            boolean mask with one value per sample.
+
+        Returns
+        -------
+        dataset: :any:`Dataset`
+        """
+        indices = numpy.asarray(indices).reshape(-1)
+        if indices.dtype == bool:
+            if len(indices) != len(self):
+                raise IndexError(f"Boolean mask with {len(indices)} values can't index {len(self)} samples.")
+            indices = numpy.flatnonzero(indices)
+        indices = indices.astype(numpy.int64)
+
+        if len(indices) and (indices.min() < -len(self) or indices.max() >= len(self)):
+            raise IndexError("Sample index out of range.")
+        indices = numpy.where(indices < 0, indices + len(self), indices)
+
+        if isinstance(self._indices, range):
+            indices = self._indices.start + indices * self._indices.step
+        elif self._indices is not None:
+            indices = self._indices[indices]
+        return self._view(indices)
+
+
+    def _view(self, indices):
+        view = Dataset.__new__(Dataset)
+        view._paths = self._paths
+        view._samples = self._samples
+        view._threads = self._threads
+        view._image_cache = self._image_cache
+        view._indices = indices
+        view._catalog = self._catalog
+        view._inverted_index = None
+        return view
+
+
+    def _sample_path(self, index):
+        if self._indices is None:
+            return self._samples[index]
+        return self._samples[self._indices[index]]
+
+
+    def _load_catalog(self, cache, processes):
+
+        # Assign each sample to the first dataset directory that contains it.
+        root_samples = collections.defaultdict(dict)
+        for sample in self._samples:
+            for root in self._paths:
+                if sample.startswith(os.path.join(root, "")):
+                    root_samples[root][sample] = None
+                    break
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._threads) as executor:
+            stats = dict(zip(self._samples, executor.map(_stat_sample, self._samples)))
+
+        # Reuse cached metadata for samples that haven't changed.
+        roots = []
+        modified_samples = []
+        for root, samples in root_samples.items():
+            samples = list(samples)
+            root_stats = numpy.array([stats[sample] for sample in samples], dtype=numpy.int64).reshape((-1, 2))
+
+            cached_indices = []
+            cached_samples = []
+            root_modified_samples = []
+            cached = _load_catalog(root) if cache else None
+            if cached is not None:
+                cached_rows = {path: index for index, path in enumerate(cached[1])}
+                for sample, stat in zip(samples, root_stats):
+                    index = cached_rows.get(sample)
+                    if index is not None and numpy.array_equal(cached[2][index], stat):
+                        cached_indices.append(index)
+                        cached_samples.append(sample)
+                    else:
+                        root_modified_samples.append(sample)
+            else:
+                root_modified_samples = samples
+
+            roots.append((root, samples, root_stats, cached, cached_indices, cached_samples, root_modified_samples))
+            modified_samples += root_modified_samples
+
+        # Read the metadata for new and modified samples.
+        modified_rows = [None] * len(modified_samples)
+        results = _map_samples(modified_samples, _sample_catalog_row, processes=processes, chunksize=64, ordered=False, with_indices=False) if modified_samples else []
+        for index, path, error, row in results:
+            if error is not None:
+                raise RuntimeError(f"Couldn't read metadata from {path}: {error}")
+            modified_rows[index] = row
+
+        catalogs = []
+        rows = {}
+        offset = 0
+        for root, samples, root_stats, cached, cached_indices, cached_samples, root_modified_samples in roots:
+            parts = [Catalog._from_rows(modified_rows[offset:offset + len(root_modified_samples)])]
+            offset += len(root_modified_samples)
+            if cached_indices:
+                parts.insert(0, cached[0].take(cached_indices))
+            catalog = Catalog.concatenate(parts)
+
+            order = {sample: index for index, sample in enumerate(cached_samples + root_modified_samples)}
+            catalog = catalog.take([order[sample] for sample in samples])
+            if cache and os.path.isdir(root) and (root_modified_samples or cached is None or len(cached[1]) != len(samples)):
+                _save_catalog(root, catalog, samples, root_stats)
+
+            row_offset = len(rows)
+            rows.update({sample: row_offset + index for index, sample in enumerate(samples)})
+            catalogs.append(catalog)
+
+        return Catalog.concatenate(catalogs).take([rows[sample] for sample in self._samples])
+
+
     @property
     def paths(self):
         """Paths used to initialize the dataset.
@@ -864,3 +3414,264 @@ class Dataset(object):
             Absolute paths used to initialize this object.
         """
         return self._paths
+
+
+def _columnar_annotations(columns, index):
+    # Reassemble one sample's metadata from columnar limbo-compress output.
+    metadata = {}
+    provenance = {}
+    for field, table in [("license", "licenses"), ("license-uri", "license-uris"), ("copyright", "copyrights"), ("uri", "uris")]:
+        value = int(columns[field][index])
+        if value >= 0:
+            provenance[field] = str(columns[table][value])
+    if provenance:
+        metadata["provenance"] = provenance
+
+    annotations = []
+    for annotation in range(columns["annotation-offsets"][index], columns["annotation-offsets"][index + 1]):
+        result = {"category": str(columns["categories"][columns["annotation-category"][annotation]])}
+        bbox = columns["annotation-bbox"][annotation]
+        if not numpy.isnan(bbox).any():
+            result["bbox"] = bbox.astype(numpy.int64).tolist() if columns["annotation-bbox-integer"][annotation] else bbox.tolist()
+        mode = int(columns["annotation-bbox-mode"][annotation])
+        if mode >= 0:
+            result["bbox_mode"] = str(columns["bbox-modes"][mode])
+        contours = range(columns["contour-offsets"][annotation], columns["contour-offsets"][annotation + 1])
+        if len(contours):
+            result["contours"] = [columns["vertices"][columns["vertex-offsets"][contour]:columns["vertex-offsets"][contour + 1]].tolist() for contour in contours]
+        mode = int(columns["annotation-contour-mode"][annotation])
+        if mode >= 0:
+            result["contour_mode"] = str(columns["contour-modes"][mode])
+        annotations.append(result)
+    metadata["annotations"] = annotations
+    return metadata
+
+
+class CompressedDataset(object):
+    """Provides access to the output of :ref:`limbo-compress`.
+
+    Images and masks are memory mapped rather than loaded, so only the
+    samples that are accessed are read from disk, and processes that open
+    the same outputs share them through the operating system's page cache.
+    Metadata is loaded the first time it is accessed.
+
+    Use ``len(dataset)`` to retrieve the number of samples.
+
+    Use ``dataset[index]`` to retrieve a :class:`dict` containing the
+    "images" and "masks-<name>" (or stacked "masks") arrays for the sample
+    at the given index, plus its "metadata" if it was compressed.  Slices
+    and integer arrays return a :class:`dict` containing arrays of samples
+    instead, with a :class:`list` of metadata.  Arrays retrieved with an
+    integer or slice are read-only views of the memory mapped outputs.
+
+    Only outputs written with the default ``--format npy`` can be read.
+    Outputs written with ``--format shards`` are listed in the
+    ``{prefix}-manifest.json`` file, and can be read with :func:`numpy.load`.
+    Masks written with ``--mask-dtype bit`` are returned packed, use
+    :func:`numpy.unpackbits` with ``axis=2`` to expand them.
+
+    Parameters
+    ----------
+    prefix: :class:`str`, required
+        Output prefix that was passed to :ref:`limbo-compress`.
+    """
+    def __init__(self, prefix):
+        self._prefix = prefix
+        self._metadata = None
+        self._columns = None
+
+        if os.path.exists(f"{prefix}-manifest.json"):
+            raise ValueError(f"Can't read shards output from {prefix}, use the shards listed in {prefix}-manifest.json.")
+
+        # Use the compress options to list masks in --mask order.
+        options = {}
+        if os.path.exists(f"{prefix}-manifest.jsonl"):
+            with open(f"{prefix}-manifest.jsonl", "rb") as stream:
+                options = json.loads(stream.readline()).get("options", {})
+
+        names = ["images"]
+        if "mask" in options:
+            names += ["masks"] + [f"masks-{name}" for name in options["mask"][0::2]]
+        else:
+            names += ["masks"] + sorted(os.path.basename(path)[len(os.path.basename(prefix)) + 1:-4] for path in glob.glob(f"{glob.escape(prefix)}-masks-*.npy"))
+
+        self._arrays = {}
+        for name in names:
+            if os.path.exists(f"{prefix}-{name}.npy"):
+                self._arrays[name] = numpy.load(f"{prefix}-{name}.npy", mmap_mode="r")
+
+        if os.path.exists(f"{prefix}-metadata.pickle"):
+            self._metadata_format = "pickle"
+        elif os.path.exists(f"{prefix}-metadata-annotation-offsets.npy"):
+            self._metadata_format = "columnar"
+        else:
+            self._metadata_format = None
+
+        if self._arrays:
+            self._length = len(next(iter(self._arrays.values())))
+        elif self._metadata_format == "columnar":
+            self._length = len(self.columns["annotation-offsets"]) - 1
+        elif self._metadata_format == "pickle":
+            self._length = len(self._load_metadata())
+        else:
+            raise ValueError(f"No limbo-compress output found with prefix {prefix}.")
+
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, numpy.integer)):
+            if index < -self._length or index >= self._length:
+                raise IndexError("Sample index out of range.")
+            index = int(index) % self._length
+            result = {name: array[index] for name, array in self._arrays.items()}
+            if self._metadata_format is not None:
+                result["metadata"] = self.metadata(index)
+            return result
+
+        if isinstance(index, slice):
+            indices = range(self._length)[index]
+            result = {name: array[index] for name, array in self._arrays.items()}
+        else:
+            indices = numpy.asarray(index).reshape(-1)
+            if indices.dtype == bool:
+                if len(indices) != self._length:
+                    raise IndexError(f"Boolean mask with {len(indices)} values can't index {self._length} samples.")
+                indices = numpy.flatnonzero(indices)
+            elif not len(indices):
+                # An empty list becomes a float64 array, which can't be used as an index.
+                indices = numpy.empty(0, dtype=numpy.intp)
+            result = {name: array[indices] for name, array in self._arrays.items()}
+        if self._metadata_format is not None:
+            result["metadata"] = [self.metadata(int(i)) for i in indices]
+        return result
+
+
+    def __len__(self):
+        return self._length
+
+
+    def __repr__(self):
+        return f"limbo.data.CompressedDataset(prefix={self._prefix!r})"
+
+
+    @property
+    def arrays(self):
+        """Memory mapped image and mask arrays.
+
+        Returns
+        -------
+        arrays: :class:`dict` of :class:`numpy.ndarray`
+            Read-only arrays with one row per sample, indexed by output name.
+        """
+        return self._arrays
+
+
+    def batches(self, batch_size, shuffle=False, seed=None, drop_last=False):
+        """Iterate over batches of samples.
+
+        Each batch is gathered into buffers that are allocated once and reused
+        for every batch, so the arrays in a batch are overwritten by the
+        next one: copy them if they need to be kept.
+
+        Parameters
+        ----------
+        batch_size: :class:`int`, required
+            Number of samples in each batch.
+        shuffle: :class:`bool`, optional
+            If :any:`True`, samples are returned in random order.  Within a
+            batch, samples are read in storage order to minimize seeking.
+        seed: :class:`int`, optional
+            Random seed used when ``shuffle`` is :any:`True`.
+        drop_last: :class:`bool`, optional
+            If :any:`True`, a final batch with fewer than ``batch_size``
+            samples is skipped.
+
+        Yields
+        ------
+        batch: :class:`dict`
+            "indices" contains the sample indices in the batch, along with one
+            array per output, and a "metadata" :class:`list` if metadata was
+            compressed.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1.")
+
+        order = numpy.arange(self._length)
+        if shuffle:
+            order = numpy.random.default_rng(seed).permutation(self._length)
+
+        buffers = {name: numpy.empty((batch_size,) + array.shape[1:], dtype=array.dtype) for name, array in self._arrays.items()}
+        for start in range(0, self._length, batch_size):
+            indices = order[start:start + batch_size]
+            if drop_last and len(indices) < batch_size:
+                break
+            if shuffle:
+                indices = numpy.sort(indices)
+
+            # The indices are always in range, and mode="clip" lets take() write
+            # directly into the buffers instead of a temporary array.
+            batch = {"indices": indices}
+            for name, array in self._arrays.items():
+                batch[name] = numpy.take(array, indices, axis=0, out=buffers[name][:len(indices)], mode="clip")
+            if self._metadata_format is not None:
+                batch["metadata"] = [self.metadata(int(index)) for index in indices]
+            yield batch
+
+
+    @property
+    def columns(self):
+        """Memory mapped columnar metadata, if it was compressed with ``--metadata-format columnar``.
+
+        Returns
+        -------
+        columns: :class:`dict` of :class:`numpy.ndarray` or :any:`None`
+            Read-only arrays indexed by name, see :ref:`limbo-compress`.
+        """
+        if self._metadata_format != "columnar":
+            return None
+        if self._columns is None:
+            start = len(os.path.basename(self._prefix)) + len("-metadata-")
+            paths = glob.glob(f"{glob.escape(self._prefix)}-metadata-*.npy")
+            self._columns = {os.path.basename(path)[start:-4]: numpy.load(path, mmap_mode="r") for path in paths}
+        return self._columns
+
+
+    def metadata(self, index):
+        """Metadata for one sample.
+
+        Columnar metadata is reassembled into the same structure as the
+        sample's original metadata, containing just the annotations and
+        provenance.
+
+        Parameters
+        ----------
+        index: :class:`int`, required
+            Sample index.
+
+        Returns
+        -------
+        metadata: :class:`dict` or :any:`None`
+            The sample metadata, or :any:`None` if metadata wasn't compressed.
+        """
+        if self._metadata_format == "pickle":
+            return self._load_metadata()[index]
+        if self._metadata_format == "columnar":
+            return _columnar_annotations(self.columns, index)
+        return None
+
+
+    @property
+    def prefix(self):
+        """Output prefix used to open the dataset.
+
+        Returns
+        -------
+        prefix: :class:`str`
+        """
+        return self._prefix
+
+
+    def _load_metadata(self):
+        if self._metadata is None:
+            with open(f"{self._prefix}-metadata.pickle", "rb") as stream:
+                self._metadata = pickle.load(stream)
+        return self._metadata